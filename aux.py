@@ -16,14 +16,24 @@ import time
 import re
 import uuid
 import csv
-from datetime import datetime, timedelta
+import zlib
+import hashlib
+import tracemalloc
+from collections import deque
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sys
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timedelta, timezone
 from json import JSONEncoder, loads, dump, dumps
 
 import pandas as pd
 import numpy as np
 from numpy import random
-from stumpy import mass
-from thefuzz import fuzz
+from rapidfuzz.fuzz import ratio as rf_ratio
+from rapidfuzz.process import cdist
 
 from typing import Any, List, Dict, Tuple
 from colorama import Fore, Style
@@ -31,9 +41,30 @@ from builtins import print as prnt
 from joblib import Parallel, delayed
 from benedict import benedict
 
-from threading import Thread
+from threading import Thread, Lock, RLock, Condition, Event, local, current_thread
+from queue import Queue, Full, Empty
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
 from paho.mqtt import client as mqtt_client
 from typedb.client import TypeDB, SessionType, TransactionType
+
+# Faster JSON decoding when orjson is installed
+try :
+    from orjson import loads as fast_loads
+except ImportError :
+    fast_loads = loads
+
+# Compact binary wire formats (optional)
+try :
+    import msgpack
+except ImportError :
+    msgpack = None
+try :
+    import cbor2
+except ImportError :
+    cbor2 = None
 # ---------------------------------------------------------------------------
 
 ###########################
@@ -49,33 +80,118 @@ kb_addr     =   '0.0.0.0:80'
 kb_name     =   'iotdt'
 broker_addr =   '0.0.0.0' # broker_addr = 'mosquitto'
 broker_port =   8883
+metrics_port =  9464 # Prometheus scrape endpoint of the agent
+transport   =   'mqtt' # messages transport: 'mqtt' (paho clients through the broker) or 'local' (in-process bus)
 
 # Other variables
 arrow_str       =   '     |------> '
 arrow_str2      =   '     |          |---> '
 sdf_cols = ['thing','thing_desc','obj','obj_desc','prop','prop_desc','prop_type','prop_unit']
+msg_header_keys = ['category','class','topic','uuid','timestamp']
 
 #########################
 ######## CLASSES ########
 #########################
 
+# Wall clock read by the data generators, ground truths and message headers
+class Clock() :
+    """
+    A class that gives the time to the simulated devices. This one follows the wall clock.
+
+    Attributes:
+        virtual (bool): False, the time goes on by itself.
+
+    Methods:
+        time() -> float: Returns the current time in seconds (as time.perf_counter).
+        utcnow() -> datetime: Returns the current UTC date and time.
+        sleep(seconds: float) -> None: Waits for a number of seconds.
+    """
+    virtual = False
+
+    # Current time
+    def time(self) -> float :
+        return time.perf_counter()
+
+    # Current UTC date and time
+    def utcnow(self) -> datetime :
+        return datetime.utcnow()
+
+    # Wait
+    def sleep(self, seconds: float) -> None :
+        time.sleep(seconds)
+
+# Deterministic clock for faster-than-real-time simulations
+class VirtualClock(Clock) :
+    """
+    A clock that only moves when it is advanced, so that a single scheduler (see simulator.py) can
+    run a simulation as fast as it is able to generate messages. Sleeping advances the clock, so it
+    must not be shared by several threads that sleep independently.
+
+    Attributes:
+        start (datetime): The UTC date and time at the virtual time 0.
+        t (float): The current virtual time in seconds.
+
+    Methods:
+        time() -> float: Returns the current virtual time in seconds.
+        utcnow() -> datetime: Returns the current virtual UTC date and time.
+        advance(seconds: float) -> None: Moves the clock forward a number of seconds.
+        advance_to(t: float) -> None: Moves the clock forward to a virtual time (never backwards).
+        sleep(seconds: float) -> None: Same as advance.
+    """
+    virtual = True
+
+    # Initialization
+    def __init__(self, start: datetime = None, t: float = 0.0):
+        self.start = datetime.utcnow() if start is None else start
+        self.t = t
+
+    # Current virtual time
+    def time(self) -> float :
+        return self.t
+
+    # Current virtual UTC date and time
+    def utcnow(self) -> datetime :
+        return self.start + timedelta(seconds=self.t)
+
+    # Move forward
+    def advance(self, seconds: float) -> None :
+        self.t += max(0.0, seconds)
+
+    # Move forward to a virtual time
+    def advance_to(self, t: float) -> None :
+        self.t = max(self.t, t)
+
+    # Sleeping only moves the clock
+    def sleep(self, seconds: float) -> None :
+        self.advance(seconds)
+
+# Clock of the simulated devices (see get_clock / set_clock)
+sim_clock = Clock()
+
 # Class providing ground truth for ambient variables such as temperature, pressure...
 class GroundTruth(Thread) :
     """
-    A class that provides ground truth values for ambient variables such as temperature, pressure, etc. It is a subclass of the Thread class and updates the ground truth values every 100 milliseconds.
+    A class that provides ground truth values for ambient variables such as temperature, pressure, etc. It is a subclass of the Thread class and updates the ground truth values every 100 milliseconds
+    of the simulation clock. The values also catch up with the clock when they are read, so the thread is optional (and must not be started with a virtual clock).
 
     Attributes:
         ground_truth_vars (dict): a dictionary containing the names and initial values of the ambient variables.
+        step (float): the time in seconds between updates.
+        t (float): the clock time of the last update.
 
     Methods:
         update_ground_truth_vars(self) -> None: updates the ground truth values.
+        sync(self) -> None: applies the updates due since the last one, according to the simulation clock.
         get(self, var: str) -> float: returns the current value of the specified variable.
         run(self) -> None: the method called when the thread is started. It updates the ground truth values and sleeps for 100 milliseconds repeatedly.
     """
     # Initialization
-    def __init__(self,ground_truth_vars):
+    def __init__(self,ground_truth_vars,step=0.1):
         Thread.__init__(self)
         self.ground_truth_vars = {}
+        self.step = step
+        self.t = None # set on the first sync, so that the clock can be replaced after initialization
+        self.lock = Lock()
         # Initialize each variable
         for name, params in ground_truth_vars.items() :
             mu, sigma = params
@@ -85,27 +201,1245 @@ class GroundTruth(Thread) :
     def update_ground_truth_vars(self) -> None :
         for name, last_value in self.ground_truth_vars.items():
             self.ground_truth_vars[name] = get_new_sample(last_value,sigma=0.001)
+
+    # Catch up with the simulation clock
+    def sync(self) -> None :
+        now = sim_clock.time()
+        with self.lock :
+            if self.t is None : self.t = now
+            while self.t + self.step <= now :
+                self.update_ground_truth_vars()
+                self.t += self.step
     
     # Get ground truth var current value
     def get(self, var: str) -> float:
+        self.sync()
         return self.ground_truth_vars[var]
 
     # Thread execution
     def run(self) -> None :
         while True : 
             # Update ground truth series values and sleep for 100ms
-            self.update_ground_truth_vars()
-            time.sleep(0.1)
+            self.sync()
+            sim_clock.sleep(self.step)
+
+# State tracker for IDLE / PROCESSING / QUERYING accounting
+class StateTracker() :
+    """
+    A class that tracks the state changes of a single processing thread over time.
+
+    Attributes:
+        name (str): The name of the tracked thread.
+        sink (StatsSink): The sink state transitions are appended to (None if they are only kept in memory).
+        state (int): The current state (0 for IDLE, 1 for PROCESSING, 2 for QUERYING).
+        states_ts (deque): The times when the state changed (only the last history ones).
+        states (deque): The values the state changed to (only the last history ones).
+        state_times (list): The total time spent in each state.
+    """
+    # Initialization
+    def __init__(self, name='', sink=None, history=10000):
+        self.name = name
+        self.sink = sink
+        self.state = 0 # 0 for IDLE, 1 for PROCESSING, 2 for QUERYING
+        self.states_ts = deque([time.perf_counter()], maxlen=history) # times when state changes
+        self.states = deque([0], maxlen=history) # values state changes to
+        self.state_times = [0,0,0]
+
+    # Track state over time as it changes
+    def change(self, new_state: int) -> None :
+        tic = time.perf_counter()
+        self.state_times[self.state] = self.state_times[self.state] + (tic-self.states_ts[-1])
+        self.state = new_state
+        self.states_ts.append(tic)
+        self.states.append(new_state)
+        if self.sink is not None : self.sink.record_state(tic, new_state, self.name)
+
+# Background writer of agent statistics
+class StatsSink(Thread) :
+    """
+    A thread that writes the agent statistics to disk off the processing path. State transitions are 
+    appended to a CSV file, and device snapshots are taken periodically: the samples received since the 
+    previous snapshot are appended to a JSON lines file, and the current device memory is written to a 
+    JSON file and to a memory-mapped buffer snapshot (both replaced atomically, see BufferSnapshot). 
+    Appended files are rotated when they grow over max_bytes, and the caches registered are saved with 
+    every snapshot.
+
+    Attributes:
+        snapshot_fn (callable): Returns (devices, state_times), a copy of the device memory (see copy_devices)
+                                and the total time spent in each state.
+        path (str): The folder files are written to.
+        max_bytes (int): The size over which appended files are rotated.
+        backups (int): The number of rotated files kept (states.csv.1 ... states.csv.N).
+        snapshot_interval (float): The time (in seconds) between device snapshots.
+        records (Queue): The state transitions waiting to be written.
+        dropped (int): The number of state transitions dropped because the queue was full.
+        caches (list): The caches saved with every snapshot (objects with a save method, e.g. SimilarityCache).
+
+    Methods:
+        record_state(ts: float, state: int, worker: str) -> None: Queues a state transition.
+        request_snapshot() -> None: Requests a device snapshot as soon as possible.
+        stop() -> None: Writes pending records and a last snapshot, and stops the thread.
+    """
+    # Initialization
+    def __init__(self, snapshot_fn, path='.', max_bytes=10*2**20, backups=5, snapshot_interval=10.0, max_records=100000):
+        Thread.__init__(self, name='stats-sink', daemon=True)
+        self.snapshot_fn = snapshot_fn
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.snapshot_interval = snapshot_interval
+        self.records = Queue(maxsize=max_records)
+        self.dropped = 0
+        self.caches = []
+        self.active = True
+        self.snapshot_requested = False
+        self.last_snapshot_ts = -np.inf # newest sample timestamp already in the history file
+        self.states_path = os.path.join(path, 'states.csv')
+        self.state_times_path = os.path.join(path, 'state_times.csv')
+        self.devices_path = os.path.join(path, 'devices.json')
+        self.buffers_path = os.path.join(path, 'buffers.snap')
+        self.history_path = os.path.join(path, 'devices.jsonl')
+
+    # Queue state transition
+    def record_state(self, ts: float, state: int, worker: str) -> None :
+        try :
+            self.records.put_nowait((ts, state, worker))
+        except Full :
+            self.dropped += 1
+
+    # Request snapshot
+    def request_snapshot(self) -> None :
+        self.snapshot_requested = True
+
+    # Stop thread
+    def stop(self) -> None :
+        self.active = False
+        self.join()
+
+    # Append queued state transitions
+    def write_states(self) -> None :
+        rows = []
+        while True :
+            try : rows.append(self.records.get_nowait())
+            except Empty : break
+        if not rows : return
+        rotate_file(self.states_path, self.max_bytes, self.backups)
+        new_file = not os.path.exists(self.states_path)
+        with open(self.states_path, 'a', newline='') as f :
+            writer = csv.writer(f)
+            if new_file : writer.writerow(['ts','states','worker'])
+            writer.writerows(rows)
+
+    # Write devices snapshot and state times
+    def write_snapshot(self) -> None :
+        devices, state_times = self.snapshot_fn()
+        # Samples received since the previous snapshot (the whole snapshot is built before any file is written)
+        delta, newest = {}, self.last_snapshot_ts
+        for dev_uuid, dev in devices.items() :
+            new = dev['timestamps'] > self.last_snapshot_ts
+            if not new.any() : continue
+            newest = max(newest, dev['timestamps'][-1])
+            delta[dev_uuid] = {'class': dev['class'], 'integrated': dev['integrated'], 'timestamps': dev['timestamps'][new],
+                               'modules': {mod_name: {attrib_name: values[new] for attrib_name, values in attribs_dic.items()} for mod_name, attribs_dic in dev['modules'].items()}}
+        # Current device memory, with ISO timestamps as before (replaced atomically so readers never see a partial file)
+        with open(self.devices_path + '.tmp', 'w') as f :
+            dump({dev_uuid: {**dev, 'timestamps': to_iso(dev['timestamps'])} for dev_uuid, dev in devices.items()}, f, cls=ModifiedEncoder)
+        os.replace(self.devices_path + '.tmp', self.devices_path)
+        BufferSnapshot.write(self.buffers_path, devices)
+        if delta :
+            rotate_file(self.history_path, self.max_bytes, self.backups)
+            with open(self.history_path, 'a') as f :
+                f.write(dumps({'ts': newest, 'devices': delta}, cls=ModifiedEncoder) + '\n')
+        self.last_snapshot_ts = newest
+        # Total time spent in each state
+        with open(self.state_times_path, 'w') as f :
+            csv.writer(f).writerow(['state_times']+state_times)
+
+    # Thread execution
+    def run(self) -> None :
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while True :
+            active = self.active
+            try : self.write_states()
+            except Exception as e : print(f'stats states write failed: {e!r}', kind='fail')
+            if self.snapshot_requested or time.monotonic() >= next_snapshot or not active :
+                self.snapshot_requested = False
+                next_snapshot = time.monotonic() + self.snapshot_interval
+                try : self.write_snapshot()
+                except Exception as e : print(f'stats snapshot failed: {e!r}', kind='fail')
+                for cache in self.caches :
+                    try : cache.save()
+                    except Exception as e : print(f'cache save failed: {e!r}', kind='fail')
+            if not active : return
+            time.sleep(0.5)
+
+# Latency histogram with fixed buckets
+class LatencyHistogram() :
+    """
+    A class that counts latencies into fixed cumulative buckets, as Prometheus histograms do.
+
+    Attributes:
+        buckets (tuple): The upper bounds (in seconds) of the buckets.
+        counts (list): The number of observations in each bucket (the last one is +Inf), not cumulative.
+        total (float): The sum of all observations.
+        n (int): The number of observations.
+        max (float): The largest observation.
+    """
+    # Initialization
+    def __init__(self, buckets=None):
+        self.buckets = buckets or latency_buckets
+        self.counts = [0]*(len(self.buckets)+1)
+        self.total = 0.0
+        self.n = 0
+        self.max = 0.0
+
+    # Count observation
+    def observe(self, seconds: float) -> None :
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+        self.max = max(self.max, seconds)
+
+    # Estimate quantile (linear interpolation within the bucket, as histogram_quantile does, bounded by the largest observation)
+    def quantile(self, q: float) -> float :
+        if self.n == 0 : return np.nan
+        rank, acc = q*self.n, 0
+        for i, count in enumerate(self.counts) :
+            if acc + count >= rank and count > 0 :
+                if i == len(self.buckets) : return self.max
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                return min(lower + (self.buckets[i]-lower)*(rank-acc)/count, self.max)
+            acc += count
+        return self.max
+
+# Registry of the agent counters and latency histograms
+class MetricsRegistry() :
+    """
+    A class that keeps named counters and latency histograms, labelled by e.g. stage and device class,
+    and renders them in the Prometheus text exposition format.
+
+    Attributes:
+        counters (dict): The counters, by name and labels.
+        histograms (dict): The latency histograms, by name and labels.
+        lock (Lock): The lock protecting the counters and histograms.
+
+    Methods:
+        inc(name: str, n: int = 1, **labels) -> None: Increments a counter.
+        observe(name: str, seconds: float, **labels) -> None: Counts a latency into a histogram.
+        timer(name: str, **labels): Context manager counting the time spent in its block into a histogram.
+        quantile(name: str, q: float, **labels) -> float: Estimates a latency quantile of the matching histograms.
+        render() -> str: Renders all metrics in Prometheus text format.
+    """
+    # Initialization
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = Lock()
+
+    # Increment counter
+    def inc(self, name: str, n: int = 1, **labels) -> None :
+        key = (name, tuple(labels.items()))
+        with self.lock : self.counters[key] = self.counters.get(key, 0) + n
+
+    # Count latency
+    def observe(self, name: str, seconds: float, **labels) -> None :
+        key = (name, tuple(labels.items()))
+        with self.lock :
+            hist = self.histograms.get(key)
+            if hist is None : hist = self.histograms[key] = LatencyHistogram()
+            hist.observe(seconds)
+
+    # Time block
+    @contextmanager
+    def timer(self, name: str, **labels) :
+        tic = time.perf_counter()
+        try : yield
+        finally : self.observe(name, time.perf_counter()-tic, **labels)
+
+    # Estimate quantile over the histograms matching the given labels
+    def quantile(self, name: str, q: float, **labels) -> float :
+        merged = LatencyHistogram()
+        with self.lock :
+            for (hist_name, hist_labels), hist in self.histograms.items() :
+                if hist_name != name or not labels.items() <= dict(hist_labels).items() : continue
+                merged.counts = [a+b for a, b in zip(merged.counts, hist.counts)]
+                merged.n += hist.n
+                merged.max = max(merged.max, hist.max)
+        return merged.quantile(q)
+
+    # Prometheus text format
+    def render(self) -> str :
+        escape = lambda v: str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+        fmt_labels = lambda labels: ','.join(f'{k}="{escape(v)}"' for k, v in labels)
+        lines, typed = [], set()
+        with self.lock :
+            for (name, labels), value in sorted(self.counters.items()) :
+                if name not in typed :
+                    lines += [f'# HELP {name} {metrics_help.get(name, name)}', f'# TYPE {name} counter']
+                    typed.add(name)
+                lines.append(f'{name}{{{fmt_labels(labels)}}} {value}')
+            for (name, labels), hist in sorted(self.histograms.items()) :
+                if name not in typed :
+                    lines += [f'# HELP {name} {metrics_help.get(name, name)}', f'# TYPE {name} histogram']
+                    typed.add(name)
+                acc, sep = 0, ',' if labels else ''
+                for le, count in zip(list(hist.buckets) + ['+Inf'], hist.counts) :
+                    acc += count
+                    lines.append(f'{name}_bucket{{{fmt_labels(labels)}{sep}le="{le}"}} {acc}')
+                lines.append(f'{name}_sum{{{fmt_labels(labels)}}} {hist.total}')
+                lines.append(f'{name}_count{{{fmt_labels(labels)}}} {hist.n}')
+        return '\n'.join(lines) + '\n'
+
+# HTTP endpoint serving the metrics
+class MetricsServer(Thread) :
+    """
+    A thread serving the metrics of a registry over HTTP (GET /metrics) in Prometheus text format.
+
+    Attributes:
+        metrics (MetricsRegistry): The registry served.
+        server (ThreadingHTTPServer): The HTTP server.
+
+    Methods:
+        stop() -> None: Shuts the server down.
+    """
+    # Initialization
+    def __init__(self, metrics, host='127.0.0.1', port=metrics_port):
+        Thread.__init__(self, name='metrics-server', daemon=True)
+        self.metrics = metrics
+        registry = metrics
+        class Handler(BaseHTTPRequestHandler) :
+            def do_GET(self) :
+                if self.path.split('?')[0] not in ('/metrics', '/') :
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args) : pass
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    # Thread execution
+    def run(self) -> None :
+        self.server.serve_forever()
+
+    # Stop server
+    def stop(self) -> None :
+        self.server.shutdown()
+        self.server.server_close()
+
+# Message delivered by the in-process bus
+class BusMessage() :
+    """A message delivered by the LocalBus, with the attributes of paho's MQTTMessage used by the callbacks."""
+    __slots__ = ('topic', 'payload', 'qos', 'retain')
+
+    # Initialization
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+        self.qos = 0
+        self.retain = False
+
+# In-process publish/subscribe bus replacing the MQTT broker
+class LocalBus() :
+    """
+    A class that routes the messages published by LocalClients to the LocalClients subscribed to matching
+    topic filters (with the MQTT '+' and '#' wildcards), within a single process and without a broker.
+    The subscribers of each topic are cached, so publishing only looks up a dictionary (without locking)
+    and puts the message in the bounded queue of each subscriber: when a subscriber falls behind, its
+    publishers wait for room instead of piling messages up.
+
+    Attributes:
+        subscriptions (dict): The clients subscribed to each topic filter.
+        routes (dict): The cached subscribers of each topic published to.
+
+    Methods:
+        subscribe(client: LocalClient, topic_filter: str) -> None: Subscribes a client to a topic filter.
+        unsubscribe(client: LocalClient) -> None: Removes all the subscriptions of a client.
+        publish(topic: str, payload: bytes) -> int: Delivers a message to the subscribers of its topic and returns their number.
+    """
+    # Initialization
+    def __init__(self):
+        self.lock = Lock()
+        self.subscriptions = {}
+        self.routes = {}
+
+    # Subscribe client
+    def subscribe(self, client: 'LocalClient', topic_filter: str) -> None :
+        with self.lock :
+            self.subscriptions.setdefault(topic_filter, set()).add(client)
+            self.routes = {}
+
+    # Unsubscribe client
+    def unsubscribe(self, client: 'LocalClient') -> None :
+        with self.lock :
+            for clients in self.subscriptions.values() : clients.discard(client)
+            self.subscriptions = {topic_filter: clients for topic_filter, clients in self.subscriptions.items() if clients}
+            self.routes = {}
+
+    # Deliver message
+    def publish(self, topic: str, payload: bytes) -> int :
+        routes = self.routes
+        clients = routes.get(topic)
+        if clients is None :
+            with self.lock :
+                clients = tuple({client for topic_filter, subscribers in self.subscriptions.items() if topic_matches(topic_filter, topic) for client in subscribers})
+                self.routes[topic] = clients
+        if clients :
+            msg = BusMessage(topic, payload)
+            for client in clients : client.queue.put(msg)
+        return len(clients)
+
+# Process-wide bus used by LocalClients
+local_bus = LocalBus()
+
+# Client of the in-process bus, with the subset of the paho client interface used by the modules
+class LocalClient() :
+    """
+    A drop-in replacement for paho's mqtt.Client that publishes to and receives from the LocalBus.
+    Callbacks are called (with paho's signatures) from the thread running loop, loop_forever or loop_start.
+
+    Attributes:
+        client_id (str): The client identifier.
+        bus (LocalBus): The bus the client is attached to.
+        queue (Queue): The bounded queue of messages waiting to be delivered to on_message.
+        on_connect, on_disconnect, on_message, on_log (callable): The paho-style callbacks.
+
+    Methods:
+        connect(host: str = None, port: int = None, keepalive: int = 60) -> int: Attaches the client to the bus (on_connect is called by the next loop).
+        subscribe(topic: str, qos: int = 0) -> Tuple[int, int]: Subscribes to a topic filter.
+        publish(topic: str, payload: bytes = None, qos: int = 0, retain: bool = False) -> None: Publishes a message.
+        loop(timeout: float = 1.0) -> None: Delivers the waiting messages (waiting up to timeout for one if subscribed).
+        loop_forever() -> None: Delivers messages until disconnected.
+        loop_start() / loop_stop() -> None: Delivers messages in a background thread.
+        disconnect() -> None: Detaches the client from the bus.
+        max_queued_messages_set(n: int) -> None: Does nothing (publishing never queues messages).
+    """
+    # Initialization
+    def __init__(self, client_id: str = '', bus: LocalBus = None, max_queue: int = 10000):
+        self.client_id = client_id
+        self.bus = local_bus if bus is None else bus
+        self.queue = Queue(maxsize=max_queue)
+        self.on_connect = self.on_disconnect = self.on_message = self.on_log = None
+        self.userdata = None
+        self.connected = False
+        self.subscribed = False
+        self.pending_connect = False
+        self.looping = False
+        self.thread = None
+
+    # Outgoing queue limit (unused)
+    def max_queued_messages_set(self, n: int) -> None :
+        pass
+
+    # Attach to bus
+    def connect(self, host: str = None, port: int = None, keepalive: int = 60) -> int :
+        self.connected = self.pending_connect = True
+        return 0
+
+    # Subscribe to topic filter
+    def subscribe(self, topic: str, qos: int = 0) -> Tuple[int, int] :
+        self.bus.subscribe(self, topic)
+        self.subscribed = True
+        return (0, 0)
+
+    # Publish message
+    def publish(self, topic: str, payload: bytes = None, qos: int = 0, retain: bool = False) -> None :
+        if isinstance(payload, str) : payload = payload.encode()
+        self.bus.publish(topic, b'' if payload is None else payload)
+
+    # Deliver waiting messages
+    def loop(self, timeout: float = 1.0) -> None :
+        if self.pending_connect :
+            self.pending_connect = False
+            if self.on_connect is not None : self.on_connect(self, self.userdata, {}, 0)
+        if not self.subscribed : return
+        try :
+            msg = self.queue.get(timeout=timeout)
+            while msg is not None :
+                if self.on_message is not None : self.on_message(self, self.userdata, msg)
+                msg = self.queue.get_nowait()
+        except Empty :
+            pass
+
+    # Deliver messages until disconnected
+    def loop_forever(self) -> None :
+        self.looping = True
+        while self.looping and self.connected :
+            self.loop(timeout=1.0)
+            if not self.subscribed : time.sleep(0.1)
+
+    # Deliver messages in a background thread
+    def loop_start(self) -> None :
+        self.thread = Thread(target=self.loop_forever, name=f'{self.client_id}-loop', daemon=True)
+        self.thread.start()
+
+    # Stop background thread
+    def loop_stop(self) -> None :
+        self.looping = False
+        self.wake()
+        if self.thread is not None and self.thread is not current_thread() : self.thread.join()
+        self.thread = None
+
+    # Detach from bus
+    def disconnect(self) -> None :
+        self.bus.unsubscribe(self)
+        self.connected = self.subscribed = False
+        self.wake()
+        if self.on_disconnect is not None : self.on_disconnect(self, self.userdata, 0)
+
+    # Wake loop up
+    def wake(self) -> None :
+        try :
+            self.queue.put_nowait(None)
+        except Full :
+            pass
+
+# Bounded ingest queues served by a pool of workers
+class IngestPool() :
+    """
+    A pool of worker threads fed by bounded, hash-partitioned queues. Items sharing the same key
+    (e.g. a device uuid) always land in the same queue, so they are processed in arrival order,
+    while items with different keys are processed concurrently by different workers.
+
+    Attributes:
+        handler (callable): The function called by the workers for each queued item.
+        n_workers (int): The number of workers (and queues).
+        queues (list): The bounded queue of each worker.
+        enqueued (int): The number of items accepted into the queues.
+        dropped (int): The number of items dropped because their queue was full.
+        errors (int): The number of items whose handler raised an exception.
+        processed (list): The number of items processed by each worker.
+        busy_times (list): The time each worker has spent running the handler.
+
+    Methods:
+        start() -> None: Starts the worker threads.
+        stop() -> None: Stops the worker threads once their queues are drained.
+        put(key: str, item: Any) -> bool: Enqueues an item in the queue its key hashes to.
+        get_stats() -> Dict[str, Any]: Returns queue depths, drops and worker utilisation.
+    """
+    # Initialization
+    def __init__(self, handler, n_workers=4, max_queue=1000, block=False):
+        self.handler = handler
+        self.n_workers = max(1,n_workers)
+        self.block = block # wait for room instead of dropping when a queue is full
+        self.queues = [Queue(maxsize=max(1,max_queue//self.n_workers)) for _ in range(self.n_workers)]
+        self.workers = [Thread(target=self.work, args=(i,), name=f'ingest-worker-{i}', daemon=True) for i in range(self.n_workers)]
+        # Stats
+        self.stats_lock = Lock()
+        self.enqueued, self.dropped, self.errors = 0, 0, 0
+        self.processed = [0]*self.n_workers
+        self.busy_times = [0.0]*self.n_workers
+        self.start_ts = time.perf_counter()
+
+    # Start workers
+    def start(self) -> None :
+        self.start_ts = time.perf_counter()
+        for worker in self.workers : worker.start()
+
+    # Stop workers after draining their queues
+    def stop(self) -> None :
+        for q in self.queues : q.put(None)
+        for worker in self.workers : worker.join()
+
+    # Queue index for a given key
+    def partition(self, key: str) -> int :
+        return zlib.crc32(key.encode()) % self.n_workers
+
+    # Enqueue item
+    def put(self, key: str, item: Any) -> bool :
+        try :
+            self.queues[self.partition(key)].put(item, block=self.block)
+        except Full :
+            with self.stats_lock : self.dropped += 1
+            return False
+        with self.stats_lock : self.enqueued += 1
+        return True
+
+    # Worker loop
+    def work(self, i: int) -> None :
+        q = self.queues[i]
+        while True :
+            item = q.get()
+            if item is None : break
+            tic = time.perf_counter()
+            try :
+                self.handler(item)
+            except Exception as e :
+                with self.stats_lock : self.errors += 1
+                print(f'ingest-worker-{i} failed to process item: {e!r}', kind='fail')
+            toc = time.perf_counter()
+            self.processed[i] += 1
+            self.busy_times[i] += toc-tic
+
+    # Queue depths, drops and worker utilisation
+    def get_stats(self) -> Dict[str, Any] :
+        elapsed = max(time.perf_counter() - self.start_ts, 1e-9)
+        depths = [q.qsize() for q in self.queues]
+        return {
+            'depth': sum(depths),
+            'depths': depths,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'processed': list(self.processed),
+            'utilisation': [busy/elapsed for busy in self.busy_times]
+        }
+
+# Long-lived process pool for the integration algorithm
+class WorkerPool() :
+    """
+    A long-lived pool of worker processes for the integration algorithm. The processes are started once (warm, in 
+    the background, calls run in process until they are ready) and reused by every call. The data of a call is 
+    copied once to shared memory, and each worker only receives the slice of rows it has to process. Every call measures how long a row takes, and a call runs in the calling 
+    process instead when dispatching it would cost more than the time saved (e.g. small jobs, or a single worker).
+
+    Attributes:
+        n_workers (int): The number of worker processes (0 to always run in process).
+        executor (ProcessPoolExecutor): The worker processes (started by warm or on first use).
+        warming (list): The futures of the tasks warming the worker processes up.
+        row_times (dict): The measured time (in seconds) per row of each function (exponential moving average).
+        dispatch_time (float): The measured overhead (in seconds) of a call dispatched to the workers.
+        calls (dict): The number of calls run in process ('local') and in the workers ('pool').
+
+    Methods:
+        warm() -> None: Starts the worker processes (in the background).
+        ready() -> bool: Checks if the worker processes are ready.
+        map(fn: callable, arrays: dict, n_rows: int, *args) -> list: Calls fn(arrays, rows, *args) over slices of rows, 
+            and returns the concatenated results in row order.
+        shutdown() -> None: Stops the worker processes.
+    """
+    # Initialization
+    def __init__(self, n_workers=None):
+        self.n_workers = os.cpu_count() if n_workers is None else max(0, n_workers)
+        self.executor = None
+        self.warming = []
+        self.lock = Lock()
+        self.row_times = {}
+        self.dispatch_time = 0.05
+        self.calls = {'local': 0, 'pool': 0}
+
+    # Start worker processes
+    def warm(self) -> None :
+        if self.n_workers < 2 : return
+        with self.lock :
+            if self.executor is not None : return
+            # Spawned (not forked) since the agent is multi-threaded
+            self.executor = ProcessPoolExecutor(self.n_workers, mp_context=get_context('spawn'))
+            self.warming = [self.executor.submit(warm_worker) for _ in range(self.n_workers)]
+
+    # Worker processes ready
+    def ready(self) -> bool :
+        return self.executor is not None and all(future.done() for future in self.warming)
+
+    # Stop worker processes
+    def shutdown(self) -> None :
+        with self.lock :
+            if self.executor is not None : self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    # Map slices of rows
+    def map(self, fn, arrays: Dict[str, np.ndarray], n_rows: int, *args) -> List[Any] :
+        name = fn.__name__
+        row_time = self.row_times.get(name)
+        n_slices = min(self.n_workers, n_rows)
+        # Worth dispatching if the time saved by the workers is higher than the overhead (unknown row time: measure it locally)
+        if n_slices < 2 or row_time is None or n_rows*row_time*(1 - 1/n_slices) < self.dispatch_time or not self.ready() :
+            self.warm()
+            tic = time.perf_counter()
+            results = fn(arrays, range(n_rows), *args)
+            self.measure(name, (time.perf_counter()-tic)/max(n_rows,1))
+            self.calls['local'] += 1
+            return results
+        tic = time.perf_counter()
+        with SharedArrays(arrays) as shared :
+            bounds = np.linspace(0, n_rows, n_slices+1).astype(int)
+            futures = [self.executor.submit(run_shared, fn, shared.spec, range(bounds[k], bounds[k+1]), *args) for k in range(n_slices)]
+            outputs = [future.result() for future in futures]
+        elapsed = time.perf_counter() - tic
+        # Workers report their own busy time, the rest is dispatch overhead
+        busy = [worker_time for _, worker_time in outputs]
+        self.measure(name, sum(busy)/n_rows)
+        self.dispatch_time = 0.8*self.dispatch_time + 0.2*max(elapsed - max(busy), 0.0)
+        self.calls['pool'] += 1
+        return [result for results, _ in outputs for result in results]
+
+    # Update row time
+    def measure(self, name: str, row_time: float) -> None :
+        previous = self.row_times.get(name)
+        self.row_times[name] = row_time if previous is None else 0.8*previous + 0.2*row_time
+
+# NumPy arrays copied to shared memory
+class SharedArrays() :
+    """
+    A context manager copying some NumPy arrays to a shared memory block, released on exit. Other processes 
+    attach to them through their spec (the block name, and the dtype, shape and offset of each array).
+
+    Attributes:
+        shm (SharedMemory): The shared memory block.
+        spec (tuple): The block name and {name: (dtype, shape, offset)} of the arrays.
+
+    Methods:
+        attach(spec: tuple) -> Tuple[SharedMemory, Dict[str, numpy.ndarray]] (static): Maps the arrays of a spec.
+    """
+    # Initialization
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        layout, offset = {}, 0
+        for name, array in arrays.items() :
+            layout[name] = (array.dtype.str, array.shape, offset)
+            offset += -(-array.nbytes//8)*8 # 8-byte aligned
+        self.shm = SharedMemory(create=True, size=max(offset, 8))
+        for name, array in arrays.items() :
+            dtype, shape, offset = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)[...] = array
+        self.spec = (self.shm.name, layout)
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.shm.close()
+        self.shm.unlink()
+
+    # Attach to shared arrays
+    @staticmethod
+    def attach(spec: Tuple[str, Dict[str, Tuple[str, tuple, int]]]) -> Tuple[SharedMemory, Dict[str, np.ndarray]] :
+        name, layout = spec
+        shm = SharedMemory(name=name)
+        return shm, {array_name: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset) for array_name, (dtype, shape, offset) in layout.items()}
+
+# Batched MASS distance profiles
+class MassBatch() :
+    """
+    The MASS distance profiles of a query against a batch of time series, computed in one vectorized pass. The 
+    series are stacked into a zero-padded matrix whose FFT and rolling window sums are computed once, so each 
+    query only costs one FFT of its own and one inverse FFT of the whole batch. The distances are the ones of 
+    stumpy mass (Euclidean, or z-normalized Euclidean), up to the rounding of the FFT, which closest corrects.
+
+    Attributes:
+        m (int): The length of the queries (window).
+        normalize (bool): Whether the distances are z-normalized.
+        lengths (numpy.ndarray): The length of each series.
+        series (List[numpy.ndarray]): The series.
+        center (float): The mean value of the series, subtracted before the FFT.
+        n_fft (int): The length of the FFTs (padded).
+        fft (numpy.ndarray): The FFT of each (padded) series.
+        sq_sums (numpy.ndarray): The sum of squares of each window of each series.
+        means (numpy.ndarray): The mean of each window of each series (z-normalized only).
+        stds (numpy.ndarray): The standard deviation of each window of each series (z-normalized only).
+        valid (numpy.ndarray): The windows within each series (the rest is padding).
+
+    Methods:
+        profiles(query: numpy.ndarray) -> numpy.ndarray: Get the squared distance profile against each series.
+        min_dists(query: numpy.ndarray) -> numpy.ndarray: Get the minimum distance to each series.
+        closest(query: numpy.ndarray) -> int: Get the index of the closest series (-1 if none).
+    """
+    # Initialization
+    def __init__(self, series: List[np.ndarray], m: int, normalize: bool = False):
+        self.m, self.normalize = m, normalize
+        self.series = [np.asarray(values, dtype=np.float64) for values in series]
+        self.lengths = np.array([values.size for values in self.series], dtype=int)
+        max_len = max(self.lengths.max(initial=0), m)
+        n_windows = max_len - m + 1
+        self.n_fft = 1 << int(max_len - 1).bit_length()
+        # Shifted by the mean value (same distances, less cancellation in the FFT)
+        self.center = np.concatenate(self.series).mean() if self.lengths.sum() else 0.0
+        stacked = np.zeros((len(self.series), max_len))
+        for j, values in enumerate(self.series) : stacked[j, :values.size] = values - self.center
+        self.fft = np.fft.rfft(stacked, n=self.n_fft, axis=1)
+        # Rolling window sums (cumulative sums difference)
+        cum_sq = np.zeros((len(self.series), max_len+1))
+        np.cumsum(stacked**2, axis=1, out=cum_sq[:, 1:])
+        self.sq_sums = cum_sq[:, m:] - cum_sq[:, :n_windows]
+        self.valid = np.arange(n_windows)[None, :] <= (self.lengths - m)[:, None]
+        if normalize :
+            cum = np.zeros((len(self.series), max_len+1))
+            np.cumsum(stacked, axis=1, out=cum[:, 1:])
+            self.means = (cum[:, m:] - cum[:, :n_windows])/m
+            self.stds = np.sqrt(np.maximum(self.sq_sums/m - self.means**2, 0.0))
+
+    # Squared distance profiles
+    def profiles(self, query: np.ndarray) -> np.ndarray :
+        query = np.asarray(query, dtype=np.float64)
+        if query.size != self.m or not np.all(np.isfinite(query)) : return np.full(self.valid.shape, np.inf)
+        query = query - self.center
+        # Sliding dot products (cross-correlation through the FFT)
+        dots = np.fft.irfft(self.fft*np.conj(np.fft.rfft(query, n=self.n_fft)), n=self.n_fft, axis=1)[:, :self.valid.shape[1]]
+        if self.normalize :
+            mean, std = query.mean(), query.std()
+            with np.errstate(divide='ignore', invalid='ignore') :
+                corr = (dots - self.m*mean*self.means)/(self.m*std*self.stds)
+            dists = 2*self.m*(1 - np.clip(corr, -1.0, 1.0))
+            # Constant windows (as stumpy): distance 0 to a constant query, sqrt(m) otherwise
+            const, query_const = self.stds < 1e-8, std < 1e-8
+            dists[const] = 0.0 if query_const else self.m
+            if query_const : dists[~const] = self.m
+        else :
+            dists = np.maximum(query @ query + self.sq_sums - 2*dots, 0.0)
+        dists[~self.valid] = np.inf
+        return dists
+
+    # Minimum distance to each series
+    def min_dists(self, query: np.ndarray) -> np.ndarray :
+        return np.sqrt(self.profiles(query).min(axis=1, initial=np.inf))
+
+    # Closest series
+    def closest(self, query: np.ndarray) -> int :
+        dists = self.profiles(query)
+        best = dists.min(axis=1, initial=np.inf)
+        if not np.isfinite(best).any() : return -1
+        if self.normalize : return int(np.argmin(best))
+        # Series within the FFT rounding of the best one are compared exactly (first one wins ties, as a loop would)
+        query = np.asarray(query, dtype=np.float64)
+        tolerance = 1e-9*((query - self.center) @ (query - self.center) + self.sq_sums.max(initial=0.0)) + 1e-12
+        ties = np.flatnonzero(best <= best.min() + tolerance)
+        if ties.size == 1 : return int(ties[0])
+        exact = [np.min(np.sum((np.lib.stride_tricks.sliding_window_view(self.series[j], self.m) - query)**2, axis=1)) for j in ties]
+        return int(ties[np.argmin(exact)])
+
+# Micro-batching of update queries
+class BatchWriter() :
+    """
+    A class that coalesces the update queries submitted by several threads and commits them together
+    in a single write transaction. A batch is committed when it reaches max_batch queries or when its
+    oldest query has been waiting for max_delay seconds. If a batch fails to commit (e.g. because of a
+    conflict), its queries are committed again one by one.
+
+    Attributes:
+        client (KGBackend): The backend used to commit the updates (see KGBackend.apply_updates).
+        max_batch (int): The maximum number of queries committed in a single transaction.
+        max_delay (float): The maximum time (in seconds) a query waits before being committed.
+        pending (list): The queries waiting to be committed.
+        batches (int): The number of committed batches.
+        batched_msgs (int): The number of queries committed.
+        max_batch_size (int): The size of the biggest committed batch.
+        commit_time (float): The total time spent committing batches.
+        max_commit_time (float): The longest time spent committing a batch.
+        fallbacks (int): The number of batches that had to be committed one query at a time.
+        failures (int): The number of queries that could not be committed.
+
+    Methods:
+        start() -> None: Starts the flushing thread.
+        stop() -> None: Commits the pending queries and stops the flushing thread.
+        submit(query: str) -> None: Adds an update query to the current batch.
+        flush() -> None: Commits the pending queries.
+        get_stats() -> Dict[str, float]: Returns batch size and commit latency statistics.
+    """
+    # Initialization
+    def __init__(self, client, max_batch=50, max_delay=0.05):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []
+        self.first_ts = None # time when the oldest pending query was submitted
+        self.active = False
+        self.cond = Condition()
+        self.flusher = Thread(target=self.run, name='batch-writer', daemon=True)
+        # Stats
+        self.batches, self.batched_msgs, self.max_batch_size = 0, 0, 0
+        self.commit_time, self.max_commit_time = 0.0, 0.0
+        self.fallbacks, self.failures = 0, 0
+
+    # Start flushing thread
+    def start(self) -> None :
+        self.active = True
+        self.flusher.start()
+
+    # Stop flushing thread after committing pending queries
+    def stop(self) -> None :
+        with self.cond :
+            self.active = False
+            self.cond.notify()
+        self.flusher.join()
+        while self.pending : self.flush()
+
+    # Add query to the current batch
+    def submit(self, query: str) -> None :
+        with self.cond :
+            if not self.pending : self.first_ts = time.perf_counter()
+            self.pending.append(query)
+            if len(self.pending) >= self.max_batch : self.cond.notify()
+
+    # Take up to max_batch pending queries
+    def take(self) -> List[str] :
+        with self.cond :
+            queries, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.first_ts = time.perf_counter() if self.pending else None
+        return queries
+
+    # Commit pending queries in a single transaction
+    def flush(self) -> None :
+        queries = self.take()
+        if not queries : return
+        tic = time.perf_counter()
+        try :
+            self.client.apply_updates(queries)
+        except Exception as e :
+            # Fall back to one transaction per query so a single conflict does not lose the whole batch
+            print(f'batch of {len(queries)} updates failed, committing one by one: {e!r}', kind='fail')
+            self.fallbacks += 1
+            for query in queries :
+                try :
+                    self.client.apply_updates([query])
+                except Exception as e :
+                    self.failures += 1
+                    print(f'update failed: {e!r}', kind='fail')
+        toc = time.perf_counter()
+        # Stats
+        self.batches += 1
+        self.batched_msgs += len(queries)
+        self.max_batch_size = max(self.max_batch_size, len(queries))
+        self.commit_time += toc-tic
+        self.max_commit_time = max(self.max_commit_time, toc-tic)
+
+    # Flushing thread execution
+    def run(self) -> None :
+        while True :
+            with self.cond :
+                while self.active and len(self.pending) < self.max_batch :
+                    if self.first_ts is None :
+                        self.cond.wait()
+                    else :
+                        remaining = self.first_ts + self.max_delay - time.perf_counter()
+                        if remaining <= 0 : break
+                        self.cond.wait(remaining)
+                if not self.active : return
+            self.flush()
+
+    # Batch size and commit latency statistics
+    def get_stats(self) -> Dict[str, float] :
+        return {
+            'batches': self.batches,
+            'msgs': self.batched_msgs,
+            'avg_batch_size': self.batched_msgs/self.batches if self.batches else 0,
+            'max_batch_size': self.max_batch_size,
+            'avg_commit_time': self.commit_time/self.batches if self.batches else 0,
+            'max_commit_time': self.max_commit_time,
+            'fallbacks': self.fallbacks,
+            'failures': self.failures
+        }
+
+# Pooled TypeDB session
+class PooledSession() :
+    """
+    A TypeDB session kept open by a SessionPool, together with a read transaction that can be reused
+    by consecutive match queries as long as no write has been committed since it was opened.
+
+    Attributes:
+        ssn (TypeDBSession): The open session.
+        generation (int): The pool generation the session was opened in.
+        rtrans (TypeDBTransaction): The cached read transaction (None if there is none).
+        rtrans_write_gen (int): The pool write generation the read transaction was opened in.
+        rtrans_ts (float): The time the read transaction was opened.
+    """
+    # Initialization
+    def __init__(self, ssn, generation):
+        self.ssn = ssn
+        self.generation = generation
+        self.rtrans, self.rtrans_write_gen, self.rtrans_ts = None, -1, 0.0
+
+    # Get a read transaction, reusing the cached one while it is still valid
+    def read_transaction(self, write_gen: int, ttl: float) :
+        if self.rtrans is not None :
+            if self.rtrans_write_gen == write_gen and time.perf_counter() - self.rtrans_ts < ttl and self.rtrans.is_open() :
+                return self.rtrans
+            self.close_read_transaction()
+        self.rtrans = self.ssn.transaction(TransactionType.READ)
+        self.rtrans_write_gen, self.rtrans_ts = write_gen, time.perf_counter()
+        return self.rtrans
+
+    # Close the cached read transaction
+    def close_read_transaction(self) -> None :
+        if self.rtrans is not None :
+            try : self.rtrans.close()
+            except Exception : pass
+            self.rtrans = None
+
+    # Close the session
+    def close(self) -> None :
+        self.close_read_transaction()
+        try : self.ssn.close()
+        except Exception : pass
+
+# Pool of long-lived TypeDB sessions
+class SessionPool() :
+    """
+    A pool of long-lived TypeDB sessions of the same type. Sessions are opened lazily (up to size of them)
+    and handed to one thread at a time. A session is reopened when it fails, when it has been closed by
+    the server or when the pool is invalidated (e.g. after a schema change).
+
+    Attributes:
+        cli (TypeDB.core_client): The TypeDB client the sessions are opened with.
+        session_type (SessionType): The type of the sessions (DATA: an open SCHEMA session would block data writes).
+        size (int): The maximum number of open sessions.
+        pooled (bool): If False, a new session is opened and closed for every use (no pooling).
+        generation (int): Increased on every invalidation, sessions of older generations are reopened.
+        write_gen (int): Increased on every committed write, read transactions of older ones are not reused.
+
+    Methods:
+        session() -> PooledSession: Context manager lending a session of the pool.
+        invalidate() -> None: Forces all sessions to be reopened before their next use.
+        close() -> None: Closes all idle sessions.
+    """
+    # Initialization
+    def __init__(self, cli, session_type, size=4, pooled=True):
+        self.cli = cli
+        self.session_type = session_type
+        self.size = max(1,size)
+        self.pooled = pooled
+        self.idle = Queue()
+        self.opened = 0
+        self.lock = Lock()
+        self.generation = 0
+        self.write_gen = 0
+
+    # Open a new session
+    def open(self) -> PooledSession :
+        return PooledSession(self.cli.session(kb_name, self.session_type), self.generation)
+
+    # Take an idle session, opening a new one if there is room in the pool
+    def acquire(self) -> PooledSession :
+        try :
+            pssn = self.idle.get_nowait()
+        except Empty :
+            with self.lock :
+                can_open = self.opened < self.size
+                if can_open : self.opened += 1
+            if not can_open : pssn = self.idle.get()
+            else :
+                try : return self.open()
+                except Exception :
+                    with self.lock : self.opened -= 1
+                    raise
+        # Reopen sessions that are outdated or closed
+        if pssn.generation != self.generation or not pssn.ssn.is_open() :
+            pssn.close()
+            try : pssn = self.open()
+            except Exception :
+                with self.lock : self.opened -= 1
+                raise
+        return pssn
+
+    # Give a session back to the pool (discarding it if it failed)
+    def release(self, pssn: PooledSession, failed: bool = False) -> None :
+        if failed :
+            pssn.close()
+            with self.lock : self.opened -= 1
+        else :
+            self.idle.put(pssn)
+
+    # Lend a session
+    @contextmanager
+    def session(self) :
+        if not self.pooled :
+            pssn = self.open()
+            try : yield pssn
+            finally : pssn.close()
+            return
+        pssn = self.acquire()
+        try :
+            yield pssn
+        except Exception :
+            self.release(pssn, failed=True)
+            raise
+        self.release(pssn)
+
+    # Force sessions to be reopened
+    def invalidate(self) -> None :
+        with self.lock : self.generation += 1
+
+    # Close idle sessions
+    def close(self) -> None :
+        while True :
+            try : pssn = self.idle.get_nowait()
+            except Empty : break
+            pssn.close()
+            with self.lock : self.opened -= 1
+
+# Schema catalog
+class SchemaCatalog() :
+    """A class keeping the types defined in the knowledge graph schema in memory, so that checking whether a type, 
+    an attribute or an ownership is already defined does not need a query, and collecting the define statements of 
+    the missing ones so that they are committed together in a single schema transaction.
+
+    Attributes:
+        types (dict): The supertype of each entity and relation type ({type: supertype}).
+        attribs (dict): The value type of each attribute type ({attribute: tdbtype}).
+        owns (set): The ownerships of attribute types ({(type, attribute), ...}).
+        pending (list): The define statements not committed yet, as (kind, key, statement) tuples.
+        lock (Lock): The lock protecting the catalog.
+
+    Methods:
+        has_type(label: str) -> bool: Check if an entity or relation type is defined.
+        has_attrib(label: str) -> bool: Check if an attribute type is defined.
+        has_owns(owner: str, attrib: str) -> bool: Check if a type owns an attribute type.
+        add_type / add_attrib / add_owns: Record a type, attribute type or ownership already defined in the schema.
+        require_type(label: str, supertype: str) -> bool: Queue the definition of a type if it is missing.
+        require_attrib(label: str, value_type: str) -> bool: Queue the definition of an attribute type if it is missing.
+        require_owns(owner: str, attrib: str) -> bool: Queue the definition of an ownership if it is missing.
+        take() -> List[Tuple[str, Any, str]]: Take the pending statements, attribute types first.
+        forget(batch: List[Tuple[str, Any, str]]) -> None: Forget a batch of statements that could not be committed.
+        build_query(batch: List[Tuple[str, Any, str]]) -> str: Build the define query of a batch of statements.
+    """
+
+    # Initialization
+    def __init__(self):
+        self.types, self.attribs, self.owns = {}, {}, set()
+        self.pending = []
+        self.lock = Lock()
+
+    # Membership checks
+    def has_type(self, label: str) -> bool : return label in self.types
+    def has_attrib(self, label: str) -> bool : return label in self.attribs
+    def has_owns(self, owner: str, attrib: str) -> bool : return (owner, attrib) in self.owns
+
+    # Record types already defined
+    def add_type(self, label: str, supertype: str) -> None : self.types[label] = supertype
+    def add_attrib(self, label: str, value_type: str) -> None : self.attribs[label] = value_type
+    def add_owns(self, owner: str, attrib: str) -> None : self.owns.add((owner, attrib))
+
+    # Queue definitions of missing types (they are considered defined from now on)
+    def require_type(self, label: str, supertype: str) -> bool :
+        with self.lock :
+            if label in self.types : return False
+            self.types[label] = supertype
+            self.pending.append(('types', label, f'{label} sub {supertype}; \n'))
+            return True
+
+    def require_attrib(self, label: str, value_type: str) -> bool :
+        with self.lock :
+            if label in self.attribs : return False
+            self.attribs[label] = value_type
+            self.pending.append(('attribs', label, f'{label} sub attribute, value {value_type}; \n'))
+            return True
+
+    def require_owns(self, owner: str, attrib: str) -> bool :
+        with self.lock :
+            if (owner, attrib) in self.owns : return False
+            self.owns.add((owner, attrib))
+            self.pending.append(('owns', (owner, attrib), f'{owner} owns {attrib}; \n'))
+            return True
+
+    # Take pending statements
+    def take(self) -> List[Tuple[str, Any, str]] :
+        with self.lock :
+            batch, self.pending = self.pending, []
+        order = {'attribs': 0, 'types': 1, 'owns': 2}
+        return sorted(batch, key=lambda entry: order[entry[0]])
+
+    # Forget statements that were not committed
+    def forget(self, batch: List[Tuple[str, Any, str]]) -> None :
+        with self.lock :
+            for kind, key, _ in batch :
+                if kind == 'owns' : self.owns.discard(key)
+                else : getattr(self, kind).pop(key, None)
+
+    # Build define query
+    @staticmethod
+    def build_query(batch: List[Tuple[str, Any, str]]) -> str :
+        return 'define\n' + ''.join(statement for _, _, statement in batch)
+
+# Knowledge graph backend API
+class KGBackend():
+    """An abstract class for the knowledge graph backends used by the Knowledge Graph Agent.
+
+    A backend keeps the devices of the IoT platform, their modules and attributes, and the 'needs' relations
+    linking devices to the tasks of the plant, following the schema and initial data in typedbconfig/.
+
+    Attributes:
+        metrics (MetricsRegistry): The counters and latency histograms the operations are recorded into.
+        on_state (callable): Called with the new state (0 for IDLE, 2 for QUERYING) of the calling thread.
+        print_queries (bool): A flag for printing the operations run on the knowledge graph.
+        query_stats (dict): The number of operations and the time spent on them by operation type.
+        data_path (str): The TypeQL file with the initial data (the plant topology).
+        load_stats (dict): The number of entities, relations and queries of the last bulk load, its time and throughput.
+
+    Methods:
+        initialization() -> None: Resets the knowledge graph to its initial schema and data.
+        bulk_load(tql: str, batch_size: int, n_jobs: int) -> Dict[str, float]: Insert the entities and then the relations 
+            of a TypeQL insert query, reporting progress and throughput.
+        declare_class(dev_class: str, template: dict) -> None: Announce the schema a device class needs, so that a 
+            backend can define it together with the device (optional).
+        define_device(dev_class: str, uuid: str) -> None: Define a new device (and its class if needed).
+        define_modules_attribs(dev_class: str, uuid: str, timestamp: str, template: dict) -> None: Define the modules 
+            and attributes of a device class if needed, and add them to a device with default values.
+        prepare_update(dev_class: str, uuid: str, timestamp: str, data: dict, template: QueryTemplate) -> Any: Prepare 
+            an update of the attributes of a device, to be applied by apply_updates.
+        apply_updates(updates: List[Any]) -> None: Apply several prepared updates together.
+        replicate_relations(integ_uuid: str, noninteg_uuid: str) -> None: Replicate the 'needs' relations of an integrated device to a non-integrated device.
+        disintegrate_device(uuid: str) -> None: Remove a device and its modules from the knowledge graph.
+        get_integrated_devices() -> List[str]: Get the UUIDs of the devices in the knowledge graph.
+        hydrate_devices() -> Dict[str, Dict[str, Any]]: Get the type, latest timestamp, modules and latest attribute 
+            values of every device in the knowledge graph, as {uuid: {'type': str, 'timestamp': datetime or None, 
+            'modules': {module: {attribute: (tdbtype, value)}}}}.
+        get_query_stats() -> Dict[str, Dict[str, float]]: Get the number of operations and their latency by type.
+    """
+
+    # Initialization
+    def __init__(self, metrics=None, on_state=None, data_path='typedbconfig/data.tql'):
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.on_state = on_state
+        self.print_queries = False
+        self.data_path = data_path
+        self.load_stats = {}
+        # Queries latency
+        self.query_stats = {}
+        self.query_stats_lock = Lock()
+
+    # Notify state change of the calling thread
+    def change_state(self, new_state: int) -> None :
+        if self.on_state is not None : self.on_state(new_state)
+
+    # Record query latency
+    def record_query(self, kind: str, tic: float) -> None :
+        elapsed = time.perf_counter() - tic
+        with self.query_stats_lock :
+            n, total, max_time = self.query_stats.get(kind, (0, 0.0, 0.0))
+            self.query_stats[kind] = (n+1, total+elapsed, max(max_time, elapsed))
+        self.metrics.inc('kgagent_queries_total', kind=kind)
+        self.metrics.observe('kgagent_query_seconds', elapsed, kind=kind)
+
+    # Number of queries and latency by query type
+    def get_query_stats(self) -> Dict[str, Dict[str, float]] :
+        with self.query_stats_lock :
+            return {kind: {'n': n, 'avg': total/n, 'max': max_time} for kind, (n, total, max_time) in self.query_stats.items()}
+
+    # Report bulk load
+    def report_load(self, n_entities: int, n_relations: int, n_queries: int, elapsed: float) -> Dict[str, float] :
+        self.load_stats = {'entities': n_entities, 'relations': n_relations, 'queries': n_queries, 'elapsed': elapsed,
+                           'throughput': (n_entities+n_relations)/elapsed if elapsed > 0 else float('inf')}
+        print(f'{kb_name} DATA LOADED <Entities={n_entities} | Relations={n_relations} | Queries={n_queries} | '
+              f'T={elapsed:.2f}s | {self.load_stats["throughput"]:.0f} things/s>', kind='success')
+        return self.load_stats
+
+    # Knowledge graph operations
+    def initialization(self) -> None : raise NotImplementedError
+    def bulk_load(self, tql: str, batch_size: int = 100, n_jobs: int = None) -> Dict[str, float] : raise NotImplementedError
+    def declare_class(self, dev_class: str, template: Dict[str, Any]) -> None : pass
+    def define_device(self, dev_class: str, uuid: str) -> None : raise NotImplementedError
+    def define_modules_attribs(self, dev_class: str, uuid: str, timestamp: str, template: Dict[str, Any]) -> None : raise NotImplementedError
+    def prepare_update(self, dev_class: str, uuid: str, timestamp: str, data: Dict[str, Dict[str, Any]], template: 'QueryTemplate') -> Any : raise NotImplementedError
+    def apply_updates(self, updates: List[Any]) -> None : raise NotImplementedError
+    def replicate_relations(self, integ_uuid: str, noninteg_uuid: str) -> None : raise NotImplementedError
+    def disintegrate_device(self, uuid: str) -> None : raise NotImplementedError
+    def get_integrated_devices(self) -> List[str] : raise NotImplementedError
+    def hydrate_devices(self) -> Dict[str, Dict[str, Any]] : raise NotImplementedError
 
 # TypeDB Client Class
-class TypeDBClient():
+class TypeDBClient(KGBackend):
     """A class for interacting with the TypeDB database.
 
     Attributes:
         cli (TypeDB.core_client): The TypeDB client object for interacting with the database.
-        defined_modules (list): A list of device module names that have been defined in the knowledge graph.
-        defined_attribs (list): A list of device attribute names that have been defined in the knowledge graph.
-        devices (list): A list of integrated device names in the knowledge graph.
+        data_pool (SessionPool): The pool of long-lived DATA sessions (SCHEMA sessions are opened for each definition, 
+                                 since an open one holds the schema lock and blocks every data write).
+        read_ttl (float): The maximum time (in seconds) a read transaction is reused by consecutive match queries.
+        catalog (SchemaCatalog): The types defined in the knowledge graph schema, and the definitions pending.
+        schema_lock (Lock): The lock serializing the commits of pending definitions.
 
     Methods:
         initialization() -> None: Initializes the knowledge graph by checking if it exists, deleting it if it does, creating it as a new knowledge base, defining the initial schema, and populating it with initial data.
@@ -113,26 +1447,35 @@ class TypeDBClient():
         insert_query(query: str) -> None: Executes an INSERT query on the knowledge graph.
         delete_query(query: str) -> None: Executes a DELETE query on the knowledge graph.
         update_query(query: str) -> None: Executes an UPDATE query on the knowledge graph.
+        update_queries(queries: List[str]) -> None: Executes several UPDATE queries on the knowledge graph in a single transaction.
         define_query(query: str) -> None: Executes a DEFINE query on the knowledge graph.
-        define_device(dev_class: str, uuid: str) -> None: Define a new device in the knowledge graph.
-        replicate_relations(integ_uuid: str, noninteg_uuid: str) -> None: Replicate the relations of an integrated device to a non-integrated device.
-        disintegrate_device(uuid: str) -> None: Disintegrate a device from the knowledge graph.
-        get_integrated_devices() -> Dict[str, Dict[str, Any]]: Get the UUIDs of the integrated devices in the knowledge graph.
+        bulk_load(tql: str, batch_size: int, n_jobs: int) -> Dict[str, float]: Inserts the data in chunks committed in parallel over the DATA sessions.
+        load_catalog() -> None: Loads the types, attribute types and ownerships of the schema into the catalog.
+        flush_schema() -> None: Commits all pending definitions of the catalog in a single DEFINE query.
+        (and the KGBackend operations, run as TypeQL queries)
     """
 
     # Initialization
-    def __init__(self, initialize):
+    def __init__(self, initialize, n_sessions=4, pool_sessions=True, read_ttl=1.0, metrics=None, on_state=None, data_path='typedbconfig/data.tql'):
+        KGBackend.__init__(self, metrics, on_state, data_path)
         # Instantiate TypeDB Client
-        self.cli = TypeDB.core_client(kb_addr,4)
+        self.cli = TypeDB.core_client(kb_addr,n_sessions)
+        # Long-lived sessions (the DATA pool matches the client parallelism)
+        self.data_pool = SessionPool(self.cli, SessionType.DATA, n_sessions, pooled=pool_sessions)
+        self.read_ttl = read_ttl
+        # Schema catalog for devices management / integration
+        self.catalog = SchemaCatalog()
+        self.schema_lock = Lock()
         # Initialize the KG in TypeDB if required
         if initialize : self.initialization()
-        # Variables for devices management / integration
-        self.defined_modules = []
-        self.defined_attribs = []
-        self.devices = self.get_integrated_devices()
+        else : self.load_catalog()
 
     # TypeDB DB Initialization
     def initialization(self) :
+        # Sessions cannot outlive the database they were opened on
+        self.data_pool.close()
+        self.data_pool.invalidate()
+
         # Check if the knowledge graph exists and delete it
         if self.cli.databases().contains(kb_name) : self.cli.databases().get(kb_name).delete()
         
@@ -142,50 +1485,163 @@ class TypeDBClient():
         
         # Open a SCHEMA session to define initial schema
         with open('typedbconfig/schema.tql') as f: self.define_query(f.read())
+        self.load_catalog()
         print(f'{kb_name} SCHEMA DEFINED.', kind='success')
                 
-        # Open a DATA session to populate kb with initial data
-        with open('typedbconfig/data.tql') as f: self.insert_query(f.read())
+        # Populate kb with initial data over the DATA sessions
+        with open(self.data_path) as f: self.bulk_load(f.read())
         print(f'{kb_name} DATA POPULATED.', kind='success')
 
         self.change_state(0) # IDLE
-    
+
+    # Write transaction on a pooled session
+    @contextmanager
+    def write_transaction(self, pool: SessionPool) :
+        with pool.session() as pssn:
+            pssn.close_read_transaction()
+            with pssn.ssn.transaction(TransactionType.WRITE) as wtrans:
+                yield wtrans
+                wtrans.commit()
+        with pool.lock : pool.write_gen += 1
+
     # TypeDB Queries
     def match_query(self, query: str, varname: str) -> List[str] :
         self.change_state(2) # QUERYING
-        with self.cli.session(kb_name, SessionType.DATA) as data_ssn:
-            with data_ssn.transaction(TransactionType.READ) as rtrans:
-                concept_maps = rtrans.query().match(query)
-                results = [concept_map.get(varname).get_value() for concept_map in concept_maps]
+        tic = time.perf_counter()
+        with self.data_pool.session() as pssn:
+            rtrans = pssn.read_transaction(self.data_pool.write_gen, self.read_ttl if self.data_pool.pooled else 0)
+            concept_maps = rtrans.query().match(query)
+            results = [concept_map.get(varname).get_value() for concept_map in concept_maps]
+            if not self.data_pool.pooled : pssn.close_read_transaction()
+        self.record_query('match', tic)
         return results
 
     def insert_query(self, query: str) -> None :
         self.change_state(2) # QUERYING
-        with self.cli.session(kb_name, SessionType.DATA) as data_ssn:
-            with data_ssn.transaction(TransactionType.WRITE) as wtrans:
-                wtrans.query().insert(query)
-                wtrans.commit()
+        tic = time.perf_counter()
+        with self.write_transaction(self.data_pool) as wtrans:
+            wtrans.query().insert(query)
+        self.record_query('insert', tic)
 
     def delete_query(self, query: str) -> None :
         self.change_state(2) # QUERYING
-        with self.cli.session(kb_name, SessionType.DATA) as data_ssn:
-            with data_ssn.transaction(TransactionType.WRITE) as wtrans:
-                wtrans.query().delete(query)
-                wtrans.commit()
+        tic = time.perf_counter()
+        with self.write_transaction(self.data_pool) as wtrans:
+            wtrans.query().delete(query)
+        self.record_query('delete', tic)
 
     def update_query(self, query: str) -> None :
         self.change_state(2) # QUERYING
-        with self.cli.session(kb_name, SessionType.DATA) as data_ssn:
-            with data_ssn.transaction(TransactionType.WRITE) as wtrans:
-                wtrans.query().update(query)
-                wtrans.commit()
+        tic = time.perf_counter()
+        with self.write_transaction(self.data_pool) as wtrans:
+            wtrans.query().update(query)
+        self.record_query('update', tic)
+
+    def update_queries(self, queries: List[str]) -> None :
+        self.change_state(2) # QUERYING
+        tic = time.perf_counter()
+        with self.write_transaction(self.data_pool) as wtrans:
+            for query in queries : wtrans.query().update(query)
+        self.record_query('update_batch', tic)
 
     def define_query(self, query: str) -> None :
         self.change_state(2) # QUERYING
+        tic = time.perf_counter()
+        # The SCHEMA session is closed right away, releasing the schema lock
         with self.cli.session(kb_name, SessionType.SCHEMA) as schema_ssn:
             with schema_ssn.transaction(TransactionType.WRITE) as wtrans:
                 wtrans.query().define(query)
                 wtrans.commit()
+        # Data sessions are reopened so they see the new schema
+        self.data_pool.invalidate()
+        self.record_query('define', tic)
+
+    # Load schema catalog
+    def load_catalog(self) -> None :
+        """Load the entity and relation types, the attribute types and the ownerships defined in the knowledge graph 
+        schema into the catalog, in a single read transaction.
+
+        Returns: 
+            None
+        """
+        catalog = SchemaCatalog()
+        # Schema concepts are readable from a DATA session (a SCHEMA session would hold the schema lock)
+        with self.data_pool.session() as pssn:
+            pssn.close_read_transaction()
+            with pssn.ssn.transaction(TransactionType.READ) as rtrans:
+                concepts = rtrans.concepts()
+                for root in (concepts.get_root_entity_type(), concepts.get_root_relation_type()) :
+                    for thing_type in root.as_remote(rtrans).get_subtypes() :
+                        if thing_type.is_root() : continue
+                        label, remote = thing_type.get_label().name(), thing_type.as_remote(rtrans)
+                        catalog.add_type(label, remote.get_supertype().get_label().name())
+                        for attrib_type in remote.get_owns() : catalog.add_owns(label, attrib_type.get_label().name())
+                for attrib_type in concepts.get_root_attribute_type().as_remote(rtrans).get_subtypes() :
+                    if attrib_type.is_root() : continue
+                    catalog.add_attrib(attrib_type.get_label().name(), str(attrib_type.get_value_type()))
+        self.catalog = catalog
+
+    # Commit pending definitions
+    def flush_schema(self) -> None :
+        """Commit all the definitions pending in the catalog in a single DEFINE query. Concurrent callers are 
+        grouped: the first one commits the definitions of all of them, and the others find nothing pending.
+
+        Returns: 
+            None
+        """
+        with self.schema_lock :
+            batch = self.catalog.take()
+            if not batch : return
+            defineq = self.catalog.build_query(batch)
+            if self.print_queries: print(defineq, kind='debug')
+            try : self.define_query(defineq)
+            except Exception :
+                self.catalog.forget(batch)
+                raise
+
+    # Declare device class
+    def declare_class(self, dev_class: str, template: Dict[str, Any]) -> None :
+        """Queue the definitions of a device class, its modules and their attributes that are missing from the schema, 
+        so that they are committed together with the next device definition.
+
+        Args:
+            dev_class (str): The class of the device.
+            template (dict): The class definition compiled by compile_define_template.
+        Returns: 
+            None
+        """
+        self.catalog.require_type(dev_class.lower(), 'device')
+        for mod_name, attribs in template['mod_attribs'].items() :
+            self.catalog.require_type(mod_name, 'module')
+            for attrib_name, tdbtype in attribs :
+                self.catalog.require_attrib(attrib_name, tdbtype)
+                self.catalog.require_owns(mod_name, attrib_name)
+
+    # Bulk load
+    def bulk_load(self, tql: str, batch_size: int = 100, n_jobs: int = None) -> Dict[str, float] :
+        """Insert the data of a TypeQL insert query in chunks committed in parallel, each in its own write transaction 
+        over the DATA sessions. All entities are committed first, and then the relations, matching their role players 
+        by their key (first) attribute.
+
+        Args:
+            tql (str): The insert query (e.g. typedbconfig/data.tql).
+            batch_size (int): The number of entities or relations inserted in each transaction.
+            n_jobs (int): The number of transactions committed in parallel (the number of DATA sessions if None).
+        Returns: 
+            dict: The number of entities, relations and queries, the elapsed time and the throughput (things/s).
+        """
+        entities, relations = parse_data_tql(tql)
+        phases = chunk_data(entities, relations, batch_size)
+        n_jobs = n_jobs or self.data_pool.size
+        n_queries, done = sum(len(queries) for queries in phases), 0
+        tic = time.perf_counter()
+        # Relations can only be matched once all entities are committed
+        for queries in phases :
+            for _ in Parallel(n_jobs=n_jobs, prefer='threads', return_as='generator_unordered')(delayed(self.insert_query)(query) for query in queries) :
+                done += 1
+                if n_queries >= 10 and done % (n_queries//10) == 0 : print(f'{kb_name} DATA LOADING <{done}/{n_queries} queries>', kind='info')
+        self.change_state(0) # IDLE
+        return self.report_load(len(entities), len(relations), n_queries, time.perf_counter() - tic)
 
     # Define device
     def define_device(self, dev_class: str, uuid: str) -> None :
@@ -197,10 +1653,57 @@ class TypeDBClient():
         Returns: 
             None
         """
-        # Build and run define / insert queries
-        self.define_query(f'define {dev_class.lower()} sub device;')
+        # Define the class (and anything declared) only if missing, then insert the device
+        self.catalog.require_type(dev_class.lower(), 'device')
+        self.flush_schema()
         self.insert_query(f'insert $dev isa {dev_class.lower()}, has uuid "{uuid}";')
 
+    # Define modules and attributes
+    def define_modules_attribs(self, dev_class: str, uuid: str, timestamp: str, template: Dict[str, Any]) -> None :
+        """Define the modules and attributes of a device class in the schema if needed, and add them to a device.
+
+        Args:
+            dev_class (str): The class of the device.
+            uuid (str): The unique identifier of the device.
+            timestamp (str): The timestamp of the update in ISO-8601 format.
+            template (dict): The class definition compiled by compile_define_template.
+        Returns: 
+            None
+        """
+        # Define in KG schema the modules, attributes and ownerships still missing (if any)
+        self.declare_class(dev_class, template)
+        self.flush_schema()
+
+        # Build match-insert query
+        insertq = template['insert'].fill(uuid=uuid, timestamp=timestamp[:-4])
+        
+        # Initialize in KG schema
+        if self.print_queries: print(insertq, kind='debug')
+        self.insert_query(insertq)
+
+    # Prepare attributes update
+    def prepare_update(self, dev_class: str, uuid: str, timestamp: str, data: Dict[str, Dict[str, Any]], template: 'QueryTemplate') -> str :
+        """Fill the precompiled match-delete-insert query updating the attributes of a device in.
+
+        Args:
+            dev_class (str): The class of the device.
+            uuid (str): The unique identifier of the device.
+            timestamp (str): The timestamp of the update in ISO-8601 format.
+            data (dict): The new attribute values, as {'module_name': {'attribute_name': attribute_value, ...}, ...}.
+            template (QueryTemplate): The update query compiled by compile_update_template for those attributes.
+        Returns: 
+            str: The update query.
+        """
+        values = [attrib_value for mod_dict in data.values() for attrib_value in mod_dict.values()]
+        query = template.fill(values, uuid=uuid, timestamp=timestamp[:-4])
+        if self.print_queries: print(query, kind='debug')
+        return query
+
+    # Apply attributes updates
+    def apply_updates(self, updates: List[str]) -> None :
+        if len(updates) == 1 : self.update_query(updates[0])
+        else : self.update_queries(updates)
+
     # Get device relations
     def replicate_relations(self, integ_uuid: str, noninteg_uuid: str) -> None :
         """Replicate the relations of an integrated device to a non-integrated device.
@@ -230,12 +1733,9 @@ class TypeDBClient():
         Returns: 
             None
         """
-        # Match and delete the device modules and its relations / attribute ownerships
-        matchq = 'match '
-        deleteq = 'delete '
-        for i, mod_uuid in enumerate(self.devices[uuid]['modules']) :
-            matchq += f'$mod{i} isa module, has uuid "{mod_uuid}";\n'
-            deleteq += f'$mod{i} isa module;\n'
+        # Match and delete the device modules (which share its uuid) and their relations / attribute ownerships
+        matchq = f'match $mod isa module, has uuid "{uuid}";\n'
+        deleteq = f'delete $mod isa module;\n'
         #print(matchq + '\n' + deleteq)
         self.delete_query(matchq + '\n' + deleteq)
 
@@ -246,14 +1746,258 @@ class TypeDBClient():
         self.delete_query(matchq + '\n' + deleteq)
         
     # Get device UUIDs present in the KG
-    def get_integrated_devices(self) -> Dict[str, Dict[str, Any]] :
+    def get_integrated_devices(self) -> List[str] :
         """Get the UUIDs of the integrated devices in the knowledge graph.
 
         Returns:
-            dict: A dictionary with the UUIDs of the integrated devices as keys and its dictionaries to be filled.
+            list: The UUIDs of the integrated devices.
+        """
+        return self.match_query('match $dev isa device, has uuid $devuuid;','devuuid')
+
+    # Get devices state
+    def hydrate_devices(self) -> Dict[str, Dict[str, Any]] :
+        """Get the type, latest timestamp, modules and attribute values of every device in the knowledge graph with 
+        a single match query, whose answers are streamed (modules own the uuid of their device, and every device 
+        matches at least through its uuid).
+
+        Returns:
+            dict: {uuid: {'type': str, 'timestamp': datetime or None, 'modules': {module: {attribute: (tdbtype, value)}}}}.
+        """
+        query = ('match $dev isa! $devtype, has uuid $uuid; $devtype sub device; '
+                 '$owner isa! $ownertype, has uuid $uuid, has $attr; $attr isa! $attrtype;')
+        devices = {}
+        self.change_state(2) # QUERYING
+        tic = time.perf_counter()
+        with self.data_pool.session() as pssn:
+            pssn.close_read_transaction()
+            with pssn.ssn.transaction(TransactionType.READ) as rtrans:
+                for concept_map in rtrans.query().match(query) :
+                    dev_type, attrib_name = concept_map.get('devtype').get_label().name(), concept_map.get('attrtype').get_label().name()
+                    dev = devices.setdefault(concept_map.get('uuid').get_value(), {'type': dev_type, 'timestamp': None, 'modules': {}})
+                    if attrib_name == 'uuid' : continue
+                    owner_type, value = concept_map.get('ownertype').get_label().name(), concept_map.get('attr').get_value()
+                    if owner_type == dev_type : 
+                        if attrib_name == 'timestamp' and (dev['timestamp'] is None or value > dev['timestamp']) : dev['timestamp'] = value
+                    else : dev['modules'].setdefault(owner_type, {})[attrib_name] = (self.catalog.attribs.get(attrib_name), value)
+        self.record_query('hydrate', tic)
+        return devices
+
+# In-memory knowledge graph
+class InMemoryGraph(KGBackend):
+    """A knowledge graph kept in memory, following the semantics of the TypeDB schema and initial data 
+    (typedbconfig/schema.tql and data.tql). Entities and relations are stored in dictionaries indexed by 
+    id, and looked up through type, uuid and role player indexes. Each operation can be delayed by an 
+    injected latency to emulate the cost of a database server.
+
+    Attributes:
+        latency (float): The time (in seconds) each operation is delayed.
+        supertypes (dict): The supertype of each type ({type: supertype}).
+        value_types (dict): The value type of each attribute type ({attribute: tdbtype}).
+        owns (dict): The attribute types each type owns ({type: set(attributes)}).
+        entities (dict): The entities, as {id: {'type': str, 'attrs': {attribute: [values]}}}.
+        relations (dict): The relations, as {id: {'type': str, 'players': [(role, entity_id), ...]}}.
+        by_uuid (dict): The ids of the entities owning each uuid ({uuid: set(ids)}).
+        by_type (dict): The ids of the entities of each type ({type: set(ids)}).
+        plays (dict): The ids of the relations each entity plays a role in ({entity_id: set(ids)}).
+        lock (RLock): The lock serializing the operations (as a write transaction would).
+
+    Methods:
+        (the KGBackend operations)
+        isa(thing_type: str, supertype: str) -> bool: Check if a type is (a subtype of) another.
+        get_device(uuid: str) -> Dict[str, Any]: Get a device, its attributes, modules and related tasks.
+    """
+
+    # Initialization
+    def __init__(self, latency=0.0, metrics=None, on_state=None, data_path='typedbconfig/data.tql'):
+        KGBackend.__init__(self, metrics, on_state, data_path)
+        self.latency = latency
+        self.lock = RLock()
+        self.initialization()
+
+    # Reset to the initial schema and data
+    def initialization(self) -> None :
+        with self.lock :
+            self.supertypes, self.value_types, self.owns = {}, {}, {}
+            self.entities, self.relations = {}, {}
+            self.by_uuid, self.by_type, self.plays = {}, {}, {}
+            self.next_id = 0
+            with open('typedbconfig/schema.tql') as f : self.load_schema(f.read())
+            with open(self.data_path) as f : self.bulk_load(f.read())
+        print(f'{kb_name} IN-MEMORY KB INITIALIZED.', kind='success')
+
+    # Parse schema definitions (type hierarchy, attribute value types and ownerships)
+    def load_schema(self, tql: str) -> None :
+        tql = re.sub(r'#.*', '', tql)
+        for statement in tql.replace('define', '', 1).split(';') :
+            match = re.match(r'\s*(\w+)\s+sub\s+(\w+)', statement)
+            if match is None : continue
+            thing_type, supertype = match.groups()
+            self.supertypes[thing_type] = supertype
+            value = re.search(r'value\s+(\w+)', statement)
+            if value : self.value_types[thing_type] = value.group(1)
+            self.owns.setdefault(thing_type, set()).update(re.findall(r'owns\s+(\w+)', statement))
+
+    # Insert initial data (entities with attributes, and relations between them)
+    def load_data(self, tql: str) -> Tuple[int, int] :
+        entities, relations = parse_data_tql(tql)
+        variables = {}
+        with self.lock :
+            for var, thing_type, attrs in entities :
+                variables[var] = self.insert_entity(thing_type, {attr: [value] for attr, value in attrs})
+            for _, rel_type, players in relations :
+                self.insert_relation(rel_type, [(role, variables[var]) for role, var in players])
+        return len(entities), len(relations)
+
+    # Bulk load (in a single step, as the operations are serialized anyway)
+    def bulk_load(self, tql: str, batch_size: int = 100, n_jobs: int = None) -> Dict[str, float] :
+        tic = time.perf_counter()
+        n_entities, n_relations = self.load_data(tql)
+        return self.report_load(n_entities, n_relations, 1, time.perf_counter() - tic)
+
+    # Type hierarchy
+    def isa(self, thing_type: str, supertype: str) -> bool :
+        while thing_type is not None :
+            if thing_type == supertype : return True
+            thing_type = self.supertypes.get(thing_type)
+        return False
+
+    # Insert entity
+    def insert_entity(self, thing_type: str, attrs: Dict[str, List[Any]]) -> int :
+        entity_id, self.next_id = self.next_id, self.next_id + 1
+        self.entities[entity_id] = {'type': thing_type, 'attrs': attrs}
+        self.by_type.setdefault(thing_type, set()).add(entity_id)
+        for uuid in attrs.get('uuid', []) : self.by_uuid.setdefault(uuid, set()).add(entity_id)
+        return entity_id
+
+    # Insert relation
+    def insert_relation(self, rel_type: str, players: List[Tuple[str, int]]) -> int :
+        rel_id, self.next_id = self.next_id, self.next_id + 1
+        self.relations[rel_id] = {'type': rel_type, 'players': players}
+        for _, entity_id in players : self.plays.setdefault(entity_id, set()).add(rel_id)
+        return rel_id
+
+    # Delete entity (relations left without role players are deleted too)
+    def delete_entity(self, entity_id: int) -> None :
+        entity = self.entities.pop(entity_id)
+        self.by_type[entity['type']].discard(entity_id)
+        for uuid in entity['attrs'].get('uuid', []) : self.by_uuid[uuid].discard(entity_id)
+        for rel_id in self.plays.pop(entity_id, set()) :
+            relation = self.relations[rel_id]
+            relation['players'] = [(role, player) for role, player in relation['players'] if player != entity_id]
+            if not relation['players'] : del self.relations[rel_id]
+
+    # Entities with a given uuid and (super)type
+    def find(self, uuid: str, supertype: str) -> List[int] :
+        return [entity_id for entity_id in self.by_uuid.get(uuid, ()) if self.isa(self.entities[entity_id]['type'], supertype)]
+
+    # Emulated operation latency
+    @contextmanager
+    def operation(self, kind: str) :
+        self.change_state(2) # QUERYING
+        tic = time.perf_counter()
+        if self.latency > 0 : time.sleep(self.latency)
+        with self.lock : yield
+        self.record_query(kind, tic)
+
+    # Define device
+    def define_device(self, dev_class: str, uuid: str) -> None :
+        with self.operation('define') :
+            self.supertypes.setdefault(dev_class.lower(), 'device')
+        with self.operation('insert') :
+            self.insert_entity(dev_class.lower(), {'uuid': [uuid]})
+
+    # Define modules and attributes
+    def define_modules_attribs(self, dev_class: str, uuid: str, timestamp: str, template: Dict[str, Any]) -> None :
+        with self.operation('define') :
+            for attrib_name, tdbtype in template['attribs'] :
+                self.supertypes.setdefault(attrib_name, 'attribute')
+                self.value_types.setdefault(attrib_name, tdbtype)
+            for mod_name, attribs in template['mod_attribs'].items() :
+                self.supertypes.setdefault(mod_name, 'module')
+                self.owns.setdefault(mod_name, set()).update(attrib_name for attrib_name, _ in attribs)
+        with self.operation('insert') :
+            # The inserted timestamp is added to the ones the device already has
+            for dev_id in self.find(uuid, 'device') :
+                modules = []
+                self.entities[dev_id]['attrs'].setdefault('timestamp', []).append(timestamp[:-4])
+                for mod_name, attribs in template['mod_attribs'].items() :
+                    attrs = {attrib_name: [defvalues[tdbtype]] for attrib_name, tdbtype in attribs}
+                    modules.append(self.insert_entity(mod_name, {'uuid': [uuid], **attrs}))
+                self.insert_relation('includes', [('device', dev_id)] + [('module', mod_id) for mod_id in modules])
+
+    # Prepare attributes update
+    def prepare_update(self, dev_class: str, uuid: str, timestamp: str, data: Dict[str, Dict[str, Any]], template: 'QueryTemplate' = None) -> Tuple[str, str, str, Dict[str, Dict[str, Any]]] :
+        return (dev_class.lower(), uuid, timestamp[:-4], data)
+
+    # Apply attributes updates (the device and modules are matched as the update query does)
+    def apply_updates(self, updates: List[Tuple[str, str, str, Dict[str, Dict[str, Any]]]]) -> None :
+        with self.operation('update' if len(updates) == 1 else 'update_batch') :
+            for dev_type, uuid, timestamp, data in updates :
+                devs = [dev_id for dev_id in self.find(uuid, dev_type) if 'timestamp' in self.entities[dev_id]['attrs']]
+                mods = {mod_name: [mod_id for mod_id in self.find(uuid, mod_name) if all(attr in self.entities[mod_id]['attrs'] for attr in mod_dict)] 
+                        for mod_name, mod_dict in data.items()}
+                if not devs or not all(mods.values()) : continue
+                for dev_id in devs : self.entities[dev_id]['attrs']['timestamp'] = [timestamp]
+                for mod_name, mod_dict in data.items() :
+                    for mod_id in mods[mod_name] :
+                        self.entities[mod_id]['attrs'].update({attrib_name: [value] for attrib_name, value in mod_dict.items()})
+
+    # Replicate 'needs' relations
+    def replicate_relations(self, integ_uuid: str, noninteg_uuid: str) -> None :
+        with self.operation('insert') :
+            tasks = [player for dev_id in self.find(integ_uuid, 'device') for rel_id in self.plays.get(dev_id, ()) 
+                     if self.relations[rel_id]['type'] == 'needs' and ('device', dev_id) in self.relations[rel_id]['players']
+                     for role, player in self.relations[rel_id]['players'] if role == 'task']
+            for dev_id in self.find(noninteg_uuid, 'device') :
+                for task_id in tasks : self.insert_relation('needs', [('task', task_id), ('device', dev_id)])
+
+    # Disintegrate device and its modules
+    def disintegrate_device(self, uuid: str) -> None :
+        with self.operation('delete') :
+            for mod_id in self.find(uuid, 'module') : self.delete_entity(mod_id)
+        with self.operation('delete') :
+            for dev_id in self.find(uuid, 'device') : self.delete_entity(dev_id)
+
+    # Get device UUIDs
+    def get_integrated_devices(self) -> List[str] :
+        with self.operation('match') :
+            return [uuid for entity in self.entities.values() if self.isa(entity['type'], 'device') for uuid in entity['attrs'].get('uuid', [])]
+
+    # Get devices state
+    def hydrate_devices(self) -> Dict[str, Dict[str, Any]] :
+        with self.operation('hydrate') :
+            devices = {}
+            for dev_id in [entity_id for thing_type, ids in self.by_type.items() if self.isa(thing_type, 'device') for entity_id in ids] :
+                entity = self.entities[dev_id]
+                timestamps = entity['attrs'].get('timestamp', [])
+                modules = {self.entities[mod_id]['type']: {attrib_name: (self.value_types.get(attrib_name), values[-1]) 
+                                                           for attrib_name, values in self.entities[mod_id]['attrs'].items() if attrib_name != 'uuid'}
+                           for rel_id in self.plays.get(dev_id, ()) if self.relations[rel_id]['type'] == 'includes'
+                           for role, mod_id in self.relations[rel_id]['players'] if role == 'module'}
+                for uuid in entity['attrs'].get('uuid', []) :
+                    devices[uuid] = {'type': entity['type'], 'timestamp': max(datetime.fromisoformat(ts) for ts in timestamps) if timestamps else None, 
+                                     'modules': modules}
+            return devices
+
+    # Get device
+    def get_device(self, uuid: str) -> Dict[str, Any] :
+        """Get a device, its attributes, the attributes of its modules and the names of the tasks that need it.
+
+        Args:
+            uuid (str): The unique identifier of the device.
+        Returns: 
+            dict: {'type': str, 'attrs': dict, 'modules': {module_type: attrs}, 'tasks': [task names]} (None if not found).
         """
-        dev_uuids = self.match_query('match $dev isa device, has uuid $devuuid;','devuuid')
-        return {k: {'class': '', 'integrated': True, 'period': 0, 'timestamps': [], 'modules':{}} for k in dev_uuids}
+        with self.lock :
+            devs = self.find(uuid, 'device')
+            if not devs : return None
+            dev_id = devs[0]
+            related = [self.relations[rel_id] for rel_id in self.plays.get(dev_id, ())]
+            modules = {self.entities[mod_id]['type']: self.entities[mod_id]['attrs'] for rel in related if rel['type'] == 'includes' 
+                       for role, mod_id in rel['players'] if role == 'module'}
+            tasks = [self.entities[task_id]['attrs']['name'][0] for rel in related if rel['type'] == 'needs' 
+                     for role, task_id in rel['players'] if role == 'task']
+            return {'type': self.entities[dev_id]['type'], 'attrs': self.entities[dev_id]['attrs'], 'modules': modules, 'tasks': tasks}
     
 # SDF manager to handle devices and modules definitions
 class SDFManager() :
@@ -262,17 +2006,24 @@ class SDFManager() :
     Attributes:
         path (str): The path to the folder containing the SDF files.
         sdf_cache (dict): A cache of previously loaded SDF files, with the file names as keys and the SDF content as values.
+        file_hashes (dict): The hash of the content of each referenced SDF file, with the file names as keys.
+        similarity (SimilarityCache): The similarities and votes between classes, kept between runs.
+        index (SDFIndex): The properties of the classes built so far, to find the closest classes to a new one.
 
     Methods:
-        __init__(path: str) -> None: Initialization.
+        __init__(path: str, cache_path: str) -> None: Initialization.
         get_all_sdfs() -> Tuple[Dict[str, Any], Dict[str, pd.DataFrame]]: Load all files in the folder.
         build_sdf(dev_class: str) -> Tuple[Dict[str, Any], pd.DataFrame]: Read SDF files completing content through references.
         build_sdf_df(sdf: Dict[str, Any]) -> pd.DataFrame: Add SDF description to a DataFrame.
+        get_class_names() -> List[str]: Get the names of the device classes described in the folder.
     """
     # Initialization
-    def __init__(self, path='sdf/'):
+    def __init__(self, path='sdf/', cache_path=None):
         self.path = path
         self.sdf_cache = {}
+        self.file_hashes = {}
+        self.similarity = SimilarityCache(cache_path)
+        self.index = SDFIndex(self.similarity)
     
     # Load all files in folder
     def get_all_sdfs(self) -> Tuple[Dict[str, Any], Dict[str, pd.DataFrame]] :
@@ -283,14 +2034,20 @@ class SDFManager() :
             sdfs[dev_class], sdf_dfs[dev_class] = self.build_sdf(dev_class)
         return sdfs, sdf_dfs
 
+    # Device classes in folder
+    def get_class_names(self) -> List[str] :
+        return [filename.split('.')[0] for filename in os.listdir(self.path) if filename.split('.')[0] != 'sdfData']
+
     # Read SDF files completing content through references
     def build_sdf(self, dev_class: str) -> Tuple[Dict[str, Any], pd.DataFrame] :
         # Retrieve original sdf text
-        with open(self.path+'/'+dev_class+'.sdf.json', 'r') as sdf_file: inner_sdf = benedict(loads(sdf_file.read()))
+        with open(self.path+'/'+dev_class+'.sdf.json', 'r') as sdf_file: sdf_text = sdf_file.read()
+        inner_sdf = benedict(loads(sdf_text))
         
         # Find dict paths to all sdf references and its associated sdfRef
         paths = get_ref_paths(inner_sdf)
         # Iterate through references replacing them by their referenced value
+        filenames = set()
         for path, sdfRef in paths.items() :
             filename = sdfRef.split('/')[0]
             innerpath = '.'.join(sdfRef.split('/')[1:])
@@ -298,13 +2055,20 @@ class SDFManager() :
                 value = inner_sdf[innerpath]
             else : # reference to an outer sdf file path
                 if filename not in self.sdf_cache: # add sdf to cache if not there
-                    with open(self.path+filename+'.sdf.json', 'r') as sdf_file:
-                        self.sdf_cache[filename] = benedict(loads(sdf_file.read()))
+                    with open(self.path+filename+'.sdf.json', 'r') as sdf_file: outer_text = sdf_file.read()
+                    self.sdf_cache[filename] = benedict(loads(outer_text))
+                    self.file_hashes[filename] = hashlib.sha1(outer_text.encode()).hexdigest()
                 value = self.sdf_cache[filename][innerpath]
+                filenames.add(filename)
             inner_sdf[path] = value # replace by referenced value
         
-        # Build sdf DataFrame
+        # Cached similarities are kept while neither the file nor the files it references change
+        fingerprint = hashlib.sha1('|'.join([sdf_text] + [self.file_hashes[filename] for filename in sorted(filenames)]).encode()).hexdigest()
+        self.similarity.validate(dev_class, fingerprint)
+
+        # Build sdf DataFrame and index its properties
         inner_sdf_df = self.build_sdf_df(inner_sdf.copy())
+        self.index.add(inner_sdf_df)
         return inner_sdf, inner_sdf_df
     
     # Add sdf description to DataFrame
@@ -323,45 +2087,553 @@ class SDFManager() :
 
         return pd.DataFrame(columns=sdf_cols,data=rows)
 
-# Class to handle datetimes in JSON printing
-class ModifiedEncoder(JSONEncoder):
-    """Class to handle datetime objects when encoding to JSON.
-
-    Overrides the default method of the JSONEncoder class to convert datetime objects to strings in the desired format before encoding.
+# Persistent cache of the similarities between SDF classes
+class SimilarityCache() :
     """
+    A cache of the similarities between the properties of each pair of SDF classes (the blocks of the matrices 
+    SDFIndex computes, fuzz.ratio scores by property type) and of the last votes of each class, kept in a JSON file 
+    between runs. Each class is identified by a fingerprint of its .sdf.json file and of the files it references 
+    (e.g. sdfData), and its entries are dropped when the fingerprint changes. The votes of a class are only reused 
+    if the classes indexed (and their fingerprints) are the same. The file is written off the integration path 
+    (by StatsSink, with every snapshot).
 
-    def default(self, obj):
-        """Convert datetime objects to strings before encoding.
-
-        Args:
-            obj (Any): The object to be encoded.
+    Attributes:
+        path (str): The path of the JSON file (None to keep the cache in memory only).
+        fingerprints (dict): The fingerprint of each class, as {class: str}.
+        scores (dict): The similarities between the properties of the same type of two classes, as 
+                       {'class|class|type': [[int, ...], ...]}.
+        votes (dict): The last votes of each class, as {class: {'signature': str, 'votes': list}}.
+        dirty (bool): Whether there are changes not saved yet.
 
-        Returns:
-            str: The string representation of the datetime object in the desired format, or the result of the default method if obj is not a datetime object.
-        """
-        if isinstance(obj,datetime): return obj.strftime("%Y-%m-%dT%H:%M:%S.%f")
-        return JSONEncoder.default(self, obj)
+    Methods:
+        validate(dev_class: str, fingerprint: str) -> bool: Records the fingerprint of a class, dropping its entries if it changed.
+        signature(classes: List[str], score: int) -> str: Identifies a set of indexed classes.
+        get_scores(a: str, b: str, prop_type: str) -> numpy.ndarray: Gets the similarities of two classes (None if not cached).
+        put_scores(a: str, b: str, prop_type: str, scores: numpy.ndarray) -> None: Caches the similarities of two classes.
+        get_votes(dev_class: str, signature: str) -> List[Dict[str, int]]: Gets the votes of a class (None if not cached).
+        put_votes(dev_class: str, signature: str, votes: list) -> None: Caches the votes of a class.
+        save() -> None: Writes the changes to the file, replacing it atomically.
+    """
+    # Initialization
+    def __init__(self, path: str = None):
+        self.path = path
+        self.fingerprints, self.scores, self.votes = {}, {}, {}
+        self.dirty = False
+        self.lock = Lock()
+        if path is None or not os.path.exists(path) : return
+        try :
+            with open(path, 'rb') as f : cache = fast_loads(f.read())
+            self.fingerprints, self.scores, self.votes = cache['fingerprints'], cache['scores'], cache['votes']
+        except (ValueError, KeyError) :
+            print(f'SIMILARITY CACHE DISCARDED <{path}>', kind='fail')
+
+    # Record class fingerprint
+    def validate(self, dev_class: str, fingerprint: str) -> bool :
+        with self.lock :
+            if self.fingerprints.get(dev_class) == fingerprint : return True
+            # Class changed (or unknown): drop its similarities and votes (the votes of other classes no longer match their signature)
+            self.fingerprints[dev_class] = fingerprint
+            self.scores = {key: scores for key, scores in self.scores.items() if dev_class not in key.split('|')[:2]}
+            self.votes.pop(dev_class, None)
+            self.dirty = True
+            return False
+
+    # Set of indexed classes
+    def signature(self, classes: List[str], score: int) -> str :
+        return hashlib.sha1('|'.join([str(score)] + [f'{dev_class}:{self.fingerprints.get(dev_class)}' for dev_class in classes]).encode()).hexdigest()
+
+    # Cached similarities of two classes
+    def get_scores(self, a: str, b: str, prop_type: str) -> np.ndarray :
+        scores = self.scores.get(f'{a}|{b}|{prop_type}')
+        if scores is not None : return np.array(scores, dtype=np.int64)
+        # fuzz.ratio is symmetric
+        scores = self.scores.get(f'{b}|{a}|{prop_type}')
+        if scores is not None : return np.array(scores, dtype=np.int64).T
+        return None
+
+    # Cache similarities of two classes
+    def put_scores(self, a: str, b: str, prop_type: str, scores: np.ndarray) -> None :
+        with self.lock :
+            self.scores[f'{a}|{b}|{prop_type}'] = scores.tolist()
+            self.dirty = True
+
+    # Cached votes of a class
+    def get_votes(self, dev_class: str, signature: str) -> List[Dict[str, int]] :
+        entry = self.votes.get(dev_class)
+        return entry['votes'] if entry is not None and entry['signature'] == signature else None
+
+    # Cache votes of a class
+    def put_votes(self, dev_class: str, signature: str, votes: List[Dict[str, int]]) -> None :
+        with self.lock :
+            self.votes[dev_class] = {'signature': signature, 'votes': votes}
+            self.dirty = True
+
+    # Write changes to file
+    def save(self) -> None :
+        # Entries are replaced, never changed: copies of the dictionaries are written without holding the lock
+        with self.lock :
+            if self.path is None or not self.dirty : return
+            cache = {'fingerprints': dict(self.fingerprints), 'scores': dict(self.scores), 'votes': dict(self.votes)}
+            self.dirty = False
+        try :
+            with open(self.path + '.tmp', 'w') as f : f.write(dumps(cache))
+            os.replace(self.path + '.tmp', self.path)
+        except Exception :
+            self.dirty = True
+            raise
+
+# Index of SDF properties
+class SDFIndex() :
+    """
+    An index of the properties of the SDF classes, partitioned by property type, to find the closest classes to a 
+    new one. Each partition keeps the text description ('prop prop_desc') and the class of its properties in the 
+    order the classes were added (as in the SDF DataFrame of the agent), so the similarities between the properties 
+    of a class and all the indexed ones of the same type are computed in a single vectorized call (rapidfuzz cdist, 
+    with the ratio fuzz.ratio rounds). Each property gives score points to its most similar other class, one less 
+    to the next distinct one, and so on. With a cache, the similarities are computed once for each pair of classes, 
+    and the votes once for each set of indexed classes.
 
-####################################################
-######## CLASSES AND TIME SERIES SIMILARITY ########
-####################################################
+    Attributes:
+        partitions (dict): The properties of each type, as {prop_type: {'things': numpy.ndarray, 'descs': list}}.
+        classes (list): The classes indexed, in the order they were added.
+        cache (SimilarityCache): The cached similarities and votes (None to always compute them).
 
-# Compute string edit distance
-def calc_str_dist(non_integ_class_row_desc, row):
-    """Compute the string edit distance between two strings.
+    Methods:
+        add(sdf_df: pd.DataFrame) -> None: Index the properties of the classes not indexed yet.
+        votes(dev_class: str, noninteg_class: pd.DataFrame, score: int) -> List[Dict[str, int]]: Get the votes of each 
+            property of a class for the closest other classes.
+        scores(dev_class: str, prop_type: str, queries: list, things: numpy.ndarray, descs: list) -> numpy.ndarray: Get the 
+            similarities of the properties of a class with the indexed ones of the same type.
+    """
+    # Initialization
+    def __init__(self, cache: SimilarityCache = None):
+        self.partitions = {}
+        self.classes = []
+        self.cache = cache
+
+    # Index new classes
+    def add(self, sdf_df: pd.DataFrame) -> None :
+        new = sdf_df[~sdf_df.thing.isin(self.classes)]
+        if new.empty : return
+        descs = (new.prop + ' ' + new.prop_desc).tolist()
+        for prop_type, rows in new.groupby('prop_type', sort=False).indices.items() :
+            partition = self.partitions.setdefault(prop_type, {'things': np.empty(0, dtype=object), 'descs': []})
+            partition['things'] = np.concatenate([partition['things'], new.thing.to_numpy(dtype=object)[rows]])
+            partition['descs'] += [descs[row] for row in rows]
+        self.classes += new.thing.unique().tolist()
+
+    # Votes of each property of a class
+    def votes(self, dev_class: str, noninteg_class: pd.DataFrame, score: int = 3) -> List[Dict[str, int]] :
+        if self.cache is not None :
+            signature = self.cache.signature(self.classes, score)
+            votes = self.cache.get_votes(dev_class, signature)
+            if votes is not None : return votes
+        votes = [{} for _ in range(noninteg_class.shape[0])]
+        queries = (noninteg_class.prop + ' ' + noninteg_class.prop_desc).tolist()
+        for prop_type, rows in noninteg_class.groupby('prop_type', sort=False).indices.items() :
+            partition = self.partitions.get(prop_type)
+            if partition is None : continue
+            # Properties of the other classes
+            others = partition['things'] != dev_class
+            if not others.any() : continue
+            things = partition['things'][others]
+            descs = [desc for desc, other in zip(partition['descs'], others) if other]
+            str_dists = self.scores(dev_class, prop_type, [queries[row] for row in rows], things, descs)
+            for row, row_dists in zip(rows, str_dists) :
+                # Give points based on closeness (ties in the order of a descending pandas sort)
+                points = score
+                for pos in pd.Series(row_dists).sort_values(ascending=False).index :
+                    if points == 0 : break
+                    if things[pos] in votes[row] : continue
+                    votes[row][things[pos]] = points
+                    points -= 1
+        if self.cache is not None : self.cache.put_votes(dev_class, signature, votes)
+        return votes
+
+    # Similarity of every property of a class with every indexed one of the same type (rounded as fuzz.ratio)
+    def scores(self, dev_class: str, prop_type: str, queries: List[str], things: np.ndarray, descs: List[str]) -> np.ndarray :
+        if self.cache is None : return np.rint(cdist(queries, descs, scorer=rf_ratio, dtype=np.float64)).astype(np.int64)
+        # The properties of each class are contiguous: one block of cached similarities per class
+        bounds = np.flatnonzero(np.r_[True, things[1:] != things[:-1], True])
+        blocks = [self.cache.get_scores(dev_class, things[start], prop_type) for start in bounds[:-1]]
+        if all(block is not None and block.shape == (len(queries), end-start) for block, start, end in zip(blocks, bounds[:-1], bounds[1:])) :
+            return np.concatenate(blocks, axis=1)
+        # Computed in a single call if any block is missing
+        str_dists = np.rint(cdist(queries, descs, scorer=rf_ratio, dtype=np.float64)).astype(np.int64)
+        for block, start, end in zip(blocks, bounds[:-1], bounds[1:]) :
+            if block is None or block.shape != (len(queries), end-start) : self.cache.put_scores(dev_class, things[start], prop_type, str_dists[:, start:end])
+        return str_dists
+
+# Ring buffer for device samples
+class RingBuffer() :
+    """
+    A preallocated NumPy ring buffer. Every sample is written twice (at its position and one capacity
+    further), so the buffered samples are always available as a contiguous view without copying.
 
-    Parameters
-    ----------
-    non_integ_class_row_desc (str): The first string.
-    row (pandas.Series): A series containing the second string in the 'prop' column and its description in the 'prop_desc' column.
+    Attributes:
+        capacity (int): The maximum number of buffered samples before the buffer has to grow.
+        buf (numpy.ndarray): The underlying array, of length 2*capacity.
+        head (int): The position where the next sample will be written.
+        size (int): The number of buffered samples.
+        fill (Any): The value appended when a sample is missing.
 
-    Returns
-    -------
-    int: The string edit distance between the two input strings.
+    Methods:
+        append(value: Any) -> None: Appends a sample, overwriting the oldest one if the buffer is full.
+        extend(values: numpy.ndarray) -> None: Appends several samples, overwriting the oldest ones if the buffer is full.
+        drop(n: int) -> None: Drops the n oldest samples.
+        grow(capacity: int) -> None: Reallocates the buffer with a bigger capacity.
+        window() -> numpy.ndarray: Returns a view of the buffered samples, from oldest to newest.
+    """
+    # Initialization
+    def __init__(self, capacity=64, dtype=np.float64, fill=np.nan):
+        self.capacity = capacity
+        self.buf = np.empty(2*capacity, dtype=dtype)
+        self.head = 0
+        self.size = 0
+        self.fill = fill
+
+    # Append sample
+    def append(self, value: Any) -> None :
+        self.buf[self.head] = value
+        self.buf[self.head+self.capacity] = value
+        self.head = (self.head+1) % self.capacity
+        if self.size < self.capacity : self.size += 1
+
+    # Append several samples
+    def extend(self, values: np.ndarray) -> None :
+        values = values[-self.capacity:]
+        pos = (self.head + np.arange(len(values))) % self.capacity
+        self.buf[pos] = values
+        self.buf[pos+self.capacity] = values
+        self.head = (self.head+len(values)) % self.capacity
+        self.size = min(self.size+len(values), self.capacity)
+
+    # Drop oldest samples
+    def drop(self, n: int) -> None :
+        self.size -= min(n, self.size)
+
+    # Reallocate with a bigger capacity
+    def grow(self, capacity: int) -> None :
+        window = self.window()
+        buf = np.empty(2*capacity, dtype=self.buf.dtype)
+        buf[:self.size] = window
+        buf[capacity:capacity+self.size] = window
+        self.buf, self.capacity, self.head = buf, capacity, self.size % capacity
+
+    # Contiguous view of the buffered samples
+    def window(self) -> np.ndarray :
+        end = self.head + self.capacity
+        return self.buf[end-self.size:end]
+
+    def __len__(self) -> int :
+        return self.size
+
+    def __iter__(self) :
+        return iter(self.window())
+
+    def __getitem__(self, i) :
+        return self.window()[i]
+
+# Memory-mapped snapshot of device buffers
+class BufferSnapshot() :
     """
-    return fuzz.ratio(non_integ_class_row_desc, row['prop'] + ' ' + row['prop_desc'])
+    A memory-mapped snapshot of the samples buffered by the devices. The file holds the raw arrays of the 
+    timestamps and attribute values of every device (8-byte aligned), followed by a JSON index with their 
+    offsets and by the offset of the index (8 bytes). Opening a snapshot only reads its index: the arrays of a 
+    device are mapped and copied into its buffers when it is loaded.
 
-# Compute voting results df
+    Attributes:
+        path (str): The path of the snapshot file.
+        data (numpy.memmap): The mapped file.
+        index (dict): The class, integration flag and period of each device, and the offset, length, dtype 
+                      (and TypeDB type) of its arrays, as {uuid: {'class': str, 'integrated': bool, 'period': float, 
+                      'timestamps': [offset, n, dtype], 'modules': {mod: {attrib: [offset, n, dtype, tdbtype]}}}}.
+
+    Methods:
+        write(path: str, devices: dict) -> None: Writes the memory of the devices (see copy_devices), replacing the file atomically.
+        load(uuid: str, threshold: float) -> Dict[str, Any]: Builds the memory of a device, without the samples older than threshold.
+        newest() -> float: Returns the timestamp of the newest sample in the snapshot.
+    """
+    # Initialization
+    def __init__(self, path: str):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        index_offset = int(self.data[-8:].view('<u8')[0])
+        self.index = loads(bytes(self.data[index_offset:-8]))
+
+    def __contains__(self, uuid: str) -> bool :
+        return uuid in self.index
+
+    def __len__(self) -> int :
+        return len(self.index)
+
+    # Write snapshot
+    @staticmethod
+    def write(path: str, devices: Dict[str, Dict[str, Any]]) -> None :
+        chunks, offset = [], 0
+        def add(values: np.ndarray) -> List[Any] :
+            nonlocal offset
+            # Strings are stored as fixed-width unicode (missing values as '')
+            if values.dtype == object : values = np.array(['' if value is None else str(value) for value in values], dtype=str)
+            raw = np.ascontiguousarray(values).tobytes()
+            entry = [offset, len(values), values.dtype.str]
+            chunks.append(raw + bytes(-len(raw) % 8))
+            offset += len(chunks[-1])
+            return entry
+        index = {}
+        for dev_uuid, dev in devices.items() :
+            index[dev_uuid] = {'class': dev['class'], 'integrated': bool(dev['integrated']), 'period': float(dev['period']),
+                               'timestamps': add(np.asarray(dev['timestamps'], dtype=np.float64)),
+                               'modules': {mod_name: {attrib_name: add(values) + [buffer_tdbtype(values.dtype)] for attrib_name, values in attribs_dic.items()} 
+                                           for mod_name, attribs_dic in dev['modules'].items()}}
+        with open(path + '.tmp', 'wb') as f :
+            for chunk in chunks : f.write(chunk)
+            f.write(dumps(index).encode())
+            f.write(np.array([offset], dtype='<u8').tobytes())
+        os.replace(path + '.tmp', path)
+
+    # Mapped array
+    def array(self, entry: List[Any]) -> np.ndarray :
+        offset, n, dtype = entry[:3]
+        dtype = np.dtype(dtype)
+        return self.data[offset:offset+n*dtype.itemsize].view(dtype)
+
+    # Load device memory
+    def load(self, uuid: str, threshold: float = -np.inf) -> Dict[str, Any] :
+        entry = self.index[uuid]
+        timestamps = self.array(entry['timestamps'])
+        start = int(np.searchsorted(timestamps, threshold, side='left'))
+        # Buffers big enough for all the samples kept
+        dev = init_device(entry['class'], entry['integrated'])
+        dev['period'] = entry['period']
+        capacity = dev['timestamps'].capacity
+        while capacity < len(timestamps)-start : capacity *= 2
+        dev['timestamps'] = RingBuffer(capacity)
+        dev['timestamps'].extend(timestamps[start:])
+        for mod_name, attribs in entry['modules'].items() :
+            for attrib_name, attrib_entry in attribs.items() :
+                tdbtype = attrib_entry[3]
+                add_attrib_buffer(dev, mod_name, attrib_name, tdbtype)
+                values = self.array(attrib_entry)[start:]
+                if tdbtype == 'string' :
+                    values = values.astype(object)
+                    values[values == ''] = None
+                dev['modules'][mod_name][attrib_name].extend(values)
+        return dev
+
+    # Newest sample
+    def newest(self) -> float :
+        return max((float(self.array(entry['timestamps'])[-1]) for entry in self.index.values() if entry['timestamps'][1] > 0), default=-np.inf)
+
+# Columnar store of the device attributes compared by the integration algorithm
+class FeatureStore() :
+    """
+    A columnar store with a row for each attribute of each device (in module and attribute order), kept up to date 
+    as devices are defined, updated, integrated, restored and removed. The metadata (uuid, class, module, attribute, 
+    integration flag and period) are NumPy columns that the integration algorithm filters with boolean masks, and 
+    the values of each row are the ring buffer of the attribute in the device memory, so samples are never copied 
+    into the store. The rows of a device are registered again only when its buffers are replaced (its modules 
+    dictionary changes), and the rows left behind are dropped when they are the majority. The rows matching a 
+    query are read (labels and samples) while the store is locked, so they cannot be dropped or moved meanwhile.
+
+    Attributes:
+        columns (dict): The metadata columns ('uuid', 'class', 'mod', 'attrib', 'integ', 'period', 'seq', 'alive'), 
+                        the buffer of each row ('buffer') and the lock of its device ('lock'), with room for more rows.
+        n_rows (int): The number of rows used (alive or not).
+        rows (dict): The rows of each device, as {uuid: numpy.ndarray}.
+        layouts (dict): The modules dictionary each device was registered with, as {uuid: dict}.
+        seqs (dict): The order in which each device was first registered, as {uuid: int}.
+        next_seq (int): The order of the next device registered.
+
+    Methods:
+        update(uuid: str, dev: dict) -> None: Registers a device or updates its metadata.
+        remove(uuid: str) -> None: Removes a device.
+        select(uuid: str, classes: list, integ: bool, exclude: str, n: int) -> Tuple[List[str], List[numpy.ndarray]]: Gets 
+            the 'class/uuid' label and the (first n) samples as floats of the rows matching some filters, in device 
+            order (the order in which the devices were first registered).
+    """
+    # Initialization
+    def __init__(self, devices: Dict[str, Dict[str, Any]] = None, capacity: int = 256):
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in feature_columns.items()}
+        self.n_rows = 0
+        self.rows, self.layouts, self.seqs, self.next_seq = {}, {}, {}, 0
+        self.lock = Lock()
+        for uuid, dev in (devices or {}).items() : self.update(uuid, dev)
+
+    # Register a device or update its metadata
+    def update(self, uuid: str, dev: Dict[str, Any]) -> None :
+        with self.lock :
+            if self.layouts.get(uuid) is not dev['modules'] :
+                self.register(uuid, dev)
+            rows = self.rows[uuid]
+            self.columns['class'][rows] = dev['class']
+            self.columns['integ'][rows] = dev['integrated']
+            self.columns['period'][rows] = dev['period']
+
+    # Register the rows of a device (the lock must be held)
+    def register(self, uuid: str, dev: Dict[str, Any]) -> None :
+        self.drop(uuid)
+        attribs = [(mod_name, attrib_name, attrib_buffer) for mod_name, attribs_dic in dev['modules'].items() for attrib_name, attrib_buffer in attribs_dic.items()]
+        if self.n_rows + len(attribs) > len(self.columns['alive']) :
+            capacity = max(2*len(self.columns['alive']), self.n_rows + len(attribs))
+            for name, column in self.columns.items() :
+                self.columns[name] = np.empty(capacity, dtype=column.dtype)
+                self.columns[name][:self.n_rows] = column[:self.n_rows]
+        rows = np.arange(self.n_rows, self.n_rows + len(attribs))
+        self.n_rows += len(attribs)
+        if uuid not in self.seqs : self.seqs[uuid], self.next_seq = self.next_seq, self.next_seq+1
+        seq = self.seqs[uuid]
+        for row, (mod_name, attrib_name, attrib_buffer) in zip(rows, attribs) :
+            self.columns['mod'][row], self.columns['attrib'][row], self.columns['buffer'][row] = mod_name, attrib_name, attrib_buffer
+            self.columns['lock'][row] = dev.get('lock')
+        self.columns['uuid'][rows], self.columns['seq'][rows], self.columns['alive'][rows] = uuid, seq, True
+        self.rows[uuid], self.layouts[uuid] = rows, dev['modules']
+
+    # Remove a device
+    def remove(self, uuid: str) -> None :
+        with self.lock :
+            self.drop(uuid)
+            self.seqs.pop(uuid, None)
+
+    # Drop the rows of a device (the lock must be held)
+    def drop(self, uuid: str) -> None :
+        rows = self.rows.pop(uuid, None)
+        self.layouts.pop(uuid, None)
+        if rows is None : return
+        self.columns['alive'][rows] = False
+        self.columns['buffer'][rows] = self.columns['lock'][rows] = None
+        # Compact the columns when most rows are dropped
+        alive = self.columns['alive'][:self.n_rows]
+        if self.n_rows > 64 and np.count_nonzero(alive) < self.n_rows//2 :
+            keep = np.flatnonzero(alive)
+            for column in self.columns.values() : column[:keep.size] = column[keep]
+            self.n_rows = keep.size
+            self.rows = {dev_uuid: np.flatnonzero(self.columns['uuid'][:self.n_rows] == dev_uuid) for dev_uuid in self.rows}
+
+    # Labels and samples of the rows matching some filters
+    def select(self, uuid: str = None, classes: List[str] = None, integ: bool = None, exclude: str = None, n: int = None) -> Tuple[List[str], List[np.ndarray]] :
+        with self.lock :
+            rows = self.match(uuid, classes, integ, exclude)
+            return self.labels(rows), self.series(rows, n)
+
+    # Rows matching some filters (the lock must be held)
+    def match(self, uuid: str = None, classes: List[str] = None, integ: bool = None, exclude: str = None) -> np.ndarray :
+        n, columns = self.n_rows, self.columns
+        mask = columns['alive'][:n].copy()
+        if uuid is not None : mask &= columns['uuid'][:n] == uuid
+        if classes is not None : mask &= np.isin(columns['class'][:n], classes)
+        if integ is not None : mask &= columns['integ'][:n] == integ
+        if exclude is not None : mask &= columns['uuid'][:n] != exclude
+        rows = np.flatnonzero(mask)
+        # Devices in the order they were added, attributes in the order of their modules
+        return rows[np.argsort(columns['seq'][rows], kind='stable')]
+
+    # Labels of some rows (the lock must be held)
+    def labels(self, rows: np.ndarray) -> List[str] :
+        return [f'{dev_class}/{uuid}' for dev_class, uuid in zip(self.columns['class'][rows], self.columns['uuid'][rows])]
+
+    # Samples of some rows (the lock must be held)
+    def series(self, rows: np.ndarray, n: int = None) -> List[np.ndarray] :
+        series = []
+        for attrib_buffer, dev_lock in zip(self.columns['buffer'][rows], self.columns['lock'][rows]) :
+            # Copied while no sample is being added to the device
+            with dev_lock if dev_lock is not None else nullcontext() :
+                window = attrib_buffer.window()[:n]
+                # Non-numeric samples are missing values
+                series.append(window.astype(np.float64) if window.dtype != object else pd.to_numeric(pd.Series(window), errors='coerce').to_numpy(np.float64))
+        return series
+
+# Precompiled TypeQL query
+class QueryTemplate() :
+    """
+    A TypeQL query compiled once, whose values only need to be filled in.
+
+    Attributes:
+        template (str): The query as a format string, with a positional field for each value and
+                        named fields for the values shared by the whole query (e.g. uuid, timestamp).
+        formatters (list): The function wrapping each positional value according to its TypeDB type.
+    """
+    # Initialization
+    def __init__(self, template: str, formatters: list):
+        self.template = template
+        self.formatters = formatters
+
+    # Fill the template in
+    def fill(self, values: List[Any] = [], **kwargs) -> str :
+        return self.template.format(*[fmt(value) for fmt, value in zip(self.formatters, values)], **kwargs)
+
+# Cache of TypeQL query templates compiled from SDF descriptions
+class QueryTemplateCache() :
+    """
+    A cache of the TypeQL queries used to define and update devices, compiled once from the SDF description
+    of each device class.
+
+    Attributes:
+        update_templates (dict): The update templates by (class, ((module, (attribute, ...)), ...)).
+        define_templates (dict): The define templates by class.
+
+    Methods:
+        get_update_template(dev_class: str, sdf_dict: dict, data: dict) -> QueryTemplate: Get the update query template of a message.
+        get_define_template(dev_class: str, sdf_dict: dict) -> Dict[str, Any]: Get the modules/attributes definition templates of a class.
+        invalidate(dev_class: str) -> None: Drop the templates of a class (e.g. when its SDF changes).
+    """
+    # Initialization
+    def __init__(self):
+        self.update_templates = {}
+        self.define_templates = {}
+        self.lock = Lock()
+
+    # Get update template, compiling it if the message has a new modules/attributes layout
+    def get_update_template(self, dev_class: str, sdf_dict: dict, data: dict) -> QueryTemplate :
+        key = (dev_class, tuple((mod_name, tuple(mod_dict)) for mod_name, mod_dict in data.items()))
+        template = self.update_templates.get(key)
+        if template is None :
+            template = compile_update_template(dev_class, sdf_dict, key[1])
+            with self.lock : self.update_templates[key] = template
+        return template
+
+    # Get define templates, compiling them the first time the class is seen
+    def get_define_template(self, dev_class: str, sdf_dict: dict) -> Dict[str, Any] :
+        template = self.define_templates.get(dev_class)
+        if template is None :
+            template = compile_define_template(dev_class, sdf_dict)
+            with self.lock : self.define_templates[dev_class] = template
+        return template
+
+    # Drop the templates of a class
+    def invalidate(self, dev_class: str) -> None :
+        with self.lock :
+            self.define_templates.pop(dev_class, None)
+            for key in [key for key in self.update_templates if key[0] == dev_class] :
+                del self.update_templates[key]
+
+# Class to handle datetimes in JSON printing
+class ModifiedEncoder(JSONEncoder):
+    """Class to handle datetime objects when encoding to JSON.
+
+    Overrides the default method of the JSONEncoder class to convert datetime objects to strings in the desired format before encoding.
+    """
+
+    def default(self, obj):
+        """Convert datetime objects to strings (and ring buffers to lists) before encoding.
+
+        Args:
+            obj (Any): The object to be encoded.
+
+        Returns:
+            str: The string representation of the datetime object in the desired format, or the result of the default method if obj is not a datetime object.
+        """
+        if isinstance(obj,datetime): return obj.strftime("%Y-%m-%dT%H:%M:%S.%f")
+        if isinstance(obj,RingBuffer): return obj.window().tolist()
+        if isinstance(obj,np.ndarray): return obj.tolist()
+        if isinstance(obj,np.generic): return obj.item()
+        return JSONEncoder.default(self, obj)
+
+####################################################
+######## CLASSES AND TIME SERIES SIMILARITY ########
+####################################################
+
+# Compute voting results df
 def calc_voting_result_df(votes: List[Dict[str, int]]) -> pd.DataFrame:
     """Compute the voting results DataFrame.
 
@@ -383,83 +2655,94 @@ def calc_voting_result_df(votes: List[Dict[str, int]]) -> pd.DataFrame:
 
     return pd.DataFrame(total_vote_sdf.items(),columns=['candidate','score']).sort_values(by='score',ascending=False)
 
-# Compute closest classes by comparing SDF descriptions
-def get_closest_classes(noninteg_class: pd.DataFrame, integ_classes: pd.DataFrame, i: int, score: int = 3,) -> Dict[str, int] :
-    """Compute the closest classes by comparing SDF descriptions.
+# Build the series compared by the closest devices search
+def closest_devs_arrays(features: FeatureStore, uuid: str, classes: List[str], m: int = 20) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """Build the arrays compared by closest_devs_rows, so that they can be shared with worker processes. Each attribute 
+    of the device is searched, by its first m values, in the values of each attribute of the candidate devices.
 
     Parameters
     ----------
-    noninteg_class (pandas.DataFrame): A DataFrame containing the non-integrated class.
-    integ_classes (pandas.DataFrame): A DataFrame containing the integrated classes.
-    i (int): The index of the row in noninteg_class to compare.
-    score (int): The maximum number of points to give to the closest class.
+    features (FeatureStore): The attributes of the devices.
+    uuid (str): The UUID of the non-integrated device.
+    classes (List[str]): The classes of the candidate devices (the closest classes and the class of the device).
+    m (int): The number of samples of the device compared (the length of the pattern searched).
 
     Returns
     -------
-    Dict[str, int]: A dictionary containing the candidate names as keys and their scores as values.
+    Tuple[Dict[str, numpy.ndarray], List[str]]: The first m values of each attribute of the device ('queries'), the 
+    values of each attribute of the candidates without missing ones, concatenated ('values') with the start of each 
+    one ('offsets'), and the 'class/uuid' label of each candidate attribute.
     """
-    # Create local copies and compare only rows with same data type
-    noninteg_class_row = noninteg_class.iloc[i].copy()
-    integ_classes = integ_classes[integ_classes.prop_type==noninteg_class_row['prop_type']].copy()
-
-    # Build non integrated row text description
-    non_integ_class_row_desc = noninteg_class_row['prop'] + ' ' + noninteg_class_row['prop_desc']
-
-    # Calc string distances to each other integrated row text description
-    integ_classes['str_dist'] = integ_classes.apply(lambda x: calc_str_dist(non_integ_class_row_desc,x), axis=1)
-    closest_things = integ_classes[['thing','obj','prop','str_dist']].sort_values(by='str_dist',ascending=False)
-
-    # Give points based on closeness
-    vote = {}
-    for row in closest_things.itertuples() :
-        if score == 0 : break
-        if row.thing in vote : continue
-        vote[row.thing] = score
-        score -= 1
-
-    return vote
-
-# Compute closest devices searching for closest time series pattern
-def get_closest_devs(noninteg_dev: pd.DataFrame, integ_devs: pd.DataFrame, closest_classes: List[str], i: int, score: int = 1) -> Dict[str, int]:
-    """Compute the closest devices searching for closest time series pattern.
+    _, device_series = features.select(uuid=uuid, n=m)
+    queries = np.full((len(device_series), m), np.nan)
+    for i, values in enumerate(device_series) : queries[i, :values.size] = values
+    labels, series = features.select(classes=classes, integ=True, exclude=uuid)
+    series = [values[~np.isnan(values)] for values in series]
+    offsets = np.cumsum([0] + [len(values) for values in series])
+    values = np.concatenate(series) if series else np.empty(0)
+    return {'queries': queries, 'values': values, 'offsets': offsets}, labels
+
+# Compute closest devices for some rows of the non-integrated device
+def closest_devs_rows(arrays: Dict[str, np.ndarray], rows: range, labels: List[str], score: int = 1, normalize: bool = False) -> List[Dict[str, int]]:
+    """Compute the closest devices searching for closest time series pattern, for some rows of the non-integrated device 
+    (see closest_devs_arrays). The winner of each row is the candidate with the lowest MASS distance to the query (the 
+    first one on ties), skipping the ones shorter than it. The distance profiles against all the candidates are 
+    computed together (see MassBatch).
 
     Parameters
     ----------
-    noninteg_dev (pandas.DataFrame): A DataFrame containing the non-integrated device.
-    integ_devs (pandas.DataFrame): A DataFrame containing the integrated devices.
-    closest_classes (List[str]): A list of class names of the closest classes.
-    i (int): The index of the row in noninteg_dev to compare.
+    arrays (Dict[str, numpy.ndarray]): The 'queries', 'values' and 'offsets' arrays.
+    rows (range): The rows of the non-integrated device to compare.
+    labels (List[str]): The 'class/uuid' label of each candidate row.
     score (int): The number of points to give to the closest device.
+    normalize (bool): Whether to compare the z-normalized patterns.
 
     Returns
     -------
-    Dict[str, int]: A dictionary containing the candidate names as keys and their scores as values.
+    List[Dict[str, int]]: The vote of each row (empty if no candidate row had enough values).
     """
-    # Create local copies
-    noninteg_dev_row = noninteg_dev.iloc[i].copy()
-    closest_classes.append(noninteg_dev_row['class'])
-    integ_devs = integ_devs[integ_devs['class'].isin(closest_classes)].copy()
-    val_cols = integ_devs.columns[6:]
+    queries, values, offsets = arrays['queries'], arrays['values'], arrays['offsets']
+    batch = MassBatch([values[offsets[j]:offsets[j+1]] for j in range(len(labels))], queries.shape[1], normalize)
+    votes = []
+    for i in rows :
+        # The winner is the one with lower distance
+        j = batch.closest(queries[i])
+        votes.append({labels[j]: score} if j >= 0 else {})
+    return votes
 
-    # Compute device with closest time series pattern
-    min_dist_profile = np.Inf
-    query_series = noninteg_dev_row[val_cols[:20]].astype(float).to_numpy()
-    for i, integ_dev_row in integ_devs.iterrows() :
-        inspected_series = integ_dev_row[val_cols].dropna().astype(float).to_numpy()
-        if inspected_series.size < query_series.size : continue
-        # MASS Distance Profile
-        dist_profile = mass(query_series, inspected_series, normalize=False)
-        if np.min(dist_profile) < min_dist_profile :
-            min_dist_profile = np.min(dist_profile)
-            candidate = integ_dev_row['class'] + '/' + integ_dev_row.uuid
-    
-    # The winner is the one with lower distance
-    return {candidate: score}
-    
 ###########################
 ######## FUNCTIONS ########
 ###########################
 
+# Warm a worker process up
+def warm_worker() -> None:
+    """Runs the integration algorithm on a tiny input in a worker process, so its code is loaded (and compiled) before it is needed."""
+    MassBatch([np.arange(40.0)], 20).closest(np.arange(20.0))
+    time.sleep(0.1) # so that every worker gets one
+
+# Run a function on shared arrays
+def run_shared(fn, spec: Tuple[str, Dict[str, Tuple[str, tuple, int]]], rows: range, *args) -> Tuple[Any, float]:
+    """Calls fn(arrays, rows, *args) in a worker process on the arrays shared by WorkerPool.map (see SharedArrays).
+    
+    Parameters
+    ----------
+    fn (callable): The function.
+    spec (tuple): The spec of the shared arrays.
+    rows (range): The rows to process.
+    *args: The other arguments of the function.
+    
+    Returns
+    -------
+    tuple: The result of the function and the time spent on it (in seconds).
+    """
+    tic = time.perf_counter()
+    shm, arrays = SharedArrays.attach(spec)
+    try :
+        return fn(arrays, rows, *args), time.perf_counter() - tic
+    finally :
+        del arrays
+        shm.close()
+
 # Get new random sample of time series based on last one
 def get_new_sample(last_sample: float, sigma: float = 0.01) -> float:
     """Returns a new sample by multiplying the last sample by a random number
@@ -491,7 +2774,7 @@ def sample_sine(offset: float, amp: float, T: float, phi: float) -> float:
     -------
     A new sample value, as a float.
     """
-    t = time.perf_counter()
+    t = sim_clock.time()
     return get_new_sample(offset + amp*np.sin((2*np.pi/T)*t + phi))
 
 # Square wave
@@ -509,7 +2792,7 @@ def sample_square(offset: float, amp: float, T: float, phi: float) -> float:
     -------
     A new sample value, as a float.
     """
-    t = time.perf_counter()
+    t = sim_clock.time()
     return get_new_sample(offset + amp*np.sign(np.sin((2*np.pi/T)*t + phi)))
 
 # Sawtooth wave
@@ -527,7 +2810,7 @@ def sample_triangular(offset: float, amp: float, T: float, phi: float) -> float:
     -------
     A new sample value, as a float.
     """
-    t = time.perf_counter() + phi/(2*np.pi/T)
+    t = sim_clock.time() + phi/(2*np.pi/T)
     val = offset + 2*amp*((t%(T/2)/T)-0.5) if t%T  < T/2 else offset - 2*amp*((t%(T/2)/T)-0.5)
     return get_new_sample(val)
 
@@ -546,7 +2829,7 @@ def sample_sawtooth(offset: float, amp: float, T: float, phi: float) -> float:
     -------
     A new sample value, as a float.
     """
-    t = time.perf_counter() + phi/(2*np.pi/T)
+    t = sim_clock.time() + phi/(2*np.pi/T)
     return get_new_sample(offset + amp*(2*((t%T)/T)-0.5))
 
 # Flip a coin (returns True with prob = prob)
@@ -628,6 +2911,288 @@ def gen_robot_data(offset: float, A: float, T: float, phi: float, actuator_statu
         }
     }
 
+# Get new random samples of N time series based on the last ones
+def get_new_samples(last_samples: np.ndarray, sigma: float = 0.01) -> np.ndarray:
+    """Batched get_new_sample: multiplies each last sample by its own random number
+    drawn from a normal distribution with mean 1 and standard deviation sigma.
+    
+    Parameters
+    ----------
+    last_samples (np.ndarray): The last sample values.
+    sigma (float): The standard deviation of the normal distribution. Default value is 0.01.
+    
+    Returns
+    -------
+    The new sample values, as an array.
+    """
+    last_samples = np.asarray(last_samples, dtype=float)
+    return last_samples*random.normal(1,sigma,last_samples.shape)
+
+# Sine waves
+def sample_sine_batch(offset: np.ndarray, amp: np.ndarray, T: np.ndarray, phi: np.ndarray, t: float = None) -> np.ndarray:
+    """Batched sample_sine: returns a new sample of N sine waves at the same time.
+    
+    Parameters
+    ----------
+    offset (np.ndarray): The offsets of the sine waves.
+    amp (np.ndarray): The amplitudes of the sine waves.
+    T (np.ndarray): The periods of the sine waves.
+    phi (np.ndarray): The phases of the sine waves.
+    t (float): The sampling time. Default is the current time of the simulation clock.
+    
+    Returns
+    -------
+    The new sample values, as an array.
+    """
+    t = sim_clock.time() if t is None else t
+    return get_new_samples(offset + amp*np.sin((2*np.pi/T)*t + phi))
+
+# Square waves
+def sample_square_batch(offset: np.ndarray, amp: np.ndarray, T: np.ndarray, phi: np.ndarray, t: float = None) -> np.ndarray:
+    """Batched sample_square: returns a new sample of N square waves at the same time.
+    
+    Parameters
+    ----------
+    offset (np.ndarray): The offsets of the square waves.
+    amp (np.ndarray): The amplitudes of the square waves.
+    T (np.ndarray): The periods of the square waves.
+    phi (np.ndarray): The phases of the square waves.
+    t (float): The sampling time. Default is the current time of the simulation clock.
+    
+    Returns
+    -------
+    The new sample values, as an array.
+    """
+    t = sim_clock.time() if t is None else t
+    return get_new_samples(offset + amp*np.sign(np.sin((2*np.pi/T)*t + phi)))
+
+# Triangular waves
+def sample_triangular_batch(offset: np.ndarray, amp: np.ndarray, T: np.ndarray, phi: np.ndarray, t: float = None) -> np.ndarray:
+    """Batched sample_triangular: returns a new sample of N triangular waves at the same time.
+    
+    Parameters
+    ----------
+    offset (np.ndarray): The offsets of the triangular waves.
+    amp (np.ndarray): The amplitudes of the triangular waves.
+    T (np.ndarray): The periods of the triangular waves.
+    phi (np.ndarray): The phases of the triangular waves.
+    t (float): The sampling time. Default is the current time of the simulation clock.
+    
+    Returns
+    -------
+    The new sample values, as an array.
+    """
+    t = (sim_clock.time() if t is None else t) + phi/(2*np.pi/T)
+    ramp = 2*amp*((t%(T/2)/T)-0.5)
+    return get_new_samples(np.where(t%T < T/2, offset + ramp, offset - ramp))
+
+# Sawtooth waves
+def sample_sawtooth_batch(offset: np.ndarray, amp: np.ndarray, T: np.ndarray, phi: np.ndarray, t: float = None) -> np.ndarray:
+    """Batched sample_sawtooth: returns a new sample of N sawtooth waves at the same time.
+    
+    Parameters
+    ----------
+    offset (np.ndarray): The offsets of the sawtooth waves.
+    amp (np.ndarray): The amplitudes of the sawtooth waves.
+    T (np.ndarray): The periods of the sawtooth waves.
+    phi (np.ndarray): The phases of the sawtooth waves.
+    t (float): The sampling time. Default is the current time of the simulation clock.
+    
+    Returns
+    -------
+    The new sample values, as an array.
+    """
+    t = (sim_clock.time() if t is None else t) + phi/(2*np.pi/T)
+    return get_new_samples(offset + amp*(2*((t%T)/T)-0.5))
+
+# Flip N coins
+def coin_batch(prob: np.ndarray, n: int = None) -> np.ndarray:
+    """Batched coin: flips N virtual coins.
+    
+    Parameters
+    ----------
+    prob (np.ndarray): The probability of each coin returning True (a float for all of them).
+    n (int): The number of coins. Default is the length of `prob`.
+    
+    Returns
+    -------
+    A boolean array, True with probability `prob`.
+    """
+    prob = np.asarray(prob, dtype=float)
+    return random.uniform(size=prob.shape if n is None else n) < prob
+
+# Generate N samples of normal distributions between a min and a maximum value
+def sample_normal_mod_batch(mu: np.ndarray, sigma: np.ndarray = 0.05, modifier: np.ndarray = 0.0) -> np.ndarray:
+    """Batched sample_normal_mod, with the same thresholding for each of the N samples.
+    
+    Parameters
+    ----------
+    mu (np.ndarray): The means of the normal distributions.
+    sigma (np.ndarray): The standard deviations of the normal distributions. Default value is 0.05.
+    modifier (np.ndarray): The factors to modify `mu` and `sigma` by. Default value is 0.0.
+    
+    Returns
+    -------
+    The sample values, as an array.
+    """
+    # Apply modification factors to values
+    mu = np.asarray(mu, dtype=float)*(1 + np.asarray(modifier))
+    sigma = np.broadcast_to(sigma*(1 + np.asarray(modifier)), mu.shape)
+    th = [mu - sigma, mu + sigma] # threshold within 1 STD
+
+    # Generate random values within thresholds
+    val = random.normal(mu,sigma)
+    return np.where(val > th[0], th[0], th[1])
+
+# Generate data of N robots
+def gen_robot_data_batch(offset: np.ndarray, A: np.ndarray, T: np.ndarray, phi: np.ndarray, actuator_status: np.ndarray, t: float = None) -> Dict[str, Dict[str, np.ndarray]]:
+    """Batched gen_robot_data: generates one tick of data for N robots at the same time.
+    
+    Parameters
+    ----------
+    offset (np.ndarray): The offsets of the generated data.
+    A (np.ndarray): The scaling factors for the generated data.
+    T (np.ndarray): The periods for the generated data.
+    phi (np.ndarray): The phase shifts for the generated data.
+    actuator_status (np.ndarray): The status of the robots' actuators.
+    t (float): The sampling time. Default is the current time of the simulation clock.
+    
+    Returns
+    -------
+    A dictionary containing the robots' joint and actuator data, with an array (one value per robot) for each attribute.
+    """
+    t = sim_clock.time() if t is None else t
+    return {
+        'joint': {
+            'x_position' : sample_sine_batch(offset,A,T,phi,t),
+            'y_position' : sample_sine_batch(offset-1,A*2,T*1.25,phi,t),
+            'z_position' : sample_sine_batch(offset-2,A/2,T*0.75,phi,t),
+            'roll_orientation' : sample_sawtooth_batch(offset+np.pi/2,A,T,phi,t),
+            'pitch_orientation' : sample_sawtooth_batch(offset+1*np.pi/4,A*2,T*1.25,phi,t),
+            'yaw_orientation' : sample_sawtooth_batch(offset+2*np.pi/4,A/2,T*0.75,phi,t)
+        },
+        'actuator': {
+            'x_position' : sample_triangular_batch(offset,A,T,phi,t),
+            'y_position' : sample_triangular_batch(offset-1,A*2,T*1.5,phi,t),
+            'z_position' : sample_triangular_batch(offset-2,A/2,T*0.5,phi,t),
+            'roll_orientation' : sample_triangular_batch(offset+np.pi/2,A,T,phi,t),
+            'pitch_orientation' : sample_triangular_batch(offset+1*np.pi/4,A*2,T*1.5,phi,t),
+            'yaw_orientation' : sample_triangular_batch(offset+2*np.pi/4,A/2,T*0.75,phi,t),
+            'actuator_status' : np.asarray(actuator_status, dtype=bool)
+        }
+    }
+
+# Split batched data into the data of each device
+def unstack_batch(data: Dict[str, Dict[str, np.ndarray]], n: int) -> List[Dict[str, Dict[str, Any]]]:
+    """Splits the data generated for N devices at once into one data dictionary per device,
+    with native Python values (so that every wire format can encode them).
+    
+    Parameters
+    ----------
+    data (dict): The modules of the devices, with an array (one value per device) for each attribute.
+    n (int): The number of devices.
+    
+    Returns
+    -------
+    A list with the data dictionary of each device.
+    """
+    columns = [(mod_name, attrib_name, np.broadcast_to(values, (n,)).tolist())
+               for mod_name, attribs in data.items() for attrib_name, values in attribs.items()]
+    batch = [{mod_name: {} for mod_name in data} for _ in range(n)]
+    for mod_name, attrib_name, values in columns :
+        for dev_data, value in zip(batch, values) : dev_data[mod_name][attrib_name] = value
+    return batch
+
+# Simulation clock
+def get_clock() -> Clock:
+    """Returns the clock read by the data generators, ground truths and message headers.
+    
+    Returns
+    -------
+    The simulation clock (the wall clock unless replaced with set_clock).
+    """
+    return sim_clock
+
+# Replace simulation clock
+def set_clock(clock: Clock) -> Clock:
+    """Replaces the clock read by the data generators, ground truths and message headers
+    (e.g. by a VirtualClock to run a simulation faster than real time).
+    
+    Parameters
+    ----------
+    clock (Clock): The new simulation clock.
+    
+    Returns
+    -------
+    The previous simulation clock, so that it can be restored.
+    """
+    global sim_clock
+    previous, sim_clock = sim_clock, clock
+    return previous
+
+# Generate device UUID
+def gen_uuid() -> str:
+    """Generates a random (version 4) UUID from the NumPy random generator, so that seeding it
+    with random.seed also makes the UUIDs of the simulated devices reproducible.
+    
+    Returns
+    -------
+    The UUID, as a string.
+    """
+    return str(uuid.UUID(bytes=random.bytes(16), version=4))
+
+# MQTT topic filter matching
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Checks whether a topic matches a subscription topic filter, with the MQTT wildcards:
+    '+' matches one level and a trailing '#' matches any number of levels (including none).
+    As in MQTT, topics starting with '$' are not matched by filters starting with a wildcard.
+    
+    Parameters
+    ----------
+    topic_filter (str): The subscription topic filter.
+    topic (str): The topic a message is published to.
+    
+    Returns
+    -------
+    True if the topic matches the filter, False otherwise.
+    """
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#') : return False
+    filter_levels, topic_levels = topic_filter.split('/'), topic.split('/')
+    for i, level in enumerate(filter_levels) :
+        if level == '#' : return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]) : return False
+    return len(filter_levels) == len(topic_levels)
+
+# Select messages transport
+def set_transport(name: str) -> None:
+    """Selects the messages transport of the clients created afterwards by new_client.
+    
+    Parameters
+    ----------
+    name (str): 'mqtt' (paho clients through the broker) or 'local' (in-process LocalBus).
+    """
+    global transport
+    if name not in ('mqtt', 'local') : raise ValueError(f'unknown transport {name!r}')
+    transport = name
+
+# Create messages client
+def new_client(client_id: str, transport_name: str = None) -> Any:
+    """Creates a client of the messages transport, with the paho client interface.
+    
+    Parameters
+    ----------
+    client_id (str): The client identifier.
+    transport_name (str): 'mqtt' or 'local'. Default is the transport selected with set_transport.
+    
+    Returns
+    -------
+    A paho mqtt.Client or a LocalClient.
+    """
+    match transport if transport_name is None else transport_name :
+        case 'mqtt' : return mqtt_client.Client(client_id)
+        case 'local' : return LocalClient(client_id)
+    raise ValueError(f'unknown transport {transport_name!r}')
+
 # Generate header data
 def gen_header(dev_class: str, topic: str, uuid: str, category: str = 'DATA') -> Dict[str, str]:
     """Generates header data for a device.
@@ -648,9 +3213,362 @@ def gen_header(dev_class: str, topic: str, uuid: str, category: str = 'DATA') ->
         'class' : dev_class,
         'topic' : topic,
         'uuid' : uuid,
-        'timestamp' : datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        'timestamp' : sim_clock.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
     }
 
+# Encode message payload
+def encode_msg(msg: Dict[str, Any], wire_format: str = 'json', ordinals: List[Tuple[str, List[str]]] = None) -> bytes:
+    """Encodes a message in the given wire format.
+    
+    Parameters
+    ----------
+    msg (dict): The message, as built by gen_header (plus 'data' for DATA messages).
+    wire_format (str): 'json' (pretty-printed, default), 'msgpack' or 'cbor'. The binary formats
+                       carry the timestamp as epoch seconds.
+    ordinals (list): If given (binary formats only), the data is sent as a list of value lists following
+                     this [(module_name, [attribute_name, ...]), ...] order (see sdf_ordinals) instead of 
+                     repeating module and attribute names.
+    
+    Returns
+    -------
+    bytes: The payload.
+    """
+    if wire_format == 'json' : return dumps(msg, indent=4).encode()
+    # Compact message
+    msg = dict(msg)
+    msg['timestamp'] = to_epoch(datetime.fromisoformat(msg['timestamp']))
+    if ordinals is not None and 'data' in msg :
+        data = msg['data']
+        msg['data'] = [[data.get(mod_name, {}).get(attrib_name) for attrib_name in attrib_names] for mod_name, attrib_names in ordinals]
+    match wire_format :
+        case 'msgpack' :
+            if msgpack is None : raise ImportError('msgpack wire format requires the msgpack package')
+            return msgpack.packb(msg)
+        case 'cbor' :
+            if cbor2 is None : raise ImportError('cbor wire format requires the cbor2 package')
+            return cbor2.dumps(msg)
+        case _ :
+            raise ValueError(f'unknown wire format {wire_format!r}')
+
+# Detect payload wire format
+def detect_wire_format(payload: bytes) -> str:
+    """Detects the wire format of a payload from its first byte ('json', 'msgpack' or 'cbor').
+    
+    Parameters
+    ----------
+    payload (bytes): The raw MQTT payload.
+    
+    Returns
+    -------
+    str: The wire format, or '' if it is not recognized.
+    """
+    first = payload.lstrip()[:1]
+    if first == b'{' : return 'json'
+    if not first : return ''
+    first = first[0]
+    if 0x80 <= first <= 0x8f or first in (0xde, 0xdf) : return 'msgpack' # msgpack map
+    if 0xa0 <= first <= 0xbb or first == 0xbf : return 'cbor' # cbor map
+    return ''
+
+# Decode MQTT message payload
+def decode_msg(payload: bytes) -> Dict[str, Any]:
+    """Decodes a message payload in a single pass, parsing its timestamp once. The wire format 
+    (JSON, MessagePack or CBOR) is detected from the payload.
+    
+    Parameters
+    ----------
+    payload (bytes): The raw MQTT payload.
+    
+    Returns
+    -------
+    dict: The message, with its header fields ('category', 'class', 'topic', 'uuid', 'timestamp'), 
+    its 'data' if it is a DATA message (a list of value lists if it was sent with ordinals, see 
+    expand_ordinals), and the parsed timestamp as a datetime ('dt_timestamp') and as epoch seconds ('ts'). 
+    The timestamp is rewritten as a naive UTC one with microseconds ("%Y-%m-%dT%H:%M:%S.%f").
+
+    Raises
+    ------
+    ValueError: If the payload cannot be decoded or the message is malformed.
+    """
+    wire_format = detect_wire_format(payload)
+    try :
+        match wire_format :
+            case 'json' : msg = fast_loads(payload)
+            case 'msgpack' if msgpack is not None : msg = msgpack.unpackb(payload)
+            case 'cbor' if cbor2 is not None : msg = cbor2.loads(payload)
+            case '' : raise ValueError('unknown wire format')
+            case _ : raise ValueError(f'{wire_format} support is not installed')
+    except ValueError as e :
+        raise ValueError(f'invalid {wire_format} payload ({e})')
+    except Exception as e : # binary decoders raise their own exception types
+        raise ValueError(f'invalid {wire_format} payload ({e!r})')
+    if not isinstance(msg, dict) : raise ValueError('payload is not a map')
+    # Timestamp parsed once for the whole processing (epoch seconds in binary formats)
+    timestamp = msg.get('timestamp')
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool) :
+        msg['ts'] = float(timestamp)
+        msg['dt_timestamp'] = datetime.fromtimestamp(msg['ts'], timezone.utc).replace(tzinfo=None)
+        msg['timestamp'] = msg['dt_timestamp'].isoformat(timespec='microseconds')
+    # Header fields
+    missing = [key for key in msg_header_keys if not isinstance(msg.get(key), str)]
+    if missing : raise ValueError(f'missing or invalid header fields {missing}')
+    if msg['category'] == 'DATA' and not isinstance(msg.get('data'), (dict, list)) : raise ValueError('DATA message without data')
+    if 'dt_timestamp' not in msg :
+        try :
+            dt_timestamp = datetime.fromisoformat(msg['timestamp'])
+        except ValueError :
+            raise ValueError(f'invalid timestamp {msg["timestamp"]!r}')
+        # Timestamps with an offset are converted to naive UTC ones
+        if dt_timestamp.tzinfo is not None : dt_timestamp = dt_timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        msg['dt_timestamp'], msg['ts'] = dt_timestamp, to_epoch(dt_timestamp)
+        # Rewritten in the format the backends expect ("%Y-%m-%dT%H:%M:%S.%f")
+        msg['timestamp'] = dt_timestamp.isoformat(timespec='microseconds')
+    return msg
+
+# Modules and attributes order for ordinal encoding
+def sdf_ordinals(sdf_dict: Dict[str, Any]) -> List[Tuple[str, List[str]]]:
+    """Returns the modules of a device class and their attributes in SDF order, used to send 
+    data as value lists instead of named dictionaries.
+    
+    Parameters
+    ----------
+    sdf_dict (dict): The SDF description of the device class.
+    
+    Returns
+    -------
+    list: The modules attributes, as [(module_name, [attribute_name, ...]), ...].
+    """
+    return [(mod_name, list(mod_sdf_dict['sdfProperty'])) for mod_name, mod_sdf_dict in sdf_dict['sdfObject'].items()]
+
+# Expand data sent with ordinals
+def expand_ordinals(data: List[List[Any]], ordinals: List[Tuple[str, List[str]]]) -> Dict[str, Dict[str, Any]]:
+    """Expands data sent as value lists back to {'module_name': {'attribute_name': attribute_value, ...}, ...}.
+    Missing (None) values and modules are left out.
+    
+    Parameters
+    ----------
+    data (list): The value lists, one per module.
+    ordinals (list): The modules attributes order, as [(module_name, [attribute_name, ...]), ...].
+    
+    Returns
+    -------
+    dict: The data dictionary.
+
+    Raises
+    ------
+    ValueError: If the value lists do not match the SDF order.
+    """
+    if len(data) != len(ordinals) : raise ValueError(f'{len(data)} value lists for {len(ordinals)} modules')
+    expanded = {}
+    for values, (mod_name, attrib_names) in zip(data, ordinals) :
+        if not isinstance(values, list) or len(values) != len(attrib_names) : raise ValueError(f'invalid value list for module {mod_name!r}')
+        mod_dict = {attrib_name: value for attrib_name, value in zip(attrib_names, values) if value is not None}
+        if mod_dict : expanded[mod_name] = mod_dict
+    return expanded
+
+# Validate message data against SDF types
+def validate_data(data: Dict[str, Any], types: Dict[str, Dict[str, str]]) -> None:
+    """Checks that every module and attribute of a message exists in the device class SDF
+    and that its value has the right type.
+    
+    Parameters
+    ----------
+    data (dict): The message data, as {'module_name': {'attribute_name': attribute_value, ...}, ...}.
+    types (dict): The TypeDB type of each attribute, as {'module_name': {'attribute_name': tdbtype, ...}, ...}.
+    
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError: If a module or attribute is unknown or a value has the wrong type.
+    """
+    for mod_name, mod_dict in data.items() :
+        mod_types = types.get(mod_name)
+        if mod_types is None : raise ValueError(f'unknown module {mod_name!r}')
+        if not isinstance(mod_dict, dict) : raise ValueError(f'module {mod_name!r} is not an object')
+        for attrib_name, attrib_value in mod_dict.items() :
+            tdbtype = mod_types.get(attrib_name)
+            if tdbtype is None : raise ValueError(f'unknown attribute {mod_name}.{attrib_name}')
+            if not isinstance(attrib_value, value_types[tdbtype]) or (tdbtype == 'double' and isinstance(attrib_value, bool)) :
+                raise ValueError(f'{mod_name}.{attrib_name}={attrib_value!r} is not a {tdbtype}')
+
+# Compile update query template
+def compile_update_template(dev_class: str, sdf_dict: Dict[str, Any], mod_attribs: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> QueryTemplate:
+    """Compiles the match-delete-insert query updating the given modules attributes of a device.
+    
+    Parameters
+    ----------
+    dev_class (str): The class of the device.
+    sdf_dict (dict): The SDF description of the device class.
+    mod_attribs (tuple): The updated attributes of each module, as ((module_name, (attribute_name, ...)), ...).
+    
+    Returns
+    -------
+    QueryTemplate: The query template, to be filled in with the attribute values in the same order
+    and the uuid and timestamp of the device.
+    """
+    # Match - Delete - Insert Query
+    matchq = f'match\n$dev isa {dev_class.lower()}, has uuid "{{uuid}}", has timestamp $tmstmp;\n\n'
+    deleteq = 'delete\n$dev has $tmstmp;\n\n'
+    insertq = 'insert\n$dev has timestamp {timestamp};\n\n'
+    formatters = []
+
+    # Iterate over modules
+    for i, (mod_name, attrib_names) in enumerate(mod_attribs) :
+        mod_sdf_dict = sdf_dict['sdfObject'][mod_name]
+        
+        # Match module
+        matchq += f'$mod{i+1} isa {mod_name}, has uuid "{{uuid}}"'
+        deleteq += f'$mod{i+1} '
+        insertq += f'$mod{i+1} '
+        for j, attrib_name in enumerate(attrib_names) :
+            # Value wrapping according to type
+            tdbtype = types_trans[mod_sdf_dict['sdfProperty'][attrib_name]['type']]
+            formatters.append(value_formatters[tdbtype])
+
+            # Query construction
+            matchq += f', has {attrib_name} $attrib{i+1}{j+1}'
+            deleteq += f'{", " if j!=0 else ""}has $attrib{i+1}{j+1}'
+            insertq += f'{", " if j!=0 else ""}has {attrib_name} {{{len(formatters)-1}}}'
+            
+        # Insert line break
+        deleteq += ';\n'
+        insertq += ';\n'
+        matchq += ';\n'
+
+    return QueryTemplate(matchq + '\n' + deleteq + '\n' + insertq, formatters)
+
+# Parse TypeQL insert data
+def parse_data_tql(tql: str) -> Tuple[List[Tuple[str, str, List[Tuple[str, str]]]], List[Tuple[str, str, List[Tuple[str, str]]]]]:
+    """Parses the statements of a TypeQL insert query with entities owning string attributes and relations between them
+    (as in typedbconfig/data.tql).
+    
+    Parameters
+    ----------
+    tql (str): The insert query.
+    
+    Returns
+    -------
+    tuple: The entities, as [(variable, type, [(attribute, value), ...]), ...], and the relations, 
+    as [(variable, type, [(role, player variable), ...]), ...], in the order they appear.
+    """
+    tql = re.sub(r'#.*', '', tql)
+    entities, relations = [], []
+    for statement in tql.replace('insert', '', 1).split(';') :
+        match = re.match(r'\s*\$(\w+)\s+isa\s+(\w+)(.*)', statement, re.S)
+        if match :
+            var, thing_type, attrs = match.groups()
+            entities.append((var, thing_type, re.findall(r'has\s+(\w+)\s+"([^"]*)"', attrs)))
+            continue
+        match = re.match(r'\s*\$(\w+)\s*\((.*)\)\s*isa\s+(\w+)', statement, re.S)
+        if match :
+            var, players, rel_type = match.groups()
+            relations.append((var, rel_type, re.findall(r'(\w+)\s*:\s*\$(\w+)', players)))
+    return entities, relations
+
+# Split TypeQL insert data in chunks
+def chunk_data(entities: List[Tuple[str, str, List[Tuple[str, str]]]], relations: List[Tuple[str, str, List[Tuple[str, str]]]], 
+               batch_size: int = 100) -> Tuple[List[str], List[str]]:
+    """Splits the entities and relations of some data (see parse_data_tql) in insert queries that can be committed 
+    in any order within each phase: the entities first, and then the relations, whose role players are matched by 
+    their type and key (first) attribute, which must be unique.
+    
+    Parameters
+    ----------
+    entities (list): The entities, as [(variable, type, [(attribute, value), ...]), ...].
+    relations (list): The relations, as [(variable, type, [(role, player variable), ...]), ...].
+    batch_size (int): The number of entities or relations in each query.
+    
+    Returns
+    -------
+    tuple: The insert queries of the entities and the match-insert queries of the relations.
+
+    Raises
+    ------
+    ValueError: If a role player has no key attribute, or its key is not unique.
+    """
+    # Keys of the role players
+    keys, seen = {}, set()
+    for var, thing_type, attrs in entities :
+        if not attrs : continue
+        key = (thing_type, *attrs[0])
+        if key in seen : raise ValueError(f'${var}: {thing_type} key {attrs[0][0]} "{attrs[0][1]}" is not unique')
+        keys[var] = key
+        seen.add(key)
+
+    # Entities
+    entity_queries = []
+    for i in range(0, len(entities), batch_size) :
+        insertq = 'insert\n'
+        for var, thing_type, attrs in entities[i:i+batch_size] :
+            insertq += f'${var} isa {thing_type}' + ''.join(f', has {attr} "{value}"' for attr, value in attrs) + ';\n'
+        entity_queries.append(insertq)
+
+    # Relations (matching their role players)
+    relation_queries = []
+    for i in range(0, len(relations), batch_size) :
+        batch = relations[i:i+batch_size]
+        players = sorted({var for _, _, roles in batch for _, var in roles})
+        missing = [var for var in players if var not in keys]
+        if missing : raise ValueError(f'role players without a key attribute: {", ".join("$"+var for var in missing)}')
+        matchq = 'match\n' + ''.join(f'${var} isa {keys[var][0]}, has {keys[var][1]} "{keys[var][2]}";\n' for var in players)
+        insertq = 'insert\n' + ''.join(f'${var} (' + ', '.join(f'{role}: ${player}' for role, player in roles) + f') isa {rel_type};\n' 
+                                        for var, rel_type, roles in batch)
+        relation_queries.append(matchq + insertq)
+
+    return entity_queries, relation_queries
+
+# Compile modules and attributes definition templates
+def compile_define_template(dev_class: str, sdf_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Compiles the queries defining and inserting the modules and attributes of a device class.
+    
+    Parameters
+    ----------
+    dev_class (str): The class of the device.
+    sdf_dict (dict): The SDF description of the device class.
+    
+    Returns
+    -------
+    dict: A dictionary with the match-insert query template ('insert', to be filled in with the uuid and 
+    timestamp of the device), the module ownerships definitions ('modules', as [(module_name, owns_statement), ...]),
+    the attribute types ('attribs', as [(attribute_name, tdbtype), ...]), the modules attributes 
+    ('mod_attribs', as {module_name: [(attribute_name, tdbtype), ...]}) and the same types by module and 
+    attribute name for validation ('types', as {module_name: {attribute_name: tdbtype}}) and the 
+    order of modules and attributes for ordinal encoding ('ordinals', see sdf_ordinals).
+    """
+    # Build match-insert query
+    matchq = f'match\n$dev isa {dev_class.lower()}, has uuid "{{uuid}}";\n\n'
+    insertq = 'insert\n$dev has timestamp {timestamp};\n\n'
+    modules, attribs, mod_attribs, types = [], [], {}, {}
+
+    # Iterate over modules and its attributes
+    for i, (mod_name, mod_sdf_dict) in enumerate(sdf_dict['sdfObject'].items()) :
+        # Insert module
+        insertq += f'$mod{i+1} isa {mod_name}, has uuid "{{uuid}}"'
+        ownsq = ''
+        mod_attribs[mod_name], types[mod_name] = [], {}
+        for j, (attrib_name, attrib_sdf_dict) in enumerate(mod_sdf_dict['sdfProperty'].items()) :
+            tdbtype = types_trans[attrib_sdf_dict['type']]
+            attribs.append((attrib_name, tdbtype))
+            mod_attribs[mod_name].append((attrib_name, tdbtype))
+            types[mod_name][attrib_name] = tdbtype
+            # Make the module own the attribute
+            ownsq += f'{", " if j>0 else f"{mod_name} "}owns {attrib_name}'
+            # Insert attributes in module with default values
+            insertq += f', has {attrib_name} {defvalues[tdbtype]}'
+        modules.append((mod_name, ownsq + ';\n'))
+        insertq += ';\n'
+    
+    # Link all modules to the device
+    insertq += '$includes (device: $dev'
+    for j in range(len(modules)): insertq += f', module: $mod{j+1}'
+    insertq += ') isa includes; \n'
+
+    return {'insert': QueryTemplate(matchq + insertq, []), 'modules': modules, 'attribs': attribs, 'mod_attribs': mod_attribs, 
+            'types': types, 'ordinals': sdf_ordinals(sdf_dict)}
+
 # Get all paths in dict with sdfRef
 def get_ref_paths(dic: dict) -> dict:
     """Get all paths in a dictionary to values with a key of 'sdfRef'.
@@ -676,32 +3594,227 @@ def get_ref_paths(dic: dict) -> dict:
     get_keys(dic) # run recursive function
     return paths
 
-# Build devices DataFrame
-def build_devs_df(devices: dict) -> pd.DataFrame:
-    """Build a DataFrame from a dictionary of devices.
+# Convert naive UTC datetime to epoch seconds
+def to_epoch(dt: datetime) -> float:
+    """Converts a naive UTC datetime to seconds since the epoch.
+    
+    Parameters
+    ----------
+    dt (datetime): The naive datetime, in UTC.
+    
+    Returns
+    -------
+    float: The seconds since the epoch.
+    """
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+# Epoch seconds to ISO timestamps
+def to_iso(ts: np.ndarray) -> List[str]:
+    """Converts seconds since the epoch to naive UTC timestamps in the "%Y-%m-%dT%H:%M:%S.%f" format.
+    
+    Parameters
+    ----------
+    ts (numpy.ndarray): The seconds since the epoch.
+    
+    Returns
+    -------
+    List[str]: The ISO timestamps.
+    """
+    micros = np.rint(np.asarray(ts, dtype=np.float64)*1e6).astype(np.int64)
+    return np.datetime_as_string(micros.astype('datetime64[us]'), unit='us').tolist()
+
+# Initialize device memory
+def init_device(dev_class: str, integrated: bool) -> Dict[str, Any]:
+    """Builds the dictionary holding the state and short memory of a device.
+    
+    Parameters
+    ----------
+    dev_class (str): The class of the device.
+    integrated (bool): Whether the device is already integrated in the knowledge graph.
+    
+    Returns
+    -------
+    dict: A dictionary with the device class, integration flag, reporting period, a ring buffer of
+    sample timestamps (epoch seconds), an empty modules dictionary and the lock guarding the buffers 
+    (held while they are changed or copied).
+    """
+    return {'class': dev_class, 'integrated': integrated, 'period': 0, 'timestamps': RingBuffer(), 'modules': {}, 'lock': Lock()}
+
+# Add attribute buffer to device memory
+def add_attrib_buffer(dev: Dict[str, Any], mod_name: str, attrib_name: str, tdbtype: str) -> None:
+    """Adds a ring buffer for an attribute to the memory of a device.
+    
+    Parameters
+    ----------
+    dev (dict): The device dictionary (see init_device).
+    mod_name (str): The name of the module.
+    attrib_name (str): The name of the attribute.
+    tdbtype (str): The TypeDB type of the attribute, which sets the buffer data type.
+    
+    Returns
+    -------
+    None
+    """
+    dtype, fill = buffer_dtypes[tdbtype]
+    dev['modules'].setdefault(mod_name, {})[attrib_name] = RingBuffer(dev['timestamps'].capacity, dtype, fill)
+
+# TypeDB type of a buffer
+def buffer_tdbtype(dtype: np.dtype) -> str:
+    """Returns the TypeDB type of the attributes buffered with a NumPy data type (see buffer_dtypes)."""
+    match dtype.kind :
+        case 'f' : return 'double'
+        case 'b' : return 'boolean'
+    return 'string'
+
+# Append samples to device memory
+def append_samples(dev: Dict[str, Any], ts: float, data: Dict[str, Dict[str, Any]]) -> None:
+    """Appends the samples of a message to the memory of a device, growing its buffers if they are full.
+    
+    Parameters
+    ----------
+    dev (dict): The device dictionary (see init_device).
+    ts (float): The timestamp of the message (epoch seconds).
+    data (dict): The message data, as {'module_name': {'attribute_name': attribute_value, ...}, ...}.
+    
+    Returns
+    -------
+    None
+    """
+    timestamps = dev['timestamps']
+    # Grow buffers instead of overwriting samples still within the time window
+    if timestamps.size == timestamps.capacity :
+        capacity = 2*timestamps.capacity
+        timestamps.grow(capacity)
+        for attribs_dic in dev['modules'].values() :
+            for attrib_buffer in attribs_dic.values() : attrib_buffer.grow(capacity)
+    # Append timestamp and values (missing attributes are filled so buffers stay aligned)
+    timestamps.append(ts)
+    for mod_name, attribs_dic in dev['modules'].items() :
+        mod_dict = data.get(mod_name, {})
+        for attrib_name, attrib_buffer in attribs_dic.items() :
+            attrib_buffer.append(mod_dict.get(attrib_name, attrib_buffer.fill))
+
+# Evict old samples from device memory
+def evict_samples(dev: Dict[str, Any], threshold: float) -> None:
+    """Drops the samples of a device older than a threshold.
+    
+    Parameters
+    ----------
+    dev (dict): The device dictionary (see init_device).
+    threshold (float): The oldest timestamp to keep (epoch seconds).
+    
+    Returns
+    -------
+    None
+    """
+    n = int(np.searchsorted(dev['timestamps'].window(), threshold, side='left'))
+    if n == 0 : return
+    dev['timestamps'].drop(n)
+    for attribs_dic in dev['modules'].values() :
+        for attrib_buffer in attribs_dic.values() : attrib_buffer.drop(n)
+
+# Restore device memory from the knowledge graph
+def hydrate_device(dev_class: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the memory of a device already integrated in the knowledge graph, with a buffer for each of its 
+    modules attributes holding their latest values as a first sample.
+    
+    Parameters
+    ----------
+    dev_class (str): The class of the device ('' if unknown).
+    record (dict): The device state in the knowledge graph (see KGBackend.hydrate_devices).
+    
+    Returns
+    -------
+    dict: The device dictionary (see init_device), marked as integrated.
+    """
+    dev = init_device(dev_class, True)
+    for mod_name, attribs in record['modules'].items() :
+        for attrib_name, (tdbtype, _) in attribs.items() :
+            if tdbtype in buffer_dtypes : add_attrib_buffer(dev, mod_name, attrib_name, tdbtype)
+    # Devices without a timestamp (e.g. from the initial data) have never sent samples
+    if record['timestamp'] is not None and dev['modules'] :
+        data = {mod_name: {attrib_name: value for attrib_name, (_, value) in attribs.items()} for mod_name, attribs in record['modules'].items()}
+        append_samples(dev, to_epoch(record['timestamp']), data)
+    return dev
+
+# Copy device memory
+def copy_devices(devices: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Copies the memory of the devices, with NumPy arrays of their buffered samples.
+    
+    Parameters
+    ----------
+    devices (dict): The devices dictionaries (see init_device).
+    
+    Returns
+    -------
+    dict: A dictionary with the same structure, where the ring buffers are replaced by array copies.
+    """
+    copies = {}
+    for dev_uuid, dev in list(devices.items()) :
+        # Buffers are copied together, while no sample is being added to them
+        with dev['lock'] if 'lock' in dev else nullcontext() :
+            copies[dev_uuid] = {'class': dev['class'], 'integrated': dev['integrated'], 'period': dev['period'],
+                                'timestamps': np.array(dev['timestamps'].window() if isinstance(dev['timestamps'], RingBuffer) else dev['timestamps']),
+                                'modules': {mod_name: {attrib_name: np.array(values.window() if isinstance(values, RingBuffer) else values) 
+                                                       for attrib_name, values in attribs_dic.items()} for mod_name, attribs_dic in dev['modules'].items()}}
+    return copies
+
+# Rotate file
+def rotate_file(path: str, max_bytes: int, backups: int) -> None:
+    """Rotates a file (path -> path.1 -> ... -> path.backups) if it has grown over max_bytes.
+    
+    Parameters
+    ----------
+    path (str): The path of the file.
+    max_bytes (int): The size over which the file is rotated.
+    backups (int): The number of rotated files kept.
+    
+    Returns
+    -------
+    None
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < max_bytes : return
+    for i in range(backups-1, 0, -1) :
+        if os.path.exists(f'{path}.{i}') : os.replace(f'{path}.{i}', f'{path}.{i+1}')
+    if backups > 0 : os.replace(path, f'{path}.1')
+    else : os.remove(path)
+
+# Load state transitions
+def load_states(path: str = 'states.csv') -> pd.DataFrame:
+    """Loads the state transitions written by StatsSink, including the rotated files.
     
     Parameters
     ----------
-    devices (dict): A dictionary where the keys are device UUIDs and the values are dictionaries containing information about the devices.
+    path (str): The path of the current states file.
     
     Returns
     -------
-    pandas.DataFrame: A DataFrame with columns 'uuid', 'class', 'integ', 'period', 'mod', 'attrib', and 'v1' to 'vn', where n is the length of the value buffer for each attribute. Each row represents an attribute of a device module.
+    pandas.DataFrame: A DataFrame with columns 'ts', 'states' and 'worker', oldest transitions first.
     """
-    rows = []
-    for dev_uuid, dev in devices.items() :
-        # Dev row initialization
-        row = { 'uuid': dev_uuid,           'class' : dev['class'],
-                'integ': dev['integrated'], 'period': dev['period']}
-        # Create a row for each module attribute with a column for each value in the buffer
-        for mod_name, attribs_dic in dev['modules'].items() :
-            row['mod'] = mod_name
-            for attrib_name, values in attribs_dic.items() :
-                row['attrib'] = attrib_name
-                for i, val in enumerate(values) : row[f'v{i+1}'] = val
-                rows.append(row.copy())
+    paths = sorted((p for p in os.listdir(os.path.dirname(path) or '.') if p.startswith(os.path.basename(path)+'.')), key=lambda p: -int(p.split('.')[-1]))
+    paths = [os.path.join(os.path.dirname(path), p) for p in paths] + [path]
+    return pd.concat([pd.read_csv(p) for p in paths if os.path.exists(p)], ignore_index=True)
 
-    return pd.DataFrame(rows)
+# Load device samples history
+def load_devices_history(path: str = 'devices.jsonl') -> List[Dict[str, Any]]:
+    """Loads the device snapshots appended by StatsSink, including the rotated files.
+    
+    Parameters
+    ----------
+    path (str): The path of the current history file.
+    
+    Returns
+    -------
+    list: The snapshots, oldest first, as {'ts': newest_sample_ts, 'devices': {uuid: {...}}} dictionaries
+    holding only the samples received since the previous snapshot.
+    """
+    paths = sorted((p for p in os.listdir(os.path.dirname(path) or '.') if p.startswith(os.path.basename(path)+'.')), key=lambda p: -int(p.split('.')[-1]))
+    paths = [os.path.join(os.path.dirname(path), p) for p in paths] + [path]
+    snapshots = []
+    for p in paths :
+        if not os.path.exists(p) : continue
+        with open(p) as f : snapshots += [loads(line) for line in f if line.strip()]
+    return snapshots
 
 # Print device data
 def print_device_data(timestamp: datetime, data: Dict[str, Dict[str, Any]]) -> None:
@@ -726,7 +3839,7 @@ def print_device_data(timestamp: datetime, data: Dict[str, Dict[str, Any]]) -> N
 
 # Print device tree
 def print_device_tree(dev_dict: Dict) -> None:
-    """Prints the device tree for a given device dictionary.
+    """Prints the device tree for a given device dictionary (as a single log record).
     
     Parameters
     ----------
@@ -736,31 +3849,162 @@ def print_device_tree(dev_dict: Dict) -> None:
     -------
     None
     """
+    if not logger.isEnabledFor(kind_levels['']) : return
+    lines = []
     for mod_name, mod_sdf_dict in dev_dict['sdfObject'].items() :
-        print(arrow_str + f'[{mod_name}]',kind='')
+        lines.append(arrow_str + f'[{mod_name}]')
         for attrib_name, attrib_sdf_dict in mod_sdf_dict['sdfProperty'].items() :
             tdbtype = types_trans[attrib_sdf_dict['type']]
-            print(arrow_str2 + f'({attrib_name})<{tdbtype}>',kind='')
+            lines.append(arrow_str2 + f'({attrib_name})<{tdbtype}>')
+    print('\n'.join(lines),kind='')
+
+# Logging configuration
+def configure_logging(level: int = logging.DEBUG, colored: bool = None, rate_limit: float = None, asynchronous: bool = True) -> None:
+    """Configures the logging used by print.
+    
+    Parameters
+    ----------
+    level (int): The minimum level of the records to output (see kind_levels for the level of each kind).
+    colored (bool): Whether to color the output by kind. By default, colors are disabled when the 
+                    NO_COLOR environment variable is set.
+    rate_limit (float): The maximum number of records per second for each key passed to print 
+                        (e.g. per device uuid). None for no limit.
+    asynchronous (bool): Whether records are written to the console by a background thread, 
+                         so that callers never block on terminal I/O.
+    
+    Returns
+    -------
+    None
+    """
+    global log_listener, log_rate_limit
+    stop_logging()
+    if colored is None : colored = 'NO_COLOR' not in os.environ
+    # Console handler
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(KindFormatter(colored))
+    logger.handlers.clear()
+    if asynchronous :
+        log_queue = Queue()
+        logger.addHandler(QueueHandler(log_queue))
+        log_listener = QueueListener(log_queue, handler)
+        log_listener.start()
+    else :
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    log_rate_limit = rate_limit
+    with log_rates_lock : log_rates.clear()
+
+# Flush and stop background logging
+def stop_logging() -> None:
+    """Writes the queued records and stops the background logging thread (if any)."""
+    global log_listener
+    if log_listener is not None :
+        log_listener.stop()
+        log_listener = None
+
+# Rate limiting of log records per key
+def log_allowed(key: str) -> bool:
+    """Checks whether one more record can be logged for a key within the current second.
+    
+    Parameters
+    ----------
+    key (str): The rate limiting key (e.g. a device uuid).
+    
+    Returns
+    -------
+    bool: True if the record can be logged, False if it must be dropped.
+    """
+    now = time.monotonic()
+    # Shared by the ingest workers
+    with log_rates_lock :
+        rate = log_rates.get(key)
+        if rate is None or now - rate[0] >= 1.0 :
+            # New one second window, reporting the records dropped in the previous one
+            suppressed = rate[2] if rate is not None else 0
+            log_rates[key] = [now, 1, 0]
+        elif rate[1] < log_rate_limit :
+            rate[1] += 1
+            return True
+        else :
+            rate[2] += 1
+            return False
+    if suppressed > 0 :
+        logger.log(kind_levels['debug'], f'[{key[0:6]}] {suppressed} log lines suppressed', extra={'kind': 'debug'})
+    return True
+
+# Formatter coloring records by kind
+class KindFormatter(logging.Formatter):
+    """Formats log records as their bare message, colored according to the kind they were printed with."""
+    def __init__(self, colored: bool = True):
+        logging.Formatter.__init__(self)
+        self.colored = colored
+
+    def format(self, record):
+        text = record.getMessage()
+        if self.colored : return cprint_dict.get(getattr(record, 'kind', ''), Fore.YELLOW) + text + Style.RESET_ALL
+        return text
 
 # Colored prints
-def print(text: str, kind: str = '') -> None:
-    """Prints a text in the console with a specific color.
+def print(text: str, kind: str = '', key: str = None) -> None:
+    """Prints a text in the console with a specific color, through a leveled and (by default) 
+    asynchronous logger (see configure_logging).
     
     Parameters
     ----------
     text (str): The text to be printed.
-    kind (str): The color of the text.
+    kind (str): The kind of the text, which sets its color and its level (see kind_levels).
+    key (str): If given, the text is rate limited together with other texts with the same key
+               (e.g. the per message lines of a device).
     
     Returns
     -------
     None
     """
-    prnt(cprint_dict[kind] + str(text) + Style.RESET_ALL)
+    if logger.handlers == [] : configure_logging()
+    level = kind_levels.get(kind, logging.INFO)
+    if not logger.isEnabledFor(level) : return
+    if key is not None and log_rate_limit is not None and not log_allowed(key) : return
+    logger.log(level, str(text), extra={'kind': kind})
 
 ##############################
 ######## DICTIONARIES ########
 ##############################
 
+# Logging
+logging.addLevelName(25, 'SUMMARY')
+logger = logging.getLogger('kgiotdt')
+log_listener = None # background thread writing records
+log_rate_limit = None # records per second per key
+log_rates = {} # key -> [window start, records, suppressed records]
+log_rates_lock = Lock() # guards log_rates
+atexit.register(stop_logging)
+
+# Latency histograms buckets (seconds)
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Metrics descriptions
+metrics_help = {
+    'kgagent_messages_total': 'Messages received by category.',
+    'kgagent_messages_rejected_total': 'Messages rejected by stage.',
+    'kgagent_messages_dropped_total': 'Data messages dropped because the ingest queue was full.',
+    'kgagent_errors_total': 'Unexpected errors by stage.',
+    'kgagent_queries_total': 'TypeDB queries by type.',
+    'kgagent_query_seconds': 'TypeDB query latency by type.',
+    'kgagent_stage_seconds': 'Message processing latency by stage and device class.',
+    'kgagent_process_seconds': 'Data message processing latency by device class.',
+}
+
+# Logging level for each print kind
+kind_levels = {
+    'debug':    logging.DEBUG,
+    'info':     logging.INFO,
+    'success':  logging.INFO,
+    '':         logging.INFO,
+    'summary':  25,
+    'fail':     logging.WARNING
+}
+
 # Colored prints
 cprint_dict = {
     'info':     Fore.WHITE,
@@ -778,6 +4022,41 @@ types_trans = {
     'boolean' :     'boolean'
 }
 
+# Python types accepted for each type
+value_types = {
+    'double' :      (int, float),
+    'string' :      (str,),
+    'boolean' :     (bool,)
+}
+
+# Value wrapping in queries for each type
+value_formatters = {
+    'double' :      lambda value: f'{value:.2f}',
+    'string' :      lambda value: f'"{value}"',
+    'boolean' :     lambda value: str(value).lower()
+}
+
+# Ring buffers data type and missing value for each type
+buffer_dtypes = {
+    'double' :      (np.float64, np.nan),
+    'string' :      (object, None),
+    'boolean' :     (np.bool_, False)
+}
+
+# Columns of the feature store (see FeatureStore)
+feature_columns = {
+    'uuid' :        object,
+    'class' :       object,
+    'mod' :         object,
+    'attrib' :      object,
+    'integ' :       np.bool_,
+    'period' :      np.float64,
+    'seq' :         np.int64,
+    'alive' :       np.bool_,
+    'buffer' :      object,
+    'lock' :        object
+}
+
 # Default values for each type
 defvalues = {
     'string' :      '""',
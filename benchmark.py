@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#----------------------------------------------------------------------------
+# Created By  : Alejandro Jarabo
+# Created Date: 2022-09-19
+# Contact : ale.jarabo.penas@ericsson.com
+# version ='1.0'
+# ---------------------------------------------------------------------------
+""" Knowledge Graph Agent Benchmark
+This module measures the throughput of the Knowledge Graph Agent in a reproducible way.
+A stream of MQTT messages is first recorded to an indexed file, either by subscribing to a
+running broker or by synthesizing it offline from the test environment devices. The stream
+is then replayed into KGAgent.on_message at its original pace, N times faster or as fast as
+possible, and the achieved messages per second, the per-stage latency percentiles and the
+memory used are reported in JSON, so that regressions can be tracked across commits.
+
+The agent runs against a pluggable backend: the real TypeDB server, or the in-memory graph
+(optionally with injected query latency), which needs no network.
+
+The live command runs the simulator (on a virtual clock) and the agent in the same process instead,
+with the messages going through the MQTT broker or through the in-process bus (--transport local),
+which gives a broker-free baseline: the simulator only publishes as fast as the agent consumes.
+
+The topology command generates a plant much larger than typedbconfig/data.tql, and the load command
+bulk loads a topology into the knowledge graph, reporting the onboarding throughput.
+
+Usage:
+    python benchmark.py synthesize stream.bin --duration 120
+    python benchmark.py record stream.bin --duration 120
+    python benchmark.py replay stream.bin --speed max --backend memory --output results.json
+    python benchmark.py live --duration 600 --transport local --backend memory --output results.json
+    python benchmark.py topology plant.tql --departments 10 --tasks 100 --devices 5
+    python benchmark.py load plant.tql --backend typedb --sessions 8 --batch-size 100 --output results.json
+"""
+# ---------------------------------------------------------------------------
+# Imports
+import argparse
+import struct
+import resource
+import tracemalloc
+import subprocess
+import heapq
+from kgagent import *
+from simulator import *
+# ---------------------------------------------------------------------------
+
+# Stream files: records of (time, topic length, payload length) + topic + payload, and an index of (offset, time)
+record_header = struct.Struct('<dHI')
+index_dtype = np.dtype([('offset','<u8'),('t','<f8')])
+
+# Latency percentiles reported
+percentiles = (0.5, 0.95, 0.99)
+
+#############################
+######## STREAM FILES #######
+#############################
+
+# Stream writer
+class StreamRecorder() :
+    """
+    A class that appends MQTT messages to a stream file and its index (path + '.idx').
+
+    Attributes:
+        path (str): The path of the stream file.
+        n (int): The number of messages written.
+
+    Methods:
+        write(t: float, topic: str, payload: bytes) -> None: Appends a message received at time t (in seconds).
+        close() -> None: Closes the stream and index files.
+    """
+    # Initialization
+    def __init__(self, path: str):
+        self.path = path
+        self.data = open(path, 'wb')
+        self.index = open(path + '.idx', 'wb')
+        self.offset = 0
+        self.n = 0
+        self.lock = Lock()
+
+    # Append message
+    def write(self, t: float, topic: str, payload: bytes) -> None :
+        topic = topic.encode()
+        with self.lock :
+            self.index.write(np.array([(self.offset, t)], dtype=index_dtype).tobytes())
+            self.data.write(record_header.pack(t, len(topic), len(payload)) + topic + payload)
+            self.offset += record_header.size + len(topic) + len(payload)
+            self.n += 1
+
+    # Close files
+    def close(self) -> None :
+        self.data.close()
+        self.index.close()
+
+# Stream reader
+class StreamReader() :
+    """
+    A class that gives random access to the messages of a stream file through its index.
+
+    Attributes:
+        path (str): The path of the stream file.
+        index (numpy.ndarray): The offset and time of each message.
+
+    Methods:
+        __getitem__(i: int) -> Tuple[float, str, bytes]: Returns the time, topic and payload of a message.
+        __len__() -> int: Returns the number of messages.
+        duration() -> float: Returns the time between the first and the last message.
+    """
+    # Initialization
+    def __init__(self, path: str):
+        self.path = path
+        self.index = np.fromfile(path + '.idx', dtype=index_dtype)
+        with open(path, 'rb') as f : self.data = f.read()
+
+    # Read message
+    def __getitem__(self, i: int) -> Tuple[float, str, bytes] :
+        offset = int(self.index['offset'][i])
+        t, topic_len, payload_len = record_header.unpack_from(self.data, offset)
+        start = offset + record_header.size
+        topic = self.data[start:start+topic_len].decode()
+        return t, topic, self.data[start+topic_len:start+topic_len+payload_len]
+
+    def __len__(self) -> int :
+        return len(self.index)
+
+    def __iter__(self) :
+        for i in range(len(self)) : yield self[i]
+
+    # Stream duration
+    def duration(self) -> float :
+        return float(self.index['t'][-1] - self.index['t'][0]) if len(self) > 0 else 0.0
+
+# Message as delivered by paho
+class ReplayedMessage() :
+    """A minimal stand-in for paho's MQTTMessage, with the topic and payload of a replayed message."""
+    __slots__ = ('topic', 'payload')
+
+    # Initialization
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+#################################
+######## STREAM RECORDING #######
+#################################
+
+# Record the messages published to a broker
+def record_stream(path: str, duration: float) -> int :
+    """Subscribes to all topics of the broker and records the messages received for a while.
+
+    Parameters
+    ----------
+    path (str): The path of the stream file.
+    duration (float): The recording time in seconds.
+
+    Returns
+    -------
+    int: The number of messages recorded.
+    """
+    recorder = StreamRecorder(path)
+    client = new_client('KG-recorder')
+    client.on_connect = lambda client, userdata, flags, rc: client.subscribe('#', qos=0)
+    client.on_message = lambda client, userdata, msg: recorder.write(time.time(), msg.topic, msg.payload)
+    client.connect(broker_addr, port=broker_port)
+    client.loop_start()
+    time.sleep(duration)
+    client.loop_stop()
+    client.disconnect()
+    recorder.close()
+    return recorder.n
+
+# Synthesize a stream offline
+def synthesize_stream(path: str, duration: float, devices: List[IoTDevice] = None, events: List[Tuple[float, str, Any]] = [], seed: int = 0) -> int :
+    """Generates the messages the devices would publish during a period of time, without a broker.
+
+    Parameters
+    ----------
+    path (str): The path of the stream file.
+    duration (float): The simulated time in seconds.
+    devices (list): The devices publishing from the beginning (the test environment scenario if None).
+    events (list): The (time, 'start' | 'stop', device) events changing the devices publishing.
+    seed (int): The seed of the random data generation.
+
+    Returns
+    -------
+    int: The number of messages generated.
+    """
+    random.seed(seed)
+    if devices is None : devices, events = testenv_scenario()
+    t0 = datetime.now().timestamp()
+    # Waveforms, ground truths and timestamps follow a virtual clock starting now
+    clock = VirtualClock(start=datetime.fromtimestamp(t0))
+    # Heap of (next publishing time, order, device), devices start within their first 10 seconds (as in tic_behavior)
+    heap, active, order = [], set(), 0
+    def schedule(t, dev) :
+        nonlocal order
+        heapq.heappush(heap, (t, order, dev))
+        order += 1
+    for dev in devices :
+        active.add(dev.uuid)
+        schedule(random.uniform(0,10), dev)
+    for t, action, dev in events :
+        if action == 'start' : schedule(t + random.uniform(0,10), dev)
+    stops = {dev.uuid: t for t, action, dev in events if action == 'stop'}
+    # Generate messages in time order
+    recorder = StreamRecorder(path)
+    previous_clock = set_clock(clock)
+    try :
+        while heap and heap[0][0] < duration :
+            t, _, dev = heapq.heappop(heap)
+            if t >= stops.get(dev.uuid, np.inf) : continue
+            clock.advance_to(t)
+            recorder.write(t0 + t, dev.topic, dev.encode(dev.gen_msg()))
+            schedule(t + dev.interval, dev)
+    finally :
+        set_clock(previous_clock)
+        recorder.close()
+    return recorder.n
+
+####################################
+######## BACKENDS AND REPLAY #######
+####################################
+
+# Build agent
+def make_agent(backend: str = 'memory', latency: float = 0.0, **kwargs) -> KGAgent :
+    """Builds a Knowledge Graph Agent on the given backend.
+
+    Parameters
+    ----------
+    backend (str): 'typedb' (the KG is initialized in the TypeDB server) or 'memory' (InMemoryGraph).
+    latency (float): The latency (in seconds) injected in each operation of the in-memory graph.
+    **kwargs: The KGAgent parameters.
+
+    Returns
+    -------
+    KGAgent: The agent, with its workers not started yet.
+    """
+    match backend :
+        case 'typedb' : return KGAgent(initialize=True, **kwargs)
+        case 'memory' : return KGAgent(backend=InMemoryGraph(latency=latency), **kwargs)
+    raise ValueError(f'unknown backend {backend!r}')
+
+# Replay stream into an agent
+def replay_stream(agent: KGAgent, reader: StreamReader, speed: float = None) -> Dict[str, Any] :
+    """Delivers the messages of a stream to KGAgent.on_message and waits for them to be processed.
+
+    Parameters
+    ----------
+    agent (KGAgent): The agent, with its workers not started yet.
+    reader (StreamReader): The stream.
+    speed (float): The replay speed relative to the recording (None to replay as fast as possible).
+
+    Returns
+    -------
+    dict: The benchmark results (throughput, latency percentiles, queries and memory).
+    """
+    # Start workers (MQTT is bypassed)
+    if agent.batch_writer is not None : agent.batch_writer.start()
+    agent.ingest_pool.start()
+    agent.integration_pool.warm()
+    # Deliver messages at the requested pace
+    t0, tic = reader.index['t'][0] if len(reader) > 0 else 0.0, time.perf_counter()
+    for t, topic, payload in reader :
+        if speed is not None :
+            delay = (t-t0)/speed - (time.perf_counter()-tic)
+            if delay > 0 : time.sleep(delay)
+        agent.on_message(None, None, ReplayedMessage(topic, payload))
+    delivered = time.perf_counter()
+    # Wait for queued messages and updates to be processed
+    agent.ingest_pool.stop()
+    if agent.batch_writer is not None : agent.batch_writer.stop()
+    toc = time.perf_counter()
+    return benchmark_results(agent, len(reader), toc-tic, delivered-tic)
+
+# Generate plant topology
+def gen_topology(departments: int = 10, tasks: int = 100, devices: int = 5, seed: int = 0) -> str :
+    """Generates the initial data of a plant, in the format of typedbconfig/data.tql: departments executing lines of 
+    tasks in sequence, connected by conveyor belts, and devices of random classes (from the schema) needed by each task.
+
+    Parameters
+    ----------
+    departments (int): The number of departments.
+    tasks (int): The number of tasks of each department.
+    devices (int): The number of devices needed by each task.
+    seed (int): The seed of the random classes and UUIDs.
+
+    Returns
+    -------
+    str: The TypeQL insert query.
+    """
+    random.seed(seed)
+    with open('typedbconfig/schema.tql') as f : classes = [c for c in re.findall(r'(\w+)\s+sub\s+device', f.read()) if c != 'conveyorbelt']
+    lines = ['insert', '']
+    for d in range(departments) :
+        lines.append(f'$dept{d} isa department, has name "Department {d}";')
+        for t in range(tasks) :
+            task = f'$task{d}_{t}'
+            lines += [f'{task} isa task, has name "Task {d}.{t}";', f'$execution{d}_{t} (department: $dept{d}, task: {task}) isa execution;']
+            # Consecutive tasks are connected by a conveyor belt
+            if t > 0 :
+                lines += [f'$convbelt{d}_{t} isa conveyorbelt, has uuid "{gen_uuid()}";',
+                          f'$sequence{d}_{t} (predecessor: $task{d}_{t-1}, successor: {task}, connectedby: $convbelt{d}_{t}) isa sequence;']
+            for k in range(devices) :
+                lines += [f'$dev{d}_{t}_{k} isa {random.choice(classes)}, has uuid "{gen_uuid()}";',
+                          f'$needs{d}_{t}_{k} (task: {task}, device: $dev{d}_{t}_{k}) isa needs;']
+    return '\n'.join(lines) + '\n'
+
+# Run the agent on a live simulation
+def live_run(agent: KGAgent, devices: List[IoTDevice], events: List[Tuple[float, str, IoTDevice]], duration: float, speed: float = None, connections: int = 4, timeout: float = 60.0) -> Dict[str, Any] :
+    """Runs the agent and a simulation of the devices (on a virtual clock) in this process, with the messages
+    going through the agent's transport, and waits for the published messages to be processed.
+
+    Parameters
+    ----------
+    agent (KGAgent): The agent, not started yet.
+    devices (list): The devices publishing from the beginning (not started).
+    events (list): The (time, 'start' | 'stop', device) events changing the devices publishing.
+    duration (float): The simulated time in seconds.
+    speed (float): The simulated seconds per wall second (None to publish as fast as the transport accepts messages).
+    connections (int): The number of simulator connections.
+    timeout (float): The time (in seconds) to wait for the agent to connect and for messages in flight.
+
+    Returns
+    -------
+    dict: The benchmark results (throughput, latency percentiles, queries and memory), including the messages lost.
+    """
+    clock = VirtualClock()
+    previous_clock = set_clock(clock)
+    try :
+        # Start agent and wait for its subscription
+        Thread(target=agent.start, name='kgagent', daemon=True).start()
+        if not agent.connected.wait(timeout) : raise TimeoutError('the agent did not connect to the broker')
+        pool = ConnectionPool(connections, client_prefix='benchmark-simulator')
+        pool.connect()
+        simulator = Simulator(pool, devices, clock=clock, speed=speed, until=duration)
+        for t, action, dev in events : simulator.at(t, action, dev)
+        # Simulate
+        tic = time.perf_counter()
+        simulator.start()
+        simulator.join()
+        delivered = time.perf_counter()
+        # Wait for the messages in flight to be received, then processed
+        deadline = delivered + timeout
+        while agent.decoded_msg_count + agent.rejected_msg_count < pool.sent and time.perf_counter() < deadline : time.sleep(0.01)
+        pool.disconnect()
+        agent.client.disconnect()
+        agent.ingest_pool.stop()
+        if agent.batch_writer is not None : agent.batch_writer.stop()
+        toc = time.perf_counter()
+    finally :
+        set_clock(previous_clock)
+    results = benchmark_results(agent, simulator.published, toc-tic, delivered-tic)
+    results['lost'] = max(0, pool.sent - agent.decoded_msg_count - agent.rejected_msg_count)
+    return results
+
+# Collect results
+def benchmark_results(agent: KGAgent, n_msgs: int, elapsed: float, delivery_time: float) -> Dict[str, Any] :
+    """Collects the throughput, latency percentiles, queries and memory of a replay.
+
+    Parameters
+    ----------
+    agent (KGAgent): The agent the stream was replayed into.
+    n_msgs (int): The number of messages delivered.
+    elapsed (float): The time until all messages were processed.
+    delivery_time (float): The time until all messages were delivered.
+
+    Returns
+    -------
+    dict: The benchmark results.
+    """
+    quantiles = lambda name, **labels: {f'p{q*100:g}': agent.metrics.quantile(name, q, **labels) for q in percentiles}
+    histograms = list(agent.metrics.histograms.items())
+    stage_counts = {}
+    for (name, labels), hist in histograms :
+        if name == 'kgagent_stage_seconds' :
+            stage = dict(labels)['stage']
+            stage_counts[stage] = stage_counts.get(stage, 0) + hist.n
+    ingest_stats = agent.ingest_pool.get_stats()
+    return {
+        'n_msgs': n_msgs,
+        'processed': agent.total_msg_count,
+        'rejected': agent.rejected_msg_count,
+        'dropped': ingest_stats['dropped'],
+        'errors': ingest_stats['errors'],
+        'elapsed': elapsed,
+        'delivery_time': delivery_time,
+        'msgs_per_s': n_msgs/elapsed if elapsed > 0 else np.nan,
+        'process': quantiles('kgagent_process_seconds'),
+        'stages': {stage: dict(n=n, **quantiles('kgagent_stage_seconds', stage=stage)) for stage, n in sorted(stage_counts.items())},
+        'queries': agent.kg.get_query_stats(),
+        'memory': {'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+                   'traced_peak_mb': tracemalloc.get_traced_memory()[1]/2**20 if tracemalloc.is_tracing() else None},
+    }
+
+# Current commit
+def git_commit() -> str :
+    try : return subprocess.run(['git','rev-parse','HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) : return None
+
+######################
+######## MAIN ########
+######################
+def main() :
+    parser = argparse.ArgumentParser(description='Record and replay MQTT streams to benchmark the Knowledge Graph Agent.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_cmd = commands.add_parser('record', help='record the messages published to the broker')
+    record_cmd.add_argument('stream')
+    record_cmd.add_argument('--duration', type=float, default=120)
+    synth_cmd = commands.add_parser('synthesize', help='generate the test environment messages offline')
+    synth_cmd.add_argument('stream')
+    synth_cmd.add_argument('--duration', type=float, default=120)
+    synth_cmd.add_argument('--seed', type=int, default=0)
+    replay_cmd = commands.add_parser('replay', help='replay a stream into the agent')
+    replay_cmd.add_argument('stream')
+    replay_cmd.add_argument('--speed', default='max', help='replay speed (1, N or max)')
+    live_cmd = commands.add_parser('live', help='run the agent on a live simulation in this process')
+    live_cmd.add_argument('--duration', type=float, default=120, help='simulated time in seconds')
+    live_cmd.add_argument('--speed', default='max', help='simulation speed (1, N or max)')
+    live_cmd.add_argument('--transport', choices=['mqtt','local'], default='local')
+    live_cmd.add_argument('--devices', type=int, default=None, help='simulate a fleet of N devices instead of the test environment scenario')
+    live_cmd.add_argument('--connections', type=int, default=4)
+    live_cmd.add_argument('--seed', type=int, default=0)
+    topology_cmd = commands.add_parser('topology', help='generate a plant topology')
+    topology_cmd.add_argument('data')
+    topology_cmd.add_argument('--departments', type=int, default=10)
+    topology_cmd.add_argument('--tasks', type=int, default=100, help='tasks of each department')
+    topology_cmd.add_argument('--devices', type=int, default=5, help='devices needed by each task')
+    topology_cmd.add_argument('--seed', type=int, default=0)
+    load_cmd = commands.add_parser('load', help='bulk load a plant topology into the initialized knowledge graph')
+    load_cmd.add_argument('data')
+    load_cmd.add_argument('--backend', choices=['typedb','memory'], default='memory')
+    load_cmd.add_argument('--sessions', type=int, default=4, help='transactions committed in parallel')
+    load_cmd.add_argument('--batch-size', type=int, default=100, help='entities or relations inserted in each transaction')
+    load_cmd.add_argument('--output', help='JSON file the results are written to')
+    for cmd in (replay_cmd, live_cmd) :
+        cmd.add_argument('--backend', choices=['typedb','memory'], default='memory')
+        cmd.add_argument('--latency', type=float, default=0.0, help='operation latency injected in the memory backend (seconds)')
+        cmd.add_argument('--workers', type=int, default=4)
+        cmd.add_argument('--batch-size', type=int, default=50)
+        cmd.add_argument('--batch-ms', type=int, default=50)
+        cmd.add_argument('--trace-memory', action='store_true', help='trace Python allocations (slower)')
+        cmd.add_argument('--output', help='JSON file the results are written to')
+    args = parser.parse_args()
+
+    match args.command :
+        case 'record' :
+            n = record_stream(args.stream, args.duration)
+            prnt(f'{n} messages recorded to {args.stream}')
+        case 'synthesize' :
+            n = synthesize_stream(args.stream, args.duration, seed=args.seed)
+            prnt(f'{n} messages generated to {args.stream}')
+        case 'topology' :
+            with open(args.data, 'w') as f : f.write(gen_topology(args.departments, args.tasks, args.devices, args.seed))
+            prnt(f'{args.departments*args.tasks} tasks and {args.departments*args.tasks*(args.devices+1)-args.departments} devices generated to {args.data}')
+        case 'load' :
+            kg = TypeDBClient(initialize=True, n_sessions=args.sessions) if args.backend == 'typedb' else InMemoryGraph()
+            with open(args.data) as f : results = dict(kg.bulk_load(f.read(), args.batch_size, args.sessions))
+            results.update({'commit': git_commit(), 'timestamp': datetime.now().isoformat(), 'backend': args.backend, 'data': args.data,
+                            'sessions': args.sessions, 'batch_size': args.batch_size})
+            output = dumps(results, indent=4, cls=ModifiedEncoder)
+            if args.output :
+                with open(args.output, 'w') as f : f.write(output)
+            prnt(output)
+        case 'replay' | 'live' :
+            # Only warnings and summaries are logged, so the console does not limit throughput
+            configure_logging(level=logging.WARNING, colored=False)
+            if args.trace_memory : tracemalloc.start()
+            speed = None if args.speed == 'max' else float(args.speed)
+            if args.command == 'replay' :
+                reader = StreamReader(args.stream)
+                agent = make_agent(args.backend, args.latency, n_workers=args.workers, max_queue=len(reader)+1,
+                                   batch_size=args.batch_size, batch_ms=args.batch_ms)
+                agent.ingest_pool.block = True # measure capacity instead of dropping messages
+                results = replay_stream(agent, reader, speed)
+                results.update({'stream': args.stream, 'stream_duration': reader.duration()})
+            else :
+                random.seed(args.seed)
+                set_transport(args.transport) # of the agent and the simulator
+                devices, events = testenv_scenario() if args.devices is None else (build_fleet(args.devices)[0], [])
+                agent = make_agent(args.backend, args.latency, n_workers=args.workers, batch_size=args.batch_size,
+                                   batch_ms=args.batch_ms)
+                agent.ingest_pool.block = True # slow the simulation down instead of dropping messages
+                results = live_run(agent, devices, events, args.duration, speed, args.connections)
+                results.update({'transport': args.transport, 'devices': len(devices), 'simulated_time': args.duration, 'seed': args.seed})
+            results.update({'commit': git_commit(), 'timestamp': datetime.now().isoformat(), 'backend': args.backend, 'latency': args.latency,
+                            'speed': args.speed, 'workers': args.workers, 'batch_size': args.batch_size, 'batch_ms': args.batch_ms})
+            agent.stats_sink.stop()
+            stop_logging()
+            output = dumps(results, indent=4, cls=ModifiedEncoder)
+            if args.output :
+                with open(args.output, 'w') as f : f.write(output)
+            prnt(output)
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,8 @@ This class is then inherited by several device subclasses, such as robotic arms
 or air quality devices, which publish their simulated data updates to the MQTT network. 
 The network messages are in JSON format and include the device class, which is linked to the 
 device class' SDF description. If the Knowledge Graph Agent is unaware of the device, it can use 
-the SDF description to learn about it.
+the SDF description to learn about it. A compact binary encoding (MessagePack or CBOR, with epoch 
+timestamps and optionally SDF-ordered value lists) can be chosen through wire_format and use_ordinals.
 """
 # ---------------------------------------------------------------------------
 # Imports
@@ -25,6 +26,10 @@ broker_port = 8883
 # Control messaging frequency
 speedup_factor = 1
 
+# Messages encoding ('json', 'msgpack' or 'cbor') and SDF-ordered value lists for binary formats
+wire_format = 'json'
+use_ordinals = False
+
 ###################################
 ######## IOT DEVICES CLASS ########
 ###################################
@@ -44,6 +49,8 @@ class IoTDevice(Thread) :
     modifier (float): a factor to personalize the data generated by the device
     print_logs (bool): if True, log messages will be printed to the console
     active (bool): indicates whether the device is active or not
+    wire_format (str): the messages encoding ('json', 'msgpack' or 'cbor')
+    use_ordinals (bool): if True, binary messages carry value lists in SDF order instead of named dictionaries
 
     Methods:
     __init__(self, topic: str, devuuid: str, interval: float, modifier: float, print_logs: bool) -> None: initializes the attributes of the IoTDevice object, 
@@ -54,6 +61,10 @@ class IoTDevice(Thread) :
     on_disconnect(self, client, userdata, rc) -> None: a callback function that is called when the device disconnects from the MQTT broker. 
         It prints a message indicating that the device has disconnected and publishes a message to the device's topic.
     gen_msg(self) -> str: generates a message to be published by the device.
+    gen_data_batch(cls, devices: list) -> list: generates one tick of data for several devices of the class at once 
+        (one gen_data call per device unless the class implements it with vectorized NumPy generation).
+    gen_msg_batch(cls, devices: list) -> list: generates one message for each of several devices of the class at once.
+    encode(self, msg: dict) -> bytes: encodes a message in the device wire format.
     tic_behavior(self) -> None: defines the behavior of the device when it is active. It waits a random amount of time before starting and then periodically 
         publishes data when the device is active. It also prints log messages and processes callback functions.
     run(self) -> None: called when the IoTDevice object is started as a separate thread. It creates a new MQTT client instance and binds the callback functions. 
@@ -68,9 +79,13 @@ class IoTDevice(Thread) :
         self.modifier = modifier
         self.print_logs = print_logs
         # UUIDs
-        self.uuid = re.sub(r'(\S{8})(\S{4})(\S{4})(\S{4})(.*)',r'\1-\2-\3-\4-\5',uuid.uuid4().hex) if devuuid=='' else devuuid  # assign unique identifier
+        self.uuid = gen_uuid() if devuuid=='' else devuuid  # assign unique identifier
         # Activation flag
         self.active = True
+        # Messages encoding
+        self.wire_format = wire_format
+        self.use_ordinals = use_ordinals
+        self.ordinals = None
         
     # MQTT Callback Functions
     def on_log(client, userdata, level, buf):
@@ -79,44 +94,66 @@ class IoTDevice(Thread) :
     def on_connect(self, client, userdata, flags, rc):
         print(f'{self.dev_class}[{self.uuid[0:6]}] connected.', kind='success')
         msg = gen_header(self.dev_class,self.topic,self.uuid,category='CONNECTED')
-        self.client.publish(self.topic,dumps(msg, indent=4))
+        self.client.publish(self.topic,self.encode(msg))
 
     def on_disconnect(self, client, userdata, rc):
         print(f'{self.dev_class}[{self.uuid[0:6]}] disconnected.', kind='fail')
         msg = gen_header(self.dev_class,self.topic,self.uuid,category='DISCONNECTED')
-        self.client.publish(self.topic,dumps(msg, indent=4))
+        self.client.publish(self.topic,self.encode(msg))
 
     # Message generation function
     def gen_msg(self):
         msg = gen_header(self.dev_class,self.topic,self.uuid)
         msg['data'] = self.gen_data()
         return msg
+
+    # Batched data generation (one tick of several devices of this class)
+    @classmethod
+    def gen_data_batch(cls, devices: List['IoTDevice']) -> List[Dict] :
+        return [dev.gen_data() for dev in devices]
+
+    # Batched message generation
+    @classmethod
+    def gen_msg_batch(cls, devices: List['IoTDevice']) -> List[Dict] :
+        msgs = []
+        for dev, data in zip(devices, cls.gen_data_batch(devices)) :
+            msg = gen_header(dev.dev_class,dev.topic,dev.uuid)
+            msg['data'] = data
+            msgs.append(msg)
+        return msgs
+
+    # Message encoding function
+    def encode(self, msg):
+        if self.use_ordinals and self.wire_format != 'json' and self.ordinals is None :
+            self.ordinals = sdf_ordinals(SDFManager().build_sdf(self.dev_class)[0]['sdfThing'][self.dev_class])
+        return encode_msg(msg, self.wire_format, self.ordinals if self.use_ordinals else None)
     
     # Define tic behavior
     def tic_behavior(self):
+        clock = get_clock()
         # Wait a random amount of time (up to 10secs) before starting
-        time.sleep(random.uniform(0,10))
+        clock.sleep(random.uniform(0,10))
         # Periodically publish data when connected
         self.msg_count = 0
-        tic = time.perf_counter()
+        tic = clock.time()
         while True :
             if not self.active :
                 print(f'{self.dev_class}[{self.uuid[0:6]}] inactive <N={self.msg_count} | T={tic-last_tic:.3f}s>', kind='') # print info
-                while not self.active : time.sleep(5)
+                while not self.active : clock.sleep(5)
             self.msg_count += 1
             last_tic = tic
-            tic = time.perf_counter()
+            tic = clock.time()
             msg = self.gen_msg() # generate message with random data
-            self.client.publish(self.topic,dumps(msg, indent=4)) # publish it
-            print(f'({self.topic}) <- {self.dev_class}[{self.uuid[0:6]}] msg published <N={self.msg_count} | T={tic-last_tic:.3f}s>', kind='info') # print info
-            if self.print_logs : print(msg) #print_device_data(msg['timestamp'],msg['data'])
-            print('')
+            self.client.publish(self.topic,self.encode(msg)) # publish it
+            print(f'({self.topic}) <- {self.dev_class}[{self.uuid[0:6]}] msg published <N={self.msg_count} | T={tic-last_tic:.3f}s>', kind='info', key=self.uuid) # print info
+            if self.print_logs : print(msg, key=self.uuid) #print_device_data(msg['timestamp'],msg['data'])
+            print('', key=self.uuid)
             self.client.loop() # run client loop for callbacks to be processed
-            time.sleep(self.interval) # wait till next execution
+            clock.sleep(self.interval) # wait till next execution
         
     # Thread execution
     def run(self):
-        self.client = mqtt_client.Client(self.uuid) # create new client instance
+        self.client = new_client(self.uuid) # create new client instance
 
         self.client.on_log = self.on_log # bind callback fn
         self.client.on_connect = self.on_connect # bind callback fn
@@ -127,6 +164,24 @@ class IoTDevice(Thread) :
         
         self.tic_behavior() # start tic behavior
 
+# Data generation parameters of several devices, as one array per parameter
+def batch_params(devices: List[IoTDevice]) -> Tuple[np.ndarray, ...] :
+    return tuple(np.array(param, dtype=float) for param in zip(*[dev.params for dev in devices]))
+
+# Current ground truth values of several devices
+def batch_ground_truth(devices: List[IoTDevice], var: str) -> np.ndarray :
+    return np.array([dev.gt.get(var) for dev in devices], dtype=float)
+
+# Modifiers of several devices
+def batch_modifiers(devices: List[IoTDevice]) -> np.ndarray :
+    return np.array([dev.modifier for dev in devices], dtype=float)
+
+# Actuators transitions of several robots (same probabilities as their gen_data)
+def step_actuators(devices: List[IoTDevice]) -> np.ndarray :
+    actuator_status = coin_batch(np.where([dev.actuator_status for dev in devices], 0.7, 0.2))
+    for dev, status in zip(devices, actuator_status.tolist()) : dev.actuator_status = status
+    return actuator_status
+
 #########################################
 ######## PRODUCTION LINE DEVICES ########
 #########################################
@@ -184,6 +239,25 @@ class ConveyorBelt(IoTDevice):
         # Return updated data dictionary
         return {'conveyor_belt' : conveyor_belt_copy}
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        # CONVEYOR BELT MODULES
+        belts = [dev.conveyor_belt for dev in devices]
+        status = coin_batch(np.where([belt['status'] for belt in belts], 0.95, 0.2))
+        speeds = {name: get_new_samples([belt[name] for belt in belts]) for name in ('linear_speed','rotational_speed','weight')}
+        for i, belt in enumerate(belts) :
+            belt['status'] = bool(status[i])
+            for name, values in speeds.items() : belt[name] = float(values[i])
+
+        # Modifications based on status values
+        return unstack_batch({'conveyor_belt' : {
+            'status': status,
+            'linear_speed': np.where(status, speeds['linear_speed'], 0.0),
+            'rotational_speed': np.where(status, speeds['rotational_speed'], 0.0),
+            'weight': speeds['weight']
+        }}, len(devices))
+
 # TAG SCANNER
 class TagScanner(IoTDevice):
     """TagScanner: a class representing an RFID tag scanner in a production line
@@ -386,6 +460,22 @@ class PoseDetector(IoTDevice):
             }
         }
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        offset, A, T, phi = batch_params(devices)
+        t = get_clock().time()
+        return unstack_batch({
+            'pose_detection_cam':{
+                'x_position' : sample_triangular_batch(offset,A,T,phi,t),
+                'y_position' : sample_triangular_batch(offset+1,A*2,T/2,phi,t),
+                'z_position' : sample_triangular_batch(offset-1,A/2,T*2,phi,t),
+                'roll_orientation' : sample_triangular_batch(offset+np.pi/2,A,T,phi,t),
+                'pitch_orientation' : sample_triangular_batch(offset+6*np.pi/4,A*2,T/2,phi,t),
+                'yaw_orientation' : sample_triangular_batch(offset-6*np.pi/4,A/2,T*2,phi,t)
+            }
+        }, len(devices))
+
 # PIECE DETECTOR
 class PieceDetector(IoTDevice):
     """PieceDetector: a class representing a piece detector in a production line
@@ -423,6 +513,24 @@ class PieceDetector(IoTDevice):
             }
         }
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        offset, A, T, phi = batch_params(devices)
+        n, t = len(devices), get_clock().time()
+        piece_id = np.where(coin_batch(0.7,n), [dev.piece_id for dev in devices], random.randint(0,6,n))
+        return unstack_batch({
+            'piece_detection_cam':{
+                'piece_id' : piece_id,
+                'x_position' : sample_sawtooth_batch(offset,A,T,phi,t),
+                'y_position' : sample_sawtooth_batch(offset+1,A*2,T/2,phi,t),
+                'z_position' : sample_sawtooth_batch(offset-1,A/2,T*2,phi,t),
+                'roll_orientation' : sample_sawtooth_batch(offset+np.pi/2,A,T,phi,t),
+                'pitch_orientation' : sample_sawtooth_batch(offset+6*np.pi/4,A*2,T/2,phi,t),
+                'yaw_orientation' : sample_sawtooth_batch(offset-6*np.pi/4,A/2,T*2,phi,t)
+            }
+        }, n)
+
 # PICK UP ROBOT
 class PickUpRobot(IoTDevice):
     """PickUpRobot: a class representing a pick-up robot in a production line
@@ -452,6 +560,13 @@ class PickUpRobot(IoTDevice):
         # Return updated data dictionary
         return gen_robot_data(offset,A,T,phi+random.normal(),self.actuator_status)
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        actuator_status = step_actuators(devices)
+        offset, A, T, phi = batch_params(devices)
+        return unstack_batch(gen_robot_data_batch(offset,A,T,phi+random.normal(size=len(devices)),actuator_status), len(devices))
+
 # CLAMPING ROBOT
 class ClampingRobot(IoTDevice):
     """ClampingRobot: a class representing a clamping robot in a production line
@@ -481,6 +596,13 @@ class ClampingRobot(IoTDevice):
         # Return updated data dictionary
         return gen_robot_data(offset,A,T,phi+random.normal(),self.actuator_status)
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        actuator_status = step_actuators(devices)
+        offset, A, T, phi = batch_params(devices)
+        return unstack_batch(gen_robot_data_batch(offset,A,T,phi+random.normal(size=len(devices)),actuator_status), len(devices))
+
 # DRILLING ROBOT
 class DrillingRobot(IoTDevice):
     """DrillingRobot: a class representing a drilling robot in a production line
@@ -511,6 +633,13 @@ class DrillingRobot(IoTDevice):
         # Return updated data dictionary
         return gen_robot_data(offset,A,T,phi+random.normal(),self.actuator_status)
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        actuator_status = step_actuators(devices)
+        offset, A, T, phi = batch_params(devices)
+        return unstack_batch(gen_robot_data_batch(offset,A,T,phi+random.normal(size=len(devices)),actuator_status), len(devices))
+
 # MILLING ROBOT
 class MillingRobot(IoTDevice):
     """MillingRobot: a class representing a milling robot in a production line
@@ -541,6 +670,13 @@ class MillingRobot(IoTDevice):
         # Return updated data dictionary
         return gen_robot_data(offset,A,T,phi+random.normal(),self.actuator_status)
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        actuator_status = step_actuators(devices)
+        offset, A, T, phi = batch_params(devices)
+        return unstack_batch(gen_robot_data_batch(offset,A,T,phi+random.normal(size=len(devices)),actuator_status), len(devices))
+
 
 ################################################
 ######## SAFETY / ENVIRONMENTAL DEVICES ########
@@ -579,6 +715,18 @@ class AirQuality(IoTDevice):
             }
         }
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        modifier = batch_modifiers(devices)
+        sample = lambda var : sample_normal_mod_batch(batch_ground_truth(devices,var),modifier=modifier)
+        return unstack_batch({
+            'temperature_sensor' : {'temperature': sample('temperature')},
+            'humidity_sensor' : {'humidity': sample('humidity')},
+            'pressure_sensor' : {'pressure': sample('pressure')},
+            'air_quality_sensor' : {'pm1': sample('pm1'), 'pm25': sample('pm25'), 'pm10': sample('pm10')}
+        }, len(devices))
+
 # AIR QUALITY MODIFIED
 class AirQualitySimplified(IoTDevice):
     """AirQualitySimplified: a class for an air quality simplified device that inherits from the IoTDevice class.
@@ -610,6 +758,16 @@ class AirQualitySimplified(IoTDevice):
             }
         }
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        modifier = batch_modifiers(devices)
+        sample = lambda var : sample_normal_mod_batch(batch_ground_truth(devices,var),modifier=modifier)
+        return unstack_batch({
+            'temperature_humidity_sensor' : {'temperature' : sample('temperature'), 'humidity' : sample('humidity')},
+            'air_quality_sensor' : {'pm25' : sample('pm25'), 'pm10' : sample('pm10')}
+        }, len(devices))
+
 # NOISE SENSOR
 class NoiseSensor(IoTDevice):
     """A class representing a noise sensor device that inherits from IoTDevice.
@@ -625,6 +783,11 @@ class NoiseSensor(IoTDevice):
     def gen_data(self) -> Dict :
         return {'noise_sensor' : {'noise' : sample_normal_mod(70,2,self.modifier)}}
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        return unstack_batch({'noise_sensor' : {'noise' : sample_normal_mod_batch(np.full(len(devices),70.0),2,batch_modifiers(devices))}}, len(devices))
+
 # SMOKE SENSOR
 class SmokeSensor(IoTDevice):
     """A class representing a smoke sensor device that inherits from IoTDevice.
@@ -675,6 +838,11 @@ class RainSensor(IoTDevice):
     def gen_data(self) -> Dict :
         return {'rain_sensor' : {'cumdepth' : sample_normal_mod(self.gt.get('rain_cumdepth'),modifier=self.modifier)}}
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        return unstack_batch({'rain_sensor' : {'cumdepth' : sample_normal_mod_batch(batch_ground_truth(devices,'rain_cumdepth'),modifier=batch_modifiers(devices))}}, len(devices))
+
 # WIND SENSOR
 class WindSensor(IoTDevice):
     """A class representing a wind sensor device that inherits from IoTDevice.
@@ -696,6 +864,17 @@ class WindSensor(IoTDevice):
             }
         }
 
+    # Batched data generation
+    @classmethod
+    def gen_data_batch(cls, devices) :
+        modifier = batch_modifiers(devices)
+        return unstack_batch({
+            'wind_sensor' : {
+                'speed' : sample_normal_mod_batch(batch_ground_truth(devices,'wind_speed'),modifier=modifier),
+                'direction' : sample_normal_mod_batch(batch_ground_truth(devices,'wind_direction'),modifier=modifier)
+            }
+        }, len(devices))
+
 # INDOORS ALARM
 class IndoorsAlarm(IoTDevice):
     """A class representing a indoors alarm device that inherits from IoTDevice.
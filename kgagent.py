@@ -12,8 +12,13 @@ which is subscribed to all the topics in the MQTT network. This allows the MQTT
 to all the data being reported by the IoT devices. When the MQTT client receives a message from 
 the broker, it processes the message and updates the Knowledge Graph accordingly.
 
-The Knowledge Graph Agent class also inherits the TypeDBClient class, which is responsible for managing
-interactions with the TypeDB database using a set of predefined query operations and functions.
+Receiving and processing are decoupled: the MQTT callback only decodes each message and queues it,
+while a pool of workers processes the queued messages. Messages are assigned to workers by device uuid,
+so the messages of each device are processed in order while different devices are processed concurrently.
+
+The Knowledge Graph Agent stores the knowledge graph in a backend implementing the KGBackend operations:
+TypeDBClient, which manages the interactions with the TypeDB database using a set of predefined queries,
+or InMemoryGraph, a fast in-memory graph following the same schema, used to run the agent locally.
 
 When a data message is received, it is processed by the consistency_handler function. 
 This function checks whether the device has already been integrated into the Knowledge Graph. 
@@ -47,11 +52,12 @@ from aux import *
 #######################################
 
 # Knowledge Graph Agent to handle MQTT subscriptions and interaction with TypeDB
-class KGAgent(TypeDBClient) :
+class KGAgent() :
     """
     A class for managing devices and their data in a knowledge graph.
 
     Attributes:
+        kg (KGBackend): The backend storing the knowledge graph (TypeDB by default).
         print_queries (bool): A flag for printing queries made to the database.
         dev_msg_stats (dict): A dictionary for storing message statistics for each device.
         total_msg_count (int): The total number of messages received.
@@ -60,44 +66,175 @@ class KGAgent(TypeDBClient) :
         buffer_th (int): The number of seconds to store data for each device.
         sdf_dicts (dict): A dictionary for storing SDF information.
         sdfs_df (pandas.DataFrame): A DataFrame for storing SDF information.
+        query_templates (QueryTemplateCache): The TypeQL query templates compiled from each class SDF.
+        state_trackers (dict): The state tracker (IDLE/PROCESSING/QUERYING) of each processing thread.
+        kg_lock (RLock): A lock serializing the changes shared among devices (SDFs, schema, integration).
+        ingest_pool (IngestPool): The queues and workers processing data messages.
+        batch_writer (BatchWriter): The writer coalescing attribute updates into shared transactions (None if disabled).
+        stats_sink (StatsSink): The background writer of state transitions and device snapshots.
+        metrics (MetricsRegistry): The message, query and error counters and the per-stage latency histograms.
+        metrics_port (int): The port the metrics are served on in Prometheus format (None to disable).
+        transport (str): The messages transport ('mqtt' or 'local', the one selected with set_transport if None).
+        buffers (BufferSnapshot): The samples buffered before the last restart (None if there is no snapshot).
+        pending_restore (set): The devices whose samples have not been restored from the snapshot yet.
+        connected (Event): Set once the agent is subscribed to all topics.
+        integration_pool (WorkerPool): The long-lived worker processes of the integration algorithm.
+        features (FeatureStore): The attributes of the devices compared by the integration algorithm (kept up to date with the devices memory).
     """
 
     # Initialization
-    def __init__(self, initialize=True, print_queries=False, buffer_th=60):
+    def __init__(self, initialize=True, print_queries=False, buffer_th=60, n_workers=4, max_queue=1000, batch_size=50, batch_ms=50, pool_sessions=True, stats_path='.', snapshot_interval=10.0, metrics_port=None, backend=None, transport=None, integration_workers=None):
         """
-        Initializes the KGAgent and its parent class, TypeDBClient.
+        Initializes the KGAgent and its knowledge graph backend.
 
         Args:
-            initialize (bool): A flag for initializing the database.
+            initialize (bool): A flag for initializing the database (TypeDB backend).
             print_queries (bool): A flag for printing queries made to the database.
             buffer_th (int): The number of seconds to store data for each device.
+            n_workers (int): The number of workers processing data messages concurrently.
+            max_queue (int): The maximum number of data messages waiting to be processed.
+            batch_size (int): The maximum number of attribute updates committed in a single transaction (1 disables batching).
+            batch_ms (int): The maximum time (in milliseconds) an attribute update waits to be committed.
+            pool_sessions (bool): A flag for keeping TypeDB sessions open between queries.
+            stats_path (str): The folder statistics files are written to (also the buffers snapshot and the SDF similarity cache).
+            snapshot_interval (float): The time (in seconds) between device snapshots.
+            metrics_port (int): The local port to serve the metrics on in Prometheus format (None to disable).
+            backend (KGBackend): The backend storing the knowledge graph (a TypeDBClient if None).
+            transport (str): The messages transport, 'mqtt' (broker) or 'local' (in-process bus). Default is the one selected with set_transport.
+            integration_workers (int): The number of worker processes of the integration algorithm (the number of cores if None, 0 to run it in process).
         """
-        # State tracking
-        self.state = 0 # 0 for IDLE, 1 for PROCESSING, 2 for QUERYING
-        self.states_ts = [time.perf_counter()] # times when state changes
-        self.states = [0] # values state changes to
-        self.state_times = [0,0,0]
-        # Parent class initialization
-        TypeDBClient.__init__(self,initialize)
+        # Counters and latency histograms
+        self.metrics = MetricsRegistry()
+        self.metrics_port = metrics_port
+        # Messages transport
+        self.transport = transport
+        self.connected = Event()
+        # State tracking (one tracker per processing thread)
+        self.trackers_local = local()
+        self.state_trackers = {}
+        self.kg_lock = RLock()
+        # State transitions are queued from now on, the sink is started once the devices memory exists
+        self.stats_sink = StatsSink(self.snapshot, path=stats_path, snapshot_interval=snapshot_interval)
+        # Knowledge graph backend
+        if backend is None : backend = TypeDBClient(initialize,pool_sessions=pool_sessions,metrics=self.metrics,on_state=self.change_state)
+        else : backend.metrics, backend.on_state = self.metrics, self.change_state
+        self.kg = backend
         # Debugging / logging
-        self.print_queries = print_queries
+        self.print_queries = self.kg.print_queries = print_queries
         # Attributes for stats
         self.dev_msg_stats = {}
         self.total_msg_count = 0
         self.msg_proc_time = 0
-        self.sdf_manager = SDFManager()
+        self.decoded_msg_count = 0
+        self.rejected_msg_count = 0
+        self.decode_time = 0
+        self.stats_lock = Lock()
+        self.sdf_manager = SDFManager(cache_path=os.path.join(stats_path, 'similarity.json'))
+        self.stats_sink.caches.append(self.sdf_manager.similarity)
         # Variables for devices management / integration
         self.buffer_th = buffer_th # values within buffer_th last minutes will be stored for each device
         self.sdf_dicts = {}
         self.sdfs_df = pd.DataFrame(columns=sdf_cols)
+        self.query_templates = QueryTemplateCache()
+        self.integration_pool = WorkerPool(integration_workers)
+        # Devices already in the knowledge graph (restored from it, so they are updated without redefining them)
+        self.devices = self.hydrate()
+        # Attributes compared by the integration algorithm (kept up to date with the devices memory)
+        self.features = FeatureStore(self.devices)
+        # Samples buffered before the last restart (restored lazily, when each device is needed)
+        self.buffers, self.pending_restore = None, set()
+        buffers_path = os.path.join(stats_path, 'buffers.snap')
+        if os.path.exists(buffers_path) :
+            self.buffers = BufferSnapshot(buffers_path)
+            self.pending_restore = {uuid for uuid in self.devices if uuid in self.buffers}
+            print(f'BUFFER SNAPSHOT OPENED <Devices={len(self.pending_restore)}/{len(self.buffers)}>', kind='success')
+        # Ingest queues and workers (messages of the same device are always processed in order)
+        self.ingest_pool = IngestPool(self.process_msg, n_workers=n_workers, max_queue=max_queue)
+        # Attribute updates coalesced into shared write transactions
+        self.batch_writer = BatchWriter(self.kg, max_batch=batch_size, max_delay=batch_ms/1000) if batch_size > 1 else None
+        # Statistics and snapshots written in the background
+        self.stats_sink.start()
     
+    # State tracker of the calling thread
+    def get_state_tracker(self) -> StateTracker :
+        tracker = getattr(self.trackers_local, 'tracker', None)
+        if tracker is None :
+            tracker = StateTracker(current_thread().name, self.stats_sink)
+            self.trackers_local.tracker = tracker
+            self.state_trackers[current_thread().name] = tracker
+        return tracker
+
     # Track state over time as it changes
     def change_state(self, new_state) :
+        self.get_state_tracker().change(new_state)
+
+    # Total time spent in each state by all threads
+    def get_state_times(self) -> List[float] :
+        return [sum(tracker.state_times[i] for tracker in list(self.state_trackers.values())) for i in range(3)]
+
+    # Snapshot of the devices memory and state times (called by the stats sink)
+    def snapshot(self) -> Tuple[Dict[str, Dict[str, Any]], List[float]] :
+        with self.kg_lock :
+            # Samples not restored yet would be lost when the snapshot is replaced
+            if self.pending_restore : self.restore_buffers(list(self.pending_restore))
+            devices = copy_devices(self.devices)
+        return devices, self.get_state_times()
+
+    # Restore devices memory from the knowledge graph
+    def hydrate(self) -> Dict[str, Dict[str, Any]] :
+        """
+        Restore the memory of the devices already in the knowledge graph (class, modules and latest attribute values),
+        fetched with a single streamed query, and report the time and memory it takes.
+
+        Returns
+        -------
+        dict: The device dictionaries (see init_device) by uuid.
+        """
+        classes = {dev_class.lower(): dev_class for dev_class in self.sdf_manager.get_class_names()}
+        tracing = tracemalloc.is_tracing()
+        if not tracing : tracemalloc.start()
+        tracemalloc.reset_peak()
         tic = time.perf_counter()
-        self.state_times[self.state] = self.state_times[self.state] + (tic-self.states_ts[-1])
-        self.state = new_state
-        self.states_ts.append(tic)
-        self.states.append(new_state)
+        devices = {uuid: hydrate_device(classes.get(record['type'], ''), record) for uuid, record in self.kg.hydrate_devices().items()}
+        toc = time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1]
+        if not tracing : tracemalloc.stop()
+        self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='hydrate')
+        print(f'{len(devices)} DEVICES HYDRATED in {(toc-tic)*1000:.0f}ms ({peak/2**20:.2f}MB peak).', kind='success')
+        return devices
+
+    # Restore buffered samples from the snapshot
+    def restore_buffers(self, uuids: List[str], ts: float = None) -> None :
+        """
+        Restore the samples buffered before the last restart for some of the devices, dropping the samples older 
+        than buffer_th. The restored buffers replace the hydrated ones if the device modules have not changed, 
+        and the latest sample in the knowledge graph is kept if it is newer.
+
+        Parameters
+        ----------
+        uuids (list): The UUIDs of the devices.
+        ts (float): The current time (epoch seconds) samples are dropped relative to (the newest sample in the snapshot if None).
+
+        Returns
+        -------
+        None
+        """
+        with self.kg_lock :
+            if ts is None : ts = self.buffers.newest()
+            for uuid in uuids :
+                if uuid not in self.pending_restore : continue
+                self.pending_restore.discard(uuid)
+                dev, restored = self.devices[uuid], self.buffers.load(uuid, ts - self.buffer_th)
+                # Buffers are only replaced if the device modules and attributes have not changed
+                if {mod_name: set(attribs_dic) for mod_name, attribs_dic in dev['modules'].items()} != \
+                   {mod_name: set(attribs_dic) for mod_name, attribs_dic in restored['modules'].items()} : continue
+                with dev['lock'] :
+                    # The latest sample in the knowledge graph is kept if it is newer
+                    if len(dev['timestamps']) > 0 and (len(restored['timestamps']) == 0 or dev['timestamps'][-1] > restored['timestamps'][-1]) :
+                        append_samples(restored, dev['timestamps'][-1], {mod_name: {attrib_name: values[-1] for attrib_name, values in attribs_dic.items()} 
+                                                                         for mod_name, attribs_dic in dev['modules'].items()})
+                    dev['timestamps'], dev['modules'], dev['period'] = restored['timestamps'], restored['modules'], restored['period']
+                self.features.update(uuid, dev)
 
     # MQTT Callback Functions
     def on_log(client, userdata, level, buf):
@@ -107,17 +244,31 @@ class KGAgent(TypeDBClient) :
     def on_connect(self, client, userdata, flags, rc):
         """Subscribes to all topics and prints a success message on connection."""
         self.client.subscribe('#', qos=0)
+        self.connected.set()
         print("\nKnowledge Graph connected - Waiting for messages...\n", kind='success')
 
     def on_disconnect(self, client, userdata, rc):
         """Prints a failure message on disconnection."""
+        self.connected.clear()
         print("\nKnowledge Graph disconnected.\n", kind='fail')
 
     def on_message(self, client, userdata, msg):
-        """Handles messages received from the MQTT broker."""
+        """Decodes messages received from the MQTT broker and queues data messages for processing."""
         # Decode message
-        msg = loads(str(msg.payload.decode("utf-8")))
+        tic = time.perf_counter()
+        try :
+            msg = decode_msg(msg.payload)
+        except ValueError as e :
+            self.rejected_msg_count += 1
+            self.metrics.inc('kgagent_messages_rejected_total', stage='decode')
+            print(f'({msg.topic}) -> msg rejected <{e}>', kind='fail')
+            return
+        toc = time.perf_counter()
+        self.decode_time += toc - tic
+        self.decoded_msg_count += 1
         topic, dev_class, uuid = msg['topic'], msg['class'], msg['uuid']
+        self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='decode', dev_class=dev_class)
+        self.metrics.inc('kgagent_messages_total', category=msg['category'])
 
         # Treat message depending on its category
         match msg['category'] :
@@ -128,48 +279,75 @@ class KGAgent(TypeDBClient) :
                 print(f'({topic}) - {dev_class}[{uuid[0:6]}] disconnected from broker.', kind='fail')
 
             case 'DATA' :
-                if uuid not in self.dev_msg_stats: self.dev_msg_stats[uuid] = [0,0]
-                print(f'({topic}) -> {dev_class}[{uuid[0:6]}] msg received <N={self.dev_msg_stats[uuid][0]+1}>', kind='info')
-                # Integrate message and time elapsed time
-                tic = time.perf_counter()
-                self.change_state(1) # PROCESSING
-                self.consistency_handler(msg)
-                self.change_state(0) # IDLE
-                toc = time.perf_counter()
-                # Data messages statistics
-                self.total_msg_count += 1
-                self.dev_msg_stats[uuid][0] += 1
-                self.msg_proc_time += toc-tic
-                self.dev_msg_stats[uuid][1] += toc-tic
-                print(arrow_str + f'msg processed <Tp={(toc-tic)*1000:.0f}ms | Avg.Tp={(self.dev_msg_stats[uuid][1]/self.dev_msg_stats[uuid][0])*1000:.0f}ms>\n', kind='info')
-                # Data messages summary
-                if self.total_msg_count % 100 == 0 :
-                    # Print messages processing summary
-                    print('-----------------------------------------------------', kind='summary')
-                    print(f'MSGs SUMMARY <N={self.total_msg_count} | Avg. Tp={(self.msg_proc_time/self.total_msg_count)*1000:.0f}ms>', kind='summary')
-                    print('-----------------------------------------------------\n', kind='summary')
-                    # Save devices data to file for analysis
-                    with open('devices.json', 'w') as f:
-                        dump(self.devices,f,cls=ModifiedEncoder)
-                    # Save state data for visualization
-                    with open('states.csv', 'w') as f:
-                        writer = csv.writer(f)
-                        writer.writerows(zip(['ts']+self.states_ts, ['states']+self.states))
-                    # Save state times
-                    with open('state_times.csv', 'w') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['state_times']+self.state_times)
+                # Queue message to be processed by the worker its device is assigned to
+                if not self.ingest_pool.put(uuid, msg) :
+                    self.metrics.inc('kgagent_messages_dropped_total')
+                    print(f'({topic}) -> {dev_class}[{uuid[0:6]}] msg dropped <queue full>', kind='fail')
+
+    def process_msg(self, msg: dict) -> None:
+        """Processes a data message in one of the ingest workers."""
+        topic, dev_class, uuid = msg['topic'], msg['class'], msg['uuid']
+        with self.stats_lock :
+            if uuid not in self.dev_msg_stats: self.dev_msg_stats[uuid] = [0,0]
+        print(f'({topic}) -> {dev_class}[{uuid[0:6]}] msg received <N={self.dev_msg_stats[uuid][0]+1}>', kind='info', key=uuid)
+        # Integrate message and time elapsed time
+        tic = time.perf_counter()
+        self.change_state(1) # PROCESSING
+        try :
+            self.consistency_handler(msg)
+        except ValueError as e :
+            with self.stats_lock : self.rejected_msg_count += 1
+            self.metrics.inc('kgagent_messages_rejected_total', stage='validate')
+            print(arrow_str + f'msg rejected <{e}>\n', kind='fail')
+            return
+        except Exception :
+            self.metrics.inc('kgagent_errors_total', stage='process')
+            raise
+        finally :
+            self.change_state(0) # IDLE
+        toc = time.perf_counter()
+        self.metrics.observe('kgagent_process_seconds', toc-tic, dev_class=dev_class)
+        # Data messages statistics
+        with self.stats_lock :
+            self.total_msg_count += 1
+            self.dev_msg_stats[uuid][0] += 1
+            self.msg_proc_time += toc-tic
+            self.dev_msg_stats[uuid][1] += toc-tic
+            total_msg_count = self.total_msg_count
+        print(arrow_str + f'msg processed <Tp={(toc-tic)*1000:.0f}ms | Avg.Tp={(self.dev_msg_stats[uuid][1]/self.dev_msg_stats[uuid][0])*1000:.0f}ms>\n', kind='info', key=uuid)
+        # Data messages summary
+        if total_msg_count % 100 == 0 :
+            ingest_stats = self.ingest_pool.get_stats()
+            utilisation = ' '.join(f'{u*100:.0f}%' for u in ingest_stats['utilisation'])
+            # Print messages processing summary
+            print('-----------------------------------------------------', kind='summary')
+            print(f'MSGs SUMMARY <N={total_msg_count} | Avg. Tp={(self.msg_proc_time/total_msg_count)*1000:.0f}ms | Avg. Td={(self.decode_time/max(self.decoded_msg_count,1))*1e6:.0f}us | Rejected={self.rejected_msg_count}>', kind='summary')
+            print(f'INGEST <Depth={ingest_stats["depth"]} | Dropped={ingest_stats["dropped"]} | Errors={ingest_stats["errors"]} | Util={utilisation}>', kind='summary')
+            if self.batch_writer is not None :
+                batch_stats = self.batch_writer.get_stats()
+                print(f'BATCHES <N={batch_stats["batches"]} | Avg. Size={batch_stats["avg_batch_size"]:.1f} | Max. Size={batch_stats["max_batch_size"]} | Avg. Tc={batch_stats["avg_commit_time"]*1000:.0f}ms | Max. Tc={batch_stats["max_commit_time"]*1000:.0f}ms | Fallbacks={batch_stats["fallbacks"]}>', kind='summary')
+            query_stats = self.kg.get_query_stats()
+            print('QUERIES <' + ' | '.join(f'{kind}: N={st["n"]} Avg.Tq={st["avg"]*1000:.0f}ms' for kind, st in query_stats.items()) + '>', kind='summary')
+            stages = sorted({dict(labels)['stage'] for name, labels in list(self.metrics.histograms) if name == 'kgagent_stage_seconds'})
+            print('STAGES <' + ' | '.join(f'{stage}: p50={self.metrics.quantile("kgagent_stage_seconds", 0.5, stage=stage)*1000:.1f}ms p99={self.metrics.quantile("kgagent_stage_seconds", 0.99, stage=stage)*1000:.1f}ms' for stage in stages) + '>', kind='summary')
+            print('-----------------------------------------------------\n', kind='summary')
+            # Save devices data and state times for analysis (written in the background)
+            self.stats_sink.request_snapshot()
 
     # Start MQTT client
     def start(self):
-        """Starts the MQTT client and binds the callback functions."""
-        self.client = mqtt_client.Client('KG') # create new client
+        """Starts the MQTT client (or the in-process bus client) and binds the callback functions."""
+        self.client = new_client('KG', self.transport) # create new client
 
         self.client.on_log = self.on_log
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
 
+        if self.metrics_port is not None : MetricsServer(self.metrics, port=self.metrics_port).start() # serve metrics
+        if self.batch_writer is not None : self.batch_writer.start() # start committing batched updates
+        self.ingest_pool.start() # start workers before receiving messages
+        self.integration_pool.warm() # start integration processes in the background
         self.client.connect(broker_addr, port=broker_port) # connect to the broker
         self.client.loop_forever() # run client loop for callbacks to be processed
 
@@ -191,66 +369,20 @@ class KGAgent(TypeDBClient) :
         -------
         None
         """
-        # Build datetime timestamp
-        dt_timestamp = datetime.strptime(timestamp,"%Y-%m-%dT%H:%M:%S.%f")
-        self.devices[uuid]['timestamps'].append(dt_timestamp)
-        # Get device sdf dict
+        # Get device sdf dict and its precompiled templates
         sdf_dict = self.sdf_dicts[dev_class]
-        # Build define query
-        defineq = ''
-        defineq_attribs = ''
-        # Build match-insert query
-        matchq = f'match\n$dev isa {dev_class.lower()}, has uuid "{uuid}";\n\n'
-        insertq = f'insert\n$dev has timestamp {timestamp[:-4]};\n\n'
-
-        # Iterate over modules and its attributes
-        for i, (mod_name, mod_sdf_dict) in enumerate(sdf_dict['sdfObject'].items()) :
-            # Add module to device dict
-            self.devices[uuid]['modules'][mod_name] = {}
-            
-            # Check if module has already been defined in KG schema
-            if mod_name not in self.defined_modules : 
-                defineq += f'{mod_name} sub module; '
-                self.defined_modules.append(mod_name)
-            
-            # Insert module
-            insertq += f'$mod{i+1} isa {mod_name}, has uuid "{uuid}"'
-            for j, (attrib_name, attrib_sdf_dict) in enumerate(mod_sdf_dict['sdfProperty'].items()) :
-                # Define modules and assign default values
-                tdbtype = types_trans[attrib_sdf_dict['type']]
-
-                # In case the attribute was not yet defined, define it
-                if attrib_name not in self.defined_attribs : 
-                    defineq_attribs += f'{attrib_name} sub attribute, value {tdbtype}; \n'
-                    self.defined_attribs.append(attrib_name)
+        template = self.query_templates.get_define_template(dev_class, sdf_dict)
 
-                # Make the module own the attribute
-                defineq += f'{", " if j>0 else f"{mod_name} "}owns {attrib_name}'
+        # Add modules to device dict and create buffer arrays (previous samples are discarded)
+        dev = self.devices[uuid]
+        with dev['lock'] :
+            dev['timestamps'], dev['modules'] = RingBuffer(), {}
+            for mod_name, attribs in template['mod_attribs'].items() :
+                for attrib_name, tdbtype in attribs : add_attrib_buffer(dev, mod_name, attrib_name, tdbtype)
 
-                # Insert attributes in module
-                insertq += f', has {attrib_name} {defvalues[tdbtype]}'
-
-                # Create buffer arrays
-                self.devices[uuid]['modules'][mod_name][attrib_name] = []
-
-            # Finish queries construction
-            defineq += ';\n'
-            insertq += ';\n'
-        
-        # Link all modules to the device
-        insertq += '$includes (device: $dev'
-        for j in range(i+1): insertq += f', module: $mod{j+1}'
-        insertq += ') isa includes; \n'
-
-        # Define in KG schema
+        # Define in KG schema and initialize in KG
         tic = time.perf_counter()
-        if (defineq != '') or (defineq_attribs != '') :
-            if self.print_queries: print('define\n' + defineq_attribs + defineq, kind='debug')
-            self.define_query('define\n' + defineq_attribs + defineq)
-        
-        # Initialize in KG schema
-        if self.print_queries: print(matchq + insertq, kind='debug')
-        self.insert_query(matchq + insertq)
+        self.kg.define_modules_attribs(dev_class, uuid, timestamp, template)
         toc = time.perf_counter()
 
         # Notify of definition in console log
@@ -258,7 +390,7 @@ class KGAgent(TypeDBClient) :
         print_device_tree(sdf_dict)
 
     # Update module attributes
-    def update_attribs(self,dev_class: str, uuid: str, timestamp: str, data: dict) -> None :
+    def update_attribs(self,dev_class: str, uuid: str, timestamp: str, data: dict, dt_timestamp: datetime = None, dev: dict = None) -> None :
         """
         Update the attributes of the modules of a device in the knowledge graph.
 
@@ -270,65 +402,42 @@ class KGAgent(TypeDBClient) :
         data (dict): A dictionary containing the updates for the modules and their attributes. The structure should
                      be {'module_name': {'attribute_name': attribute_value, ...}, ...}. The attribute value should
                      have the correct type according to the attribute's definition in the SDF.
+        dt_timestamp (datetime): The already parsed timestamp (parsed from timestamp if not given).
+        dev (dict): The device memory, as resolved by the caller while holding kg_lock (looked up if not given).
 
         Returns
         -------
         None
         """
+        if dev is None :
+            with self.kg_lock : dev = self.devices[uuid]
         # Build datetime timestamp
-        dt_timestamp = datetime.strptime(timestamp,"%Y-%m-%dT%H:%M:%S.%f")
-        # Get device sdf dict
-        sdf_dict = self.sdf_dicts[dev_class]
-        # Match - Delete - Insert Query
-        matchq = f'match\n$dev isa {dev_class.lower()}, has uuid "{uuid}", has timestamp $tmstmp;\n\n'
-        deleteq = 'delete\n$dev has $tmstmp;\n\n'
-        insertq = f'insert\n$dev has timestamp {timestamp[:-4]};\n\n'
-
-        # Iterate over modules
-        for i, (mod_name, mod_dict) in enumerate(data.items()) :
-            mod_sdf_dict = sdf_dict['sdfObject'][mod_name]
-            
-            # Match module
-            matchq += f'$mod{i+1} isa {mod_name}, has uuid "{uuid}"'
-            deleteq += f'$mod{i+1} '
-            insertq += f'$mod{i+1} '
-            for j, (attrib_name, attrib_value) in enumerate(mod_dict.items()) :
-                attrib_sdf_dict = mod_sdf_dict['sdfProperty'][attrib_name]
-                
-                # Value wrapping according to type
-                tdbtype = types_trans[attrib_sdf_dict['type']]
-                match tdbtype :
-                    case 'double' : value = f'{attrib_value:.2f}'
-                    case 'string' : value = f'"{attrib_value}"'
-                    case 'boolean': value = str(attrib_value).lower()
-
-                # Query construction
-                matchq += f', has {attrib_name} $attrib{i+1}{j+1}'
-                deleteq += f'{", " if j!=0 else ""}has $attrib{i+1}{j+1}'
-                insertq += f'{", " if j!=0 else ""}has {attrib_name} {value}'
-
-                # Add the value to the buffer
-                self.devices[uuid]['modules'][mod_name][attrib_name].append(attrib_value)
-                
-            # Insert line break
-            deleteq += ';\n'
-            insertq += ';\n'
-            matchq += ';\n'
-        
-        # Remove too old samples from buffer
-        if self.devices[uuid]['timestamps'][0] < dt_timestamp - timedelta(seconds=self.buffer_th) :
-            self.devices[uuid]['timestamps'].pop(0)
-            for mod_name, attribs_dic in self.devices[uuid]['modules'].items() :
-                for attrib_name, attrib_buffer in attribs_dic.items() :
-                    attrib_buffer.pop(0)
+        if dt_timestamp is None : dt_timestamp = datetime.fromisoformat(timestamp)
+        # Prepare the update (e.g. fill the precompiled match-delete-insert query in)
+        template = self.query_templates.get_update_template(dev_class, self.sdf_dicts[dev_class], data)
+        update = self.kg.prepare_update(dev_class, uuid, timestamp, data, template)
+
+        # Add the values to the buffers, removing samples older than buffer_th
+        ts = to_epoch(dt_timestamp)
+        with dev['lock'] :
+            if len(dev['timestamps']) > 0 : dev['period'] = ts - dev['timestamps'][-1]
+            evict_samples(dev, ts - self.buffer_th)
+            append_samples(dev, ts, data)
+        # Not registered again if the device has been disintegrated meanwhile
+        with self.kg_lock :
+            if self.devices.get(uuid) is dev : self.features.update(uuid, dev)
         
         # Update attributes in the knowledge graph
-        if self.print_queries: print(matchq + '\n' + deleteq + '\n' + insertq, kind='debug')
-        tic = time.perf_counter()
-        self.update_query(matchq + '\n' + deleteq + '\n' + insertq)
-        toc = time.perf_counter()
-        # Notify of update in console log
-        print(arrow_str + f'attributes updated <Tq={(toc-tic)*1000:.0f}ms>', kind='success')
+        if self.batch_writer is not None :
+            # Committed later together with other updates
+            self.batch_writer.submit(update)
+            print(arrow_str + f'attributes update queued <Batch={len(self.batch_writer.pending)}>', kind='success', key=uuid)
+        else :
+            tic = time.perf_counter()
+            self.kg.apply_updates([update])
+            toc = time.perf_counter()
+            # Notify of update in console log
+            print(arrow_str + f'attributes updated <Tq={(toc-tic)*1000:.0f}ms>', kind='success', key=uuid)
 
     # Consistency handling
     def consistency_handler(self, msg: dict) -> None:
@@ -338,51 +447,72 @@ class KGAgent(TypeDBClient) :
 
         Parameters
         ----------
-        msg (dict): Dictionary containing message data.
-                    Expected format: {'class': string, 'uuid': string, 'timestamp': string, 'data': dict}
+        msg (dict): Dictionary containing message data, as decoded by decode_msg.
+                    Expected format: {'class': string, 'uuid': string, 'timestamp': string, 'data': dict, 'dt_timestamp': datetime}
+                    (data may also be a list of value lists if the device sent it with ordinals).
         Returns
         -------
         None
+
+        Raises
+        ------
+        ValueError: If the message data does not match the SDF description of its class.
         """
         # Decode message components
         dev_class, uuid, timestamp, data = msg['class'], msg['uuid'], msg['timestamp'], msg['data']
-        dt_timestamp = datetime.strptime(timestamp,"%Y-%m-%dT%H:%M:%S.%f")
-
-        # Retrieve and build SDF dict
-        if dev_class not in self.sdf_dicts :
-            dev_sdf, dev_sdf_df = self.sdf_manager.build_sdf(dev_class)
-            self.sdf_dicts[dev_class] = dev_sdf['sdfThing'][dev_class]
-            self.sdfs_df = pd.concat([self.sdfs_df,dev_sdf_df]).reset_index(drop=True)
-
-        # If it is the first time the device has been seen 
-        if uuid not in self.devices :
-            # Add device as not integrated
-            self.devices[uuid] = {'class':dev_class, 'integrated':False, 'period':0, 'timestamps':[], 'modules':{}}
-            # Define and add device to KG
-            self.define_device(dev_class,uuid)
-            self.change_state(1) # PROCESSING
-
-        # Check if all device modules have already been defined
-        if set(self.devices[uuid]['modules']) != set(data.keys()) :
-            # Add modules and attributes to the knowledge graph
-            self.define_modules_attribs(dev_class,uuid,timestamp,data)
-            self.change_state(1) # PROCESSING
-        
-        # If the device is defined but yet to be integrated
-        if not self.devices[uuid]['integrated'] :
-            # Wait till we have at least 20 buffered samples
-            if len(self.devices[uuid]['timestamps']) > 20 : 
-                self.integrate(dev_class,uuid,dt_timestamp)
+        dt_timestamp = msg['dt_timestamp'] if 'dt_timestamp' in msg else datetime.fromisoformat(timestamp)
+
+        # Restore the samples the device had buffered before the last restart
+        if uuid in self.pending_restore : self.restore_buffers([uuid], to_epoch(dt_timestamp))
+
+        # Changes shared among devices are serialized across workers
+        with self.kg_lock :
+            # Retrieve and build SDF dict
+            if dev_class not in self.sdf_dicts :
+                with self.metrics.timer('kgagent_stage_seconds', stage='sdf_build', dev_class=dev_class) :
+                    dev_sdf, dev_sdf_df = self.sdf_manager.build_sdf(dev_class)
+                    self.sdf_dicts[dev_class] = dev_sdf['sdfThing'][dev_class]
+                    self.query_templates.invalidate(dev_class)
+                    self.sdfs_df = pd.concat([self.sdfs_df,dev_sdf_df]).reset_index(drop=True)
+
+            # Expand data sent with ordinals and reject messages not matching the SDF description before they reach the KG
+            define_template = self.query_templates.get_define_template(dev_class, self.sdf_dicts[dev_class])
+            if isinstance(data, list) : msg['data'] = data = expand_ordinals(data, define_template['ordinals'])
+            validate_data(data, define_template['types'])
+
+            # If it is the first time the device has been seen 
+            if uuid not in self.devices :
+                # Add device as not integrated
+                self.devices[uuid] = init_device(dev_class, False)
+                # Define and add device to KG (with the schema its class still needs, in a single definition)
+                with self.metrics.timer('kgagent_stage_seconds', stage='define_device', dev_class=dev_class) :
+                    self.kg.declare_class(dev_class, define_template)
+                    self.kg.define_device(dev_class,uuid)
+                self.change_state(1) # PROCESSING
+
+            # Check if all device modules have already been defined
+            if set(self.devices[uuid]['modules']) != set(data.keys()) :
+                # Add modules and attributes to the knowledge graph
+                with self.metrics.timer('kgagent_stage_seconds', stage='define_modules_attribs', dev_class=dev_class) :
+                    self.define_modules_attribs(dev_class,uuid,timestamp,data)
                 self.change_state(1) # PROCESSING
+            
+            # If the device is defined but yet to be integrated
+            if not self.devices[uuid]['integrated'] :
+                # Wait till we have at least 20 buffered samples
+                if len(self.devices[uuid]['timestamps']) > 20 : 
+                    with self.metrics.timer('kgagent_stage_seconds', stage='integrate', dev_class=dev_class) :
+                        self.integrate(dev_class,uuid,dt_timestamp)
+                    self.change_state(1) # PROCESSING
+
+            # Update other device data (before the feature store is updated with it)
+            dev = self.devices[uuid]
+            dev['class'] = dev_class
 
         # Update device attributes
-        self.update_attribs(dev_class,uuid,timestamp,data)
+        with self.metrics.timer('kgagent_stage_seconds', stage='update', dev_class=dev_class) :
+            self.update_attribs(dev_class,uuid,timestamp,data,dt_timestamp,dev)
         self.change_state(1) # PROCESSING
-
-        # Update other device data
-        self.devices[uuid]['class'] = dev_class
-        self.devices[uuid]['period'] = (dt_timestamp - self.devices[uuid]['timestamps'][-1]).total_seconds()
-        self.devices[uuid]['timestamps'].append(dt_timestamp)
         
 
     ### INTEGRATION ALGORITHM ###
@@ -402,32 +532,34 @@ class KGAgent(TypeDBClient) :
         -------
         None
         """
-        # Create devices DataFrame
-        devs_df = build_devs_df(self.devices)
+        # Compare with the samples of all devices buffered before the last restart
+        if self.pending_restore : self.restore_buffers(list(self.pending_restore), to_epoch(dt_timestamp))
 
-        # Non-integrated class and dev DataFrames
+        # Non-integrated class DataFrame (integrated classes are looked up in the SDF index, devices in the feature store)
         noninteg_class = self.sdfs_df[self.sdfs_df.thing == dev_class]
-        noninteg_dev = devs_df[devs_df.uuid == uuid]
-
-        # Integrated classes and devs DataFrames
-        integ_classes = self.sdfs_df[self.sdfs_df.thing != dev_class]
-        integ_devs = devs_df[(devs_df.integ == True) & (devs_df.uuid != uuid)]
 
         # Compute Top 5 closest SDF classes
         tic = time.perf_counter()
-        votes = (Parallel(n_jobs=12)(delayed(get_closest_classes)(noninteg_class,integ_classes,i) for i in range(noninteg_class.shape[0])))
+        votes = self.sdf_manager.index.votes(dev_class, noninteg_class)
         voting_result_df = calc_voting_result_df(votes)
         closest_classes = voting_result_df.candidate.iloc[0:5].tolist()
         toc = time.perf_counter()
+        self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='integrate_class_vote', dev_class=dev_class)
         print(arrow_str + f'closest classes computed in {(toc-tic)*1000:.0f}ms', kind='success')
         print(voting_result_df.to_string(index=False))
         
         # Out of those 5 closest classes, get device that best matches time series pattern
         tic = time.perf_counter()
-        votes = (Parallel(n_jobs=12)(delayed(get_closest_devs)(noninteg_dev,integ_devs,closest_classes,i) for i in range(noninteg_dev.shape[0])))
-        voting_result_df = calc_voting_result_df(votes)
+        arrays, labels = closest_devs_arrays(self.features, uuid, closest_classes + [dev_class])
+        votes = self.integration_pool.map(closest_devs_rows, arrays, arrays['queries'].shape[0], labels)
+        voting_result_df = calc_voting_result_df([vote for vote in votes if vote])
+        if voting_result_df.empty :
+            # Retried with the next message, once the candidates have buffered enough samples
+            print(arrow_str + 'no integrated device with enough samples to compare with', kind='fail')
+            return
         integ_class, integ_uuid = voting_result_df.iloc[0].candidate.split('/')
         toc = time.perf_counter()
+        self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='integrate_device_vote', dev_class=dev_class)
         print(arrow_str + f'closest devices computed in {(toc-tic)*1000:.0f}ms', kind='success')
         print(voting_result_df.to_string(index=False))
 
@@ -435,18 +567,22 @@ class KGAgent(TypeDBClient) :
         # device or a complementary device to speed up a task. Therefore, we have to integrate the device
         # within the task its most similar device belongs to in the KG.
         tic = time.perf_counter()
-        self.replicate_relations(integ_uuid,uuid)
+        self.kg.replicate_relations(integ_uuid,uuid)
         self.devices[uuid]['integrated'] = True
+        self.features.update(uuid, self.devices[uuid])
         toc = time.perf_counter()
+        self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='integrate_replicate', dev_class=dev_class)
         print(arrow_str + f'device integrated (relations replicated in KG) <Tq={(toc-tic)*1000:.0f}ms>', kind='success')
 
         # In case the closest integrated device has not reported data lately, we understand it 
         # as a replacement and thus we eliminate the device from the KG
-        if self.devices[integ_uuid]['timestamps'][-1] < (dt_timestamp - timedelta(seconds=2*self.devices[integ_uuid]['period'])) :
+        if self.devices[integ_uuid]['timestamps'][-1] < to_epoch(dt_timestamp) - 2*self.devices[integ_uuid]['period'] :
             tic = time.perf_counter()
-            self.disintegrate_device(integ_uuid) # remove device from KG
+            self.kg.disintegrate_device(integ_uuid) # remove device from KG
             del self.devices[integ_uuid] # delete device from memory
+            self.features.remove(integ_uuid)
             toc = time.perf_counter()
+            self.metrics.observe('kgagent_stage_seconds', toc-tic, stage='integrate_disintegrate', dev_class=integ_class)
             print(arrow_str + f'old device and its modules disintegrated from KG <Tq={(toc-tic)*1000:.0f}ms>', kind='success')
 
         # FUTURE WORK: In case similarity is low, a more complex analysis will need to be performed to
@@ -458,8 +594,11 @@ class KGAgent(TypeDBClient) :
 ######## MAIN ########
 ######################
 def main() :
+    # Asynchronous colored logging (set colored=False / rate_limit to reduce console load in production)
+    configure_logging(level=logging.DEBUG, colored=True, rate_limit=None)
+
     # Create Knowledge Graph Agent instance
-    kg_agent = KGAgent(initialize=True, print_queries=False, buffer_th=180)
+    kg_agent = KGAgent(initialize=True, print_queries=False, buffer_th=180, n_workers=4, max_queue=1000, batch_size=50, batch_ms=50, metrics_port=metrics_port)
 
     # Start KG operation
     kg_agent.start()
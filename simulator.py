@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#----------------------------------------------------------------------------
+# Created By  : Alejandro Jarabo
+# Created Date: 2022-09-19
+# Contact : ale.jarabo.penas@ericsson.com
+# version ='1.0'
+# ---------------------------------------------------------------------------
+""" Scalable Device Simulator
+In the test environment each IoT device is a thread with its own MQTT client, which limits it
+to a few hundred devices. This module simulates large fleets instead: a single scheduler keeps
+the next publishing time of every device in a heap, generates their messages with the gen_data
+functions of the device classes and publishes them over a small pool of MQTT connections
+(the messages of each device always go through the same connection, so they stay in order).
+The devices due at the same time are generated together, one gen_data_batch call per class, so
+classes with vectorized data generation produce a whole tick of their devices with a few NumPy calls.
+
+The fleet is built by cloning the test environment devices (same classes and data generation
+parameters, new uuids), and the simulator reports the achieved versus requested publishing rate
+and how late messages are published compared to their schedule (jitter).
+
+With --virtual the simulation follows a virtual clock instead of the wall clock: waveforms, ground
+truths and message timestamps read the virtual time, which jumps to the next due message, so hours
+of plant activity are published in seconds (or at --speed times real time). Together with --seed,
+the generated data is reproducible. --scenario runs the test environment test cases instead of a fleet.
+
+Usage:
+    python simulator.py --devices 10000 --connections 8 --duration 600
+    python simulator.py --scenario --virtual --speed max --duration 3600 --seed 0
+"""
+# ---------------------------------------------------------------------------
+# Imports
+import argparse
+import copy
+import heapq
+from testenv import *
+# ---------------------------------------------------------------------------
+
+################################
+######## MQTT CONNECTIONS ######
+################################
+
+# Pool of MQTT connections shared by the simulated devices
+class ConnectionPool() :
+    """
+    A class that multiplexes the messages of many devices over a few MQTT connections (or in-process bus clients).
+
+    Attributes:
+        n_connections (int): The number of MQTT connections.
+        clients (list): The transport clients (see new_client), each with its own network loop thread.
+        sent (int): The number of messages published.
+
+    Methods:
+        connect() -> None: Connects the clients to the broker and starts their network loops.
+        publish(key: str, topic: str, payload: bytes) -> None: Publishes a message on the connection its key hashes to.
+        disconnect() -> None: Stops the network loops and disconnects the clients.
+    """
+    # Initialization
+    def __init__(self, n_connections=4, client_prefix='simulator'):
+        self.n_connections = max(1,n_connections)
+        self.clients = [new_client(f'{client_prefix}-{i}') for i in range(self.n_connections)]
+        self.sent = 0
+
+    # Connect clients
+    def connect(self) -> None :
+        for client in self.clients :
+            client.max_queued_messages_set(0) # unlimited outgoing queue
+            client.connect(broker_addr, port=broker_port)
+            client.loop_start()
+
+    # Publish message
+    def publish(self, key: str, topic: str, payload: bytes) -> None :
+        self.clients[zlib.crc32(key.encode()) % self.n_connections].publish(topic, payload)
+        self.sent += 1
+
+    # Disconnect clients
+    def disconnect(self) -> None :
+        for client in self.clients :
+            client.loop_stop()
+            client.disconnect()
+
+##########################
+######## SIMULATOR #######
+##########################
+
+# Single-scheduler simulator of many devices
+class Simulator(Thread) :
+    """
+    A thread that drives many IoTDevice-compatible devices from a single timer heap. Each device is
+    scheduled at a fixed rate (every device.interval seconds from its first message), so a late
+    message does not delay the following ones.
+
+    Attributes:
+        pool (ConnectionPool): The connections messages are published through.
+        heap (list): The (due time, order, device) entries of the scheduled devices.
+        lock (Condition): The condition protecting the heap and waking the scheduler up.
+        published (int): The number of messages published.
+        jitter (LatencyHistogram): How late (in wall seconds) messages were published compared to their schedule.
+        start_ts (float): The wall time when the simulation started.
+        clock (Clock): The simulation clock (a VirtualClock is advanced by the scheduler itself).
+        speed (float): The virtual seconds simulated per wall second with a virtual clock (None for as fast as possible).
+        until (float): The clock time when the simulation ends (None for endless).
+        batch (bool): If True, the due devices are generated per class with gen_msg_batch (otherwise one gen_msg call each).
+        max_batch (int): The maximum number of due devices generated together.
+
+    Methods:
+        add(dev: IoTDevice, delay: float = None) -> None: Schedules a device (after a random delay of up to 10 seconds by default).
+        at(delay: float, action: str, dev: IoTDevice) -> None: Starts ('start') or stops ('stop') a device after a delay.
+        requested_rate() -> float: Returns the publishing rate (in messages per second) requested by the active devices.
+        get_stats() -> Dict[str, float]: Returns the achieved and requested rates and the jitter percentiles.
+        stop() -> None: Stops the simulation.
+    """
+    # Initialization
+    def __init__(self, pool, devices=[], batch=True, max_batch=1000, clock=None, speed=None, until=None):
+        Thread.__init__(self, name='simulator', daemon=True)
+        self.pool = pool
+        self.heap = []
+        self.order = 0
+        self.devices = {}
+        self.lock = Condition()
+        self.active = True
+        self.batch = batch
+        self.max_batch = max_batch
+        # Clock
+        self.clock = get_clock() if clock is None else clock
+        self.speed = speed
+        self.until = until
+        self.start_t = self.clock.time()
+        # Stats
+        self.published = 0
+        self.jitter = LatencyHistogram()
+        self.start_ts = time.perf_counter()
+        for dev in devices : self.add(dev)
+
+    # Schedule device
+    def add(self, dev: IoTDevice, delay: float = None) -> None :
+        if delay is None : delay = random.uniform(0,10) # as tic_behavior, start within 10 seconds
+        with self.lock :
+            self.devices[dev.uuid] = dev
+            self.push(self.clock.time() + delay, dev)
+            self.lock.notify()
+        self.pool.publish(dev.uuid, dev.topic, dev.encode(gen_header(dev.dev_class,dev.topic,dev.uuid,category='CONNECTED')))
+
+    # Schedule test case event
+    def at(self, delay: float, action: str, dev: IoTDevice) -> None :
+        with self.lock :
+            self.push(self.clock.time() + delay, (action, dev))
+            self.lock.notify()
+
+    # Push heap entry (the order breaks ties between devices or events due at the same time)
+    def push(self, due: float, entry: Any) -> None :
+        heapq.heappush(self.heap, (due, self.order, entry))
+        self.order += 1
+
+    # Wall time to wait until a clock time
+    def wall_delay(self, due: float) -> float :
+        if not self.clock.virtual : return due - self.clock.time()
+        if self.speed is None : return 0.0
+        return self.start_ts + (due - self.start_t)/self.speed - time.perf_counter()
+
+    # Requested publishing rate
+    def requested_rate(self) -> float :
+        return sum(1/dev.interval for dev in list(self.devices.values()) if dev.active)
+
+    # Rates and jitter
+    def get_stats(self) -> Dict[str, float] :
+        elapsed = time.perf_counter() - self.start_ts
+        return {
+            'devices': len(self.devices),
+            'published': self.published,
+            'simulated_time': self.clock.time() - self.start_t,
+            'achieved_rate': self.published/elapsed if elapsed > 0 else 0.0,
+            'requested_rate': self.requested_rate(),
+            'jitter_p50': self.jitter.quantile(0.5),
+            'jitter_p99': self.jitter.quantile(0.99),
+            'jitter_max': self.jitter.max
+        }
+
+    # Stop simulation
+    def stop(self) -> None :
+        with self.lock :
+            self.active = False
+            self.lock.notify()
+        self.join()
+
+    # Scheduler loop
+    def run(self) -> None :
+        self.start_ts, self.start_t = time.perf_counter(), self.clock.time()
+        while True :
+            # Wait for the next device to be due
+            with self.lock :
+                while self.active :
+                    if not self.heap :
+                        self.lock.wait()
+                        continue
+                    if self.until is not None and self.heap[0][0] > self.until :
+                        self.active = False
+                        break
+                    remaining = self.wall_delay(self.heap[0][0])
+                    if remaining <= 0 : break
+                    self.lock.wait(remaining)
+                if not self.active : return
+                # A virtual clock jumps to the next due time
+                if self.clock.virtual : self.clock.advance_to(self.heap[0][0])
+                # Pop the due devices (grouped by class) and events
+                now, due_devs, events = self.clock.time(), {}, []
+                for _ in range(self.max_batch if self.batch else 1) :
+                    if not self.heap or self.heap[0][0] > now : break
+                    due, _, dev = heapq.heappop(self.heap)
+                    if isinstance(dev, tuple) :
+                        events.append(dev)
+                        continue
+                    # Fixed-rate schedule (inactive devices are checked again one interval later)
+                    self.push(due + dev.interval, dev)
+                    if dev.active : due_devs.setdefault(dev.__class__, []).append((due, dev))
+            # Test case events
+            for action, dev in events :
+                if action == 'stop' : dev.active = False
+                else : self.add(dev)
+            # Generate and publish messages
+            for dev_cls, entries in due_devs.items() :
+                devs = [dev for _, dev in entries]
+                msgs = dev_cls.gen_msg_batch(devs) if self.batch else [dev.gen_msg() for dev in devs]
+                for (due, dev), msg in zip(entries, msgs) :
+                    self.pool.publish(dev.uuid, dev.topic, dev.encode(msg))
+                    self.published += 1
+                    self.jitter.observe(-self.wall_delay(due))
+
+#######################
+######## FLEETS #######
+#######################
+
+# Clone a device with a new uuid
+def clone_device(dev: IoTDevice, devuuid: str = '') -> IoTDevice :
+    """Creates a device of the same class, data generation parameters and current state as another one.
+    The ground truths the device reads are shared, while its own state is copied.
+
+    Parameters
+    ----------
+    dev (IoTDevice): The device to clone (not started).
+    devuuid (str): The uuid of the clone (a random one if empty).
+
+    Returns
+    -------
+    IoTDevice: The clone.
+    """
+    clone = dev.__class__.__new__(dev.__class__)
+    Thread.__init__(clone)
+    for name, value in dev.__dict__.items() :
+        if name.startswith('_') : continue # thread internals
+        clone.__dict__[name] = value if isinstance(value, GroundTruth) else copy.deepcopy(value)
+    clone.uuid = gen_uuid() if devuuid=='' else devuuid
+    return clone
+
+# Build fleet
+def build_fleet(n_devices: int) -> Tuple[List[IoTDevice], Dict[str, GroundTruth]] :
+    """Builds a fleet with the test environment initial devices, cloned (round robin) up to n_devices.
+
+    Parameters
+    ----------
+    n_devices (int): The number of devices.
+
+    Returns
+    -------
+    list: The devices (not started).
+    dict: The ambient variables ground truths ('indoors' and 'outdoors').
+    """
+    devices, ground_truths = build_initial_devices()
+    templates = list(devices)
+    devices = devices[:n_devices]
+    while len(devices) < n_devices : devices.append(clone_device(templates[len(devices) % len(templates)]))
+    return devices, ground_truths
+
+######################
+######## MAIN ########
+######################
+def main() :
+    parser = argparse.ArgumentParser(description='Simulate large fleets of IoT devices from a single scheduler.')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=None, help='simulation time in seconds (endless if not given)')
+    parser.add_argument('--report', type=float, default=10, help='time in seconds between reports')
+    parser.add_argument('--no-batch', action='store_true', help='generate each message with its own gen_data call')
+    parser.add_argument('--scenario', action='store_true', help='simulate the test environment test cases instead of a fleet')
+    parser.add_argument('--virtual', action='store_true', help='follow a virtual clock instead of the wall clock')
+    parser.add_argument('--speed', default='max', help='simulated seconds per wall second with --virtual (or max)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random data generation')
+    parser.add_argument('--transport', choices=['mqtt','local'], default='mqtt', help='local only reaches subscribers in this process')
+    args = parser.parse_args()
+    set_transport(args.transport)
+
+    # Console logging limited to summaries
+    configure_logging(level=logging.INFO, colored=True)
+
+    # Clock and random generator (set before building the devices, so that their uuids are reproducible too)
+    if args.seed is not None : random.seed(args.seed)
+    clock = VirtualClock() if args.virtual else get_clock()
+    set_clock(clock)
+
+    # Devices are driven by the simulator, ground truths catch up with the clock when read
+    if args.scenario : devices, events = testenv_scenario()
+    else : (devices, _), events = build_fleet(args.devices), []
+    pool = ConnectionPool(args.connections)
+    pool.connect()
+    simulator = Simulator(pool, devices, batch=not args.no_batch, clock=clock, speed=None if args.speed == 'max' else float(args.speed),
+                          until=None if args.duration is None else clock.time() + args.duration)
+    for t, action, dev in events : simulator.at(t, action, dev)
+    simulator.start()
+
+    # Periodic reports
+    while simulator.is_alive() :
+        simulator.join(args.report)
+        st = simulator.get_stats()
+        print(f'SIMULATOR <Devices={st["devices"]} | Published={st["published"]} | Simulated={st["simulated_time"]:.0f}s | Rate={st["achieved_rate"]:.0f}/{st["requested_rate"]:.0f} msgs/s | '
+              f'Jitter p50={st["jitter_p50"]*1000:.1f}ms p99={st["jitter_p99"]*1000:.1f}ms max={st["jitter_max"]*1000:.1f}ms>', kind='summary')
+    simulator.stop()
+    pool.disconnect()
+
+if __name__ == "__main__":
+    main()
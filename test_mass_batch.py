@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" MassBatch tests
+Checks the batched MASS distance profiles (MassBatch) and the closest devices search built on them
+(closest_devs_rows) against stumpy mass, called on one series at a time as the search used to do.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+import numpy as np
+import pytest
+from stumpy import mass
+from aux import MassBatch, closest_devs_rows
+# ---------------------------------------------------------------------------
+
+M = 20
+
+# Minimum stumpy mass distance to each series (inf if shorter than the query)
+def reference_min_dists(query, series, normalize):
+    return np.array([np.min(mass(query, values, normalize=normalize)) if values.size >= query.size else np.inf for values in series])
+
+# Closest series as a loop over stumpy mass (first one wins ties, -1 if none)
+def reference_closest(query, series, normalize):
+    best, closest = np.inf, -1
+    for j, values in enumerate(series) :
+        if values.size < query.size : continue
+        dist = np.min(mass(query, values, normalize=normalize))
+        if dist < best : best, closest = dist, j
+    return closest
+
+# Random series of random lengths, some of them shorter than the query and some far from zero
+def random_series(rng, n=12):
+    series = [rng.normal(size=rng.integers(M//2, 6*M)) for _ in range(n)]
+    series[0] = rng.normal(size=4*M)
+    series[1] = series[1][:M-1]
+    series[2] = rng.normal(size=2*M) + 1e4
+    return series
+
+# Distances equal up to the FFT rounding (of MassBatch and of stumpy), compared squared as it is absolute on them
+def assert_dists_close(actual, expected):
+    np.testing.assert_allclose(actual**2, expected**2, rtol=1e-6, atol=1e-5)
+
+# Minimum distances on random series
+@pytest.mark.parametrize('normalize', [False, True])
+def test_min_dists_random(normalize):
+    rng = np.random.default_rng(0)
+    for _ in range(5) :
+        series = random_series(rng)
+        batch = MassBatch(series, M, normalize)
+        for query in [rng.normal(size=M), series[0][:M], series[2][-M:]] :
+            expected = reference_min_dists(query, series, normalize)
+            assert_dists_close(batch.min_dists(query), expected)
+
+# Minimum distances on constant windows (z-normalized: 0 between constant ones, sqrt(m) to a varying one)
+def test_min_dists_constant():
+    rng = np.random.default_rng(1)
+    series = [np.full(3*M, 5.0), np.concatenate([rng.normal(size=M), np.full(2*M, -2.0)]), rng.normal(size=3*M)]
+    for normalize in [False, True] :
+        batch = MassBatch(series, M, normalize)
+        for query in [np.full(M, 5.0), rng.normal(size=M)] :
+            expected = reference_min_dists(query, series, normalize)
+            assert_dists_close(batch.min_dists(query), expected)
+
+# Ties between duplicated series and series shorter than the query
+@pytest.mark.parametrize('normalize', [False, True])
+def test_closest_ties(normalize):
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=4*M)
+    series = [values[:M-1], values + 3.0, values, values.copy(), values[M:]]
+    batch = MassBatch(series, M, normalize)
+    query = values[M:2*M]
+    assert batch.closest(query) == reference_closest(query, series, normalize)
+    assert batch.closest(query) == (1 if normalize else 2)
+    # Near ties within the FFT rounding are resolved exactly
+    series = [values + 1e-7, values]
+    assert MassBatch(series, M).closest(query) == reference_closest(query, series, False) == 1
+
+# No series as long as the query
+def test_closest_none():
+    rng = np.random.default_rng(3)
+    series = [rng.normal(size=M-1), rng.normal(size=M//2)]
+    batch = MassBatch(series, M)
+    assert np.all(np.isinf(batch.min_dists(rng.normal(size=M))))
+    assert batch.closest(rng.normal(size=M)) == reference_closest(rng.normal(size=M), series, False) == -1
+    assert MassBatch([], M).closest(rng.normal(size=M)) == -1
+
+# Closest devices search against the loop over stumpy mass
+@pytest.mark.parametrize('normalize', [False, True])
+def test_closest_devs_rows(normalize):
+    rng = np.random.default_rng(4)
+    series = random_series(rng, 30)
+    series[3] = series[0].copy()
+    labels = [f'Class{j%4}/uuid{j}' for j in range(len(series))]
+    queries = np.array([rng.normal(size=M) for _ in range(5)] + [series[0][5:5+M], series[2][:M]])
+    arrays = {'queries': queries, 'values': np.concatenate(series), 'offsets': np.cumsum([0] + [values.size for values in series])}
+    votes = closest_devs_rows(arrays, range(len(queries)), labels, normalize=normalize)
+    expected = [reference_closest(query, series, normalize) for query in queries]
+    assert votes == [{labels[j]: 1} for j in expected]
@@ -82,112 +82,96 @@ safetyenv_outdoor_vars = { #(mean, standard deviation)
 }
 
 ######################
-######## MAIN ########
+####### DEVICES ######
 ######################
-def main() :
-    '''
-    # DEMO - Reduced number of devices
-    # SAFETY / ENVIRONMENTAL - INITIAL DEVICES
-    # Ambient variables time series
-    safetyenv_indoors = GroundTruth(safetyenv_indoor_vars)
-    safetyenv_outdoors = GroundTruth(safetyenv_outdoor_vars)
-    safetyenv_indoors.start()
-    safetyenv_outdoors.start()
+def build_initial_devices() -> Tuple[List[IoTDevice], Dict[str, GroundTruth]] :
+    """Builds (without starting them) the devices initially present in the plant, which are 
+    also described in the initial data of the Knowledge Graph.
 
-    # Indoors Monitoring
-    indoors_airquality = AirQuality(safetyenv_indoors,devuuid="indoors_airquality",print_logs=True)
-    indoors_airquality.start()
-    NoiseSensor(devuuid="7fc17e8f-1e1c-43f8-a2d1-9ff4bcfbf9ff").start()
-    SmokeSensor(devuuid="5a84f26b-bf77-42d3-ab8a-83a214112844").start()
-    SeismicSensor(devuuid="4f1f6ac2-f565-42af-a186-db17f7ed94c2").start()
+    Returns:
+        list: The initial devices.
+        dict: The ambient variables ground truths ('indoors' and 'outdoors').
+    """
+    devices = []
 
-    # Outdoors Monitoring
-    AirQuality(safetyenv_outdoors,devuuid="outdoors_airquality").start()
-    RainSensor(safetyenv_outdoors,devuuid="70a15d0b-f6d3-4833-b929-74abdff69fa5").start()
-    WindSensor(safetyenv_outdoors,devuuid="f41db548-3a85-491e-ada6-bab5c106ced6").start()
-
-    # CASE 1: Known device disappears and new, similar device appears
-    # If a known device disappears and a new one with similar characteristics appears, 
-    # this could justify replacing the old device with the new one. 
-    # Similar characteristics refer to a few modifications in the device's modules or attributes, 
-    # and the data it reports having a similar behavior. 
-    # In this case, the similarity between the two devices should be quite high.
-
-    time.sleep(90) # after 30 secs old device disappears and new one appears
-    indoors_airquality.active = False # stop indoors air quality
-    time.sleep(10)
-    indoors_airqualitysimp = AirQualitySimplified(safetyenv_indoors,devuuid='indoors_airqualitysimp',print_logs=True)
-    indoors_airqualitysimp.start() # start simplified indoors air quality
-
-    '''
     # PRODUCTION LINE - INITIAL DEVICES
     # Initialization Task
-    TagScanner(devuuid="8a40d136-8401-41bd-9845-7dc8f28ea582").start()
-    ProductionControl(devuuid="3d193d4c-ba9c-453e-b98b-cec9546b9182").start()
+    devices.append(TagScanner(devuuid="8a40d136-8401-41bd-9845-7dc8f28ea582"))
+    devices.append(ProductionControl(devuuid="3d193d4c-ba9c-453e-b98b-cec9546b9182"))
 
     # Underpan Configuration Task
-    PickUpRobot(prod_underpan_params,devuuid="5f3333b9-8292-4371-b5c5-c1ec21d0b652").start()
-    PieceDetector(prod_underpan_params,devuuid="45d289e7-4da6-4c10-aa6e-2c1d48b223e2").start()
+    devices.append(PickUpRobot(prod_underpan_params,devuuid="5f3333b9-8292-4371-b5c5-c1ec21d0b652"))
+    devices.append(PieceDetector(prod_underpan_params,devuuid="45d289e7-4da6-4c10-aa6e-2c1d48b223e2"))
 
     # Body Configuration Task
     bodyconfig_pickuprob = PickUpRobot(prod_body_params,devuuid="bodyconfig_pickuprob")
-    bodyconfig_pickuprob.start()
-    ClampingRobot(prod_body_params,devuuid="5ee2149f-ef6e-402b-937e-8e04a2133cdd").start()
-    DrillingRobot(prod_body_params,devuuid="98247600-c4fe-4728-bda6-ed8fadf81af2").start()
-    PieceDetector(prod_body_params,devuuid="d7295016-4a54-4c98-a4c1-4f0c7f7614b5").start()
-    PoseDetector(prod_body_params,devuuid="2c91bd9d-bdfc-4a6b-b465-575f43897d59").start()
+    devices.append(bodyconfig_pickuprob)
+    devices.append(ClampingRobot(prod_body_params,devuuid="5ee2149f-ef6e-402b-937e-8e04a2133cdd"))
+    devices.append(DrillingRobot(prod_body_params,devuuid="98247600-c4fe-4728-bda6-ed8fadf81af2"))
+    devices.append(PieceDetector(prod_body_params,devuuid="d7295016-4a54-4c98-a4c1-4f0c7f7614b5"))
+    devices.append(PoseDetector(prod_body_params,devuuid="2c91bd9d-bdfc-4a6b-b465-575f43897d59"))
 
     # Vehicle Scanning
-    ConfigurationScanner(devuuid="0d451573-243e-423b-bfab-0f3117f88bd0").start()
-    FaultNotifier(devuuid="f1b43cb8-127a-43b5-905d-9f145171079es").start()
+    devices.append(ConfigurationScanner(devuuid="0d451573-243e-423b-bfab-0f3117f88bd0"))
+    devices.append(FaultNotifier(devuuid="f1b43cb8-127a-43b5-905d-9f145171079es"))
 
     # Window Milling
-    PickUpRobot(prod_window_params,devuuid="windowmilling_pickuprob").start()
-    MillingRobot(prod_window_params,devuuid="5ce94c31-3004-431e-97b3-c8f779fb180d").start()
-    PoseDetector(prod_window_params,devuuid="1df9566a-2f06-48f0-975f-28058c6784c0").start()
+    devices.append(PickUpRobot(prod_window_params,devuuid="windowmilling_pickuprob"))
+    devices.append(MillingRobot(prod_window_params,devuuid="5ce94c31-3004-431e-97b3-c8f779fb180d"))
+    devices.append(PoseDetector(prod_window_params,devuuid="1df9566a-2f06-48f0-975f-28058c6784c0"))
 
     # Quality Check
-    QualityScanner(devuuid="fd9ccbb2-be41-4507-85ac-a431fe886541").start()
-    FaultNotifier(devuuid="5bb02f4b-0dfe-45d4-8a87-e902e6ea0bf6").start()
+    devices.append(QualityScanner(devuuid="fd9ccbb2-be41-4507-85ac-a431fe886541"))
+    devices.append(FaultNotifier(devuuid="5bb02f4b-0dfe-45d4-8a87-e902e6ea0bf6"))
 
     # Artificial Repair
-    RepairControl(devuuid="4525aa12-06fb-484f-be38-58afb33e1558").start()
+    devices.append(RepairControl(devuuid="4525aa12-06fb-484f-be38-58afb33e1558"))
 
     # Product Completion
-    PickUpRobot(prod_completion_params,devuuid="ae5e4ad3-bd59-4dc8-b242-e72747d187d4").start()
-    PoseDetector(prod_completion_params,devuuid="f2d73019-1e87-48a7-b93c-af0a4fc17994").start()
+    devices.append(PickUpRobot(prod_completion_params,devuuid="ae5e4ad3-bd59-4dc8-b242-e72747d187d4"))
+    devices.append(PoseDetector(prod_completion_params,devuuid="f2d73019-1e87-48a7-b93c-af0a4fc17994"))
 
     # Tasks Connectors
-    ConveyorBelt(prod_convbelt_1,devuuid="fbeaa5f3-e532-4e02-8429-c77301f46470").start()
-    ConveyorBelt(prod_convbelt_2,devuuid="f169a965-bb15-4db3-97cd-49b5b641a9fe").start()
-    ConveyorBelt(prod_convbelt_3,devuuid="3140ce5c-0d08-4aff-9bb4-14a9e6a33d12").start()
-    ConveyorBelt(prod_convbelt_4,devuuid="a6f65d7a-019a-4723-9b81-fb4a163fa23a").start()
-    ConveyorBelt(prod_convbelt_5,devuuid="f342e60b-6a54-4f20-8874-89a550ebc75c").start()
+    devices.append(ConveyorBelt(prod_convbelt_1,devuuid="fbeaa5f3-e532-4e02-8429-c77301f46470"))
+    devices.append(ConveyorBelt(prod_convbelt_2,devuuid="f169a965-bb15-4db3-97cd-49b5b641a9fe"))
+    devices.append(ConveyorBelt(prod_convbelt_3,devuuid="3140ce5c-0d08-4aff-9bb4-14a9e6a33d12"))
+    devices.append(ConveyorBelt(prod_convbelt_4,devuuid="a6f65d7a-019a-4723-9b81-fb4a163fa23a"))
+    devices.append(ConveyorBelt(prod_convbelt_5,devuuid="f342e60b-6a54-4f20-8874-89a550ebc75c"))
     
     # SAFETY / ENVIRONMENTAL - INITIAL DEVICES
     # Ambient variables time series
     safetyenv_indoors = GroundTruth(safetyenv_indoor_vars)
     safetyenv_outdoors = GroundTruth(safetyenv_outdoor_vars)
-    safetyenv_indoors.start()
-    safetyenv_outdoors.start()
 
     # Indoors Monitoring
     indoors_airquality = AirQuality(safetyenv_indoors,devuuid="indoors_airquality",print_logs=True)
-    indoors_airquality.start()
-    NoiseSensor(devuuid="7fc17e8f-1e1c-43f8-a2d1-9ff4bcfbf9ff").start()
-    SmokeSensor(devuuid="5a84f26b-bf77-42d3-ab8a-83a214112844").start()
-    SeismicSensor(devuuid="4f1f6ac2-f565-42af-a186-db17f7ed94c2").start()
+    devices.append(indoors_airquality)
+    devices.append(NoiseSensor(devuuid="7fc17e8f-1e1c-43f8-a2d1-9ff4bcfbf9ff"))
+    devices.append(SmokeSensor(devuuid="5a84f26b-bf77-42d3-ab8a-83a214112844"))
+    devices.append(SeismicSensor(devuuid="4f1f6ac2-f565-42af-a186-db17f7ed94c2"))
 
     # Outdoors Monitorization
-    AirQuality(safetyenv_outdoors,devuuid="outdoors_airquality").start()
-    RainSensor(safetyenv_outdoors,devuuid="70a15d0b-f6d3-4833-b929-74abdff69fa5").start()
-    WindSensor(safetyenv_outdoors,devuuid="f41db548-3a85-491e-ada6-bab5c106ced6").start()
+    devices.append(AirQuality(safetyenv_outdoors,devuuid="outdoors_airquality"))
+    devices.append(RainSensor(safetyenv_outdoors,devuuid="70a15d0b-f6d3-4833-b929-74abdff69fa5"))
+    devices.append(WindSensor(safetyenv_outdoors,devuuid="f41db548-3a85-491e-ada6-bab5c106ced6"))
 
     # Safety Alarms
-    IndoorsAlarm(devuuid="4d36d0c4-891f-44ec-afe1-278258058944").start()
-    OutdoorsAlarm(devuuid="b60108c2-46a3-4b67-9b8d-38586cb3039d").start()
+    devices.append(IndoorsAlarm(devuuid="4d36d0c4-891f-44ec-afe1-278258058944"))
+    devices.append(OutdoorsAlarm(devuuid="b60108c2-46a3-4b67-9b8d-38586cb3039d"))
+
+    return devices, {'indoors': safetyenv_indoors, 'outdoors': safetyenv_outdoors}
 
-    # TEST CASES
+def testenv_scenario() -> Tuple[List[IoTDevice], List[Tuple[float, str, IoTDevice]]] :
+    """Builds (without starting them) the initial devices and the timeline of the test cases.
+
+    Returns:
+        list: The initial devices.
+        list: The (time in seconds, 'start' | 'stop', device) events of the test cases, in time order.
+    """
+    devices, ground_truths = build_initial_devices()
+    safetyenv_indoors = ground_truths['indoors']
+    indoors_airquality = next(dev for dev in devices if dev.uuid == 'indoors_airquality')
+    events = []
 
     # CASE 1: New, slightly different class device replaces inactive device.
 
@@ -197,11 +181,9 @@ def main() :
     # In this case similarity should be quite high, which could justify applying a simple
     # replacement of the old device by the new device.
 
-    time.sleep(15) # after 2 mins old device disappears and new one appears
-    indoors_airquality.active = False # stop indoors air quality
-    time.sleep(15)
+    events.append((15, 'stop', indoors_airquality)) # after 15 secs old device disappears
     indoors_airqualitymod = AirQualitySimplified(safetyenv_indoors,devuuid='indoors_airqualitysimp',print_logs=True)
-    indoors_airqualitymod.start() # start modified indoors air quality
+    events.append((30, 'start', indoors_airqualitymod)) # and 15 secs later the modified one appears
 
     # CASE 2: Complementary device appears in a task.
     # In this case, a complementary device appears in a task. 
@@ -212,9 +194,8 @@ def main() :
     # An example of this scenario is the addition of a robotic arm to speed up a task, 
     # where the new robotic arm shows similar behavior to the one it is complementing.
 
-    time.sleep(30) # after 30 seconds a complementary pickup robot is added to bodyconf task
     bodyconfig_pickuprob2 = PickUpRobot(prod_body_params,devuuid='bodyconfig_pickuprob2',print_logs=False)
-    bodyconfig_pickuprob2.start()
+    events.append((60, 'start', bodyconfig_pickuprob2)) # after 30 more seconds a complementary pickup robot is added to bodyconf task
 
     # CASE 3: Completely unknown device appears.
     # In this case, a completely unknown device appears. 
@@ -231,5 +212,61 @@ def main() :
     # To do this, it may be necessary to include more information in the device's description, such as which devices it interacts with. 
     # One option could be to check which devices are subscribed to other devices' topics to create more complex relations.
 
+    return devices, events
+
+######################
+######## MAIN ########
+######################
+def main() :
+    # Asynchronous colored logging (set colored=False / rate_limit to reduce console load)
+    configure_logging(level=logging.DEBUG, colored=True, rate_limit=None)
+
+    '''
+    # DEMO - Reduced number of devices
+    # SAFETY / ENVIRONMENTAL - INITIAL DEVICES
+    # Ambient variables time series
+    safetyenv_indoors = GroundTruth(safetyenv_indoor_vars)
+    safetyenv_outdoors = GroundTruth(safetyenv_outdoor_vars)
+    safetyenv_indoors.start()
+    safetyenv_outdoors.start()
+
+    # Indoors Monitoring
+    indoors_airquality = AirQuality(safetyenv_indoors,devuuid="indoors_airquality",print_logs=True)
+    indoors_airquality.start()
+    NoiseSensor(devuuid="7fc17e8f-1e1c-43f8-a2d1-9ff4bcfbf9ff").start()
+    SmokeSensor(devuuid="5a84f26b-bf77-42d3-ab8a-83a214112844").start()
+    SeismicSensor(devuuid="4f1f6ac2-f565-42af-a186-db17f7ed94c2").start()
+
+    # Outdoors Monitoring
+    AirQuality(safetyenv_outdoors,devuuid="outdoors_airquality").start()
+    RainSensor(safetyenv_outdoors,devuuid="70a15d0b-f6d3-4833-b929-74abdff69fa5").start()
+    WindSensor(safetyenv_outdoors,devuuid="f41db548-3a85-491e-ada6-bab5c106ced6").start()
+
+    # CASE 1: Known device disappears and new, similar device appears
+    # If a known device disappears and a new one with similar characteristics appears, 
+    # this could justify replacing the old device with the new one. 
+    # Similar characteristics refer to a few modifications in the device's modules or attributes, 
+    # and the data it reports having a similar behavior. 
+    # In this case, the similarity between the two devices should be quite high.
+
+    time.sleep(90) # after 30 secs old device disappears and new one appears
+    indoors_airquality.active = False # stop indoors air quality
+    time.sleep(10)
+    indoors_airqualitysimp = AirQualitySimplified(safetyenv_indoors,devuuid='indoors_airqualitysimp',print_logs=True)
+    indoors_airqualitysimp.start() # start simplified indoors air quality
+
+    '''
+    # INITIAL DEVICES (ground truths catch up with the clock when read, their threads keep them updated meanwhile)
+    devices, events = testenv_scenario()
+    for ground_truth in {id(dev.gt): dev.gt for dev in devices if hasattr(dev,'gt')}.values() : ground_truth.start()
+    for dev in devices : dev.start()
+
+    # TEST CASES (in real time, see simulator.py to run them faster than real time)
+    tic = time.perf_counter()
+    for t, action, dev in events :
+        time.sleep(max(0, t-(time.perf_counter()-tic)))
+        if action == 'stop' : dev.active = False
+        else : dev.start()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file